@@ -0,0 +1,192 @@
+"""Middleware ASGI de compressão negociada (brotli/gzip).
+
+- Escolhe a codificação pelo header Accept-Encoding (br tem prioridade quando
+  a lib `brotli` está instalada; gzip sempre disponível via zlib).
+- Só comprime respostas acima de `minimum_size` bytes e de tipos compressíveis
+  (JSON, CSV, HTML...). Imagens, respostas parciais (Range) e respostas que já
+  têm Content-Encoding passam intactas.
+- Suporta respostas em streaming (StreamingResponse): cada chunk é comprimido
+  à medida que chega, sem acumular o corpo inteiro em memória.
+"""
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - dependência opcional
+    brotli = None
+
+
+# Tipos que já vêm comprimidos (ou que não compensam)
+_SKIP_PREFIXES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/octet-stream",
+    "text/event-stream",
+)
+
+
+class _GzipCompressor:
+    def __init__(self, level: int) -> None:
+        # wbits=31 -> formato gzip (header + trailer)
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.compress(data)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int) -> None:
+        self._c = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Retorna 'br', 'gzip' ou None conforme Accept-Encoding (respeitando q=0)."""
+    aceitas: dict[str, float] = {}
+    for parte in (accept_encoding or "").split(","):
+        token, _, params = parte.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        aceitas[token] = q
+
+    def qualidade(enc: str) -> float:
+        return aceitas.get(enc, aceitas.get("*", 0.0))
+
+    if brotli is not None and qualidade("br") > 0:
+        return "br"
+    if qualidade("gzip") > 0:
+        return "gzip"
+    return None
+
+
+class CompressionMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def new_compressor(self, encoding: str):
+        if encoding == "br":
+            return _BrotliCompressor(self.brotli_quality)
+        return _GzipCompressor(self.gzip_level)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send) -> None:
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor = None
+
+    def _compressible(self, headers: MutableHeaders) -> bool:
+        if self.initial_message.get("status", 200) in (204, 206, 304):
+            return False
+        if "content-encoding" in headers or "content-range" in headers:
+            return False
+        content_type = (headers.get("content-type") or "").lower()
+        return not content_type.startswith(_SKIP_PREFIXES)
+
+    async def send(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # Atrasar o start até sabermos o tamanho do primeiro chunk
+            self.initial_message = message
+            return
+        if message_type != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            headers = MutableHeaders(raw=self.initial_message["headers"])
+            if not self._compressible(headers) or (len(body) < self.middleware.minimum_size and not more_body):
+                self.passthrough = True
+                await self._send(self.initial_message)
+                await self._send(message)
+                return
+
+            self.compressor = self.middleware.new_compressor(self.encoding)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if "etag" in headers:
+                # ETag forte deixa de valer para a representação comprimida
+                etag = headers["etag"]
+                if not etag.startswith("W/"):
+                    headers["ETag"] = f"W/{etag}"
+
+            if not more_body:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(data))
+                await self._send(self.initial_message)
+                await self._send({"type": "http.response.body", "body": data})
+                return
+
+            if "content-length" in headers:
+                del headers["Content-Length"]
+            await self._send(self.initial_message)
+            await self._send({
+                "type": "http.response.body",
+                "body": self.compressor.compress(body),
+                "more_body": True,
+            })
+            return
+
+        if self.passthrough:
+            await self._send(message)
+            return
+
+        data = self.compressor.compress(body)
+        if not more_body:
+            data += self.compressor.finish()
+        await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
@@ -9,6 +9,27 @@ class Settings(BaseSettings):
     JWT_SECRET: str = "a_very_secret_key_that_should_be_changed"
     JWT_ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
+
+    # Compressão de respostas (bytes mínimos para comprimir; 0 desativa o middleware)
+    COMPRESSION_MIN_SIZE: int = 1024
+
+    # Upload de imagens de produtos (tamanho máximo em MB)
+    MEDIA_MAX_UPLOAD_MB: int = 8
+
+    # Fila de relatórios em background (workers simultâneos, jobs aguardando, pasta do cache)
+    REPORT_WORKERS: int = 2
+    REPORT_QUEUE_MAX: int = 50
+    REPORTS_DIR: str = "reports_cache"
+
+    # Idempotency-Key (horas que a resposta fica guardada; tamanho máximo da resposta guardada)
+    IDEMPOTENCIA_TTL_HORAS: int = 24
+    IDEMPOTENCIA_MAX_CORPO: int = 256 * 1024
+
+    # Compactação do change-log de sync (segundos entre execuções; 0 desativa)
+    ALTERACOES_COMPACTAR_SEGUNDOS: int = 3600
+
+    # Isolamento por tenant: consulta ORM sem tenant vinculado numa requisição falha (em vez de só logar)
+    TENANT_ESCOPO_ESTRITO: bool = False
     
     # Railway environment detection
     ENVIRONMENT: str = "development"
@@ -9,6 +9,7 @@ from sqlalchemy import select
 
 from app.core.config import settings
 from app.core.security import verify_password
+from app.core.tenant import TODOS_TENANTS, vincular
 from app.db.database import get_db_session
 from app.db.models import User, Tenant
 
@@ -38,7 +39,8 @@ async def get_current_admin_user(
     except JWTError:
         raise credentials_exception
 
-    result = await db.execute(select(User).where(User.id == user_id))
+    # O usuário do token pode ser de outro tenant que o do header
+    result = await db.execute(select(User).where(User.id == user_id).execution_options(**TODOS_TENANTS))
     user = result.scalar_one_or_none()
     if not user:
         raise credentials_exception
@@ -56,11 +58,15 @@ async def get_tenant_id(
     """Resolve o tenant atual via header X-Tenant-Id.
 
     Fase 1 (compatível): se header não vier ou for inválido, cai para o primeiro tenant do banco.
+    O tenant fica vinculado à sessão da requisição: as consultas ORM dela passam a
+    filtrar por tenant_id (app/core/tenant.py).
     """
     if x_tenant_id:
         try:
-            return uuid.UUID(x_tenant_id)
-        except Exception:
+            tenant_id = uuid.UUID(x_tenant_id)
+            vincular(db, tenant_id)
+            return tenant_id
+        except ValueError:
             pass
 
     result = await db.execute(select(Tenant).order_by(Tenant.created_at))
@@ -68,4 +74,5 @@ async def get_tenant_id(
     if not tenant:
         raise HTTPException(status_code=500, detail="Nenhum tenant configurado")
 
+    vincular(db, tenant.id)
     return tenant.id
@@ -0,0 +1,255 @@
+"""Middleware ASGI de Idempotency-Key para requisições que alteram dados.
+
+Quando o cliente manda o header Idempotency-Key num POST/PUT/PATCH/DELETE:
+- a chave (por tenant, header X-Tenant-Id) é procurada em pdv.idempotencia,
+  uma leitura pelo índice único (escopo, chave);
+- já concluída: a resposta gravada é devolvida de novo (header
+  Idempotency-Replayed: true), sem executar o endpoint;
+- em andamento (outra tentativa ainda rodando): 409;
+- mesma chave com outro método/caminho/corpo: 422;
+- nova: a chave é reservada (INSERT ... ON CONFLICT DO NOTHING), o endpoint
+  roda e a resposta (status < 500) é gravada comprimida por `ttl_horas`.
+  Respostas 5xx ou exceções liberam a chave para o cliente tentar de novo.
+
+Reservas de uma tentativa que morreu no meio (processo reiniciado) expiram em
+RESERVA_SEGUNDOS. Sem o header, nada muda. Se o banco falhar na consulta da
+chave, a requisição segue sem idempotência.
+"""
+import hashlib
+import json
+import logging
+import zlib
+from datetime import timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.db.models import ChaveIdempotencia
+from app.db.session import async_session
+
+
+logger = logging.getLogger(__name__)
+
+_METODOS = {"POST", "PUT", "PATCH", "DELETE"}
+RESERVA_SEGUNDOS = 300
+# A cada N reservas, apaga um lote de chaves expiradas
+_LIMPAR_A_CADA = 500
+_LOTE_LIMPEZA = 1000
+
+
+async def _ler_corpo(receive: Receive) -> tuple[bytes, Receive]:
+    """Lê o corpo inteiro e devolve um `receive` que o entrega de novo ao app."""
+    partes = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        partes.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    corpo = b"".join(partes)
+    entregue = False
+
+    async def receive_de_novo() -> Message:
+        nonlocal entregue
+        if not entregue:
+            entregue = True
+            return {"type": "http.request", "body": corpo, "more_body": False}
+        return await receive()
+
+    return corpo, receive_de_novo
+
+
+async def _responder(send: Send, status: int, corpo: bytes, content_type: Optional[str], extra=()) -> None:
+    headers = [(b"content-length", str(len(corpo)).encode())]
+    if content_type:
+        headers.append((b"content-type", content_type.encode("latin-1")))
+    headers.extend(extra)
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": corpo})
+
+
+async def _erro(send: Send, status: int, detail: str) -> None:
+    corpo = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    await _responder(send, status, corpo, "application/json")
+
+
+class _Captura:
+    """Repassa a resposta ao cliente e guarda uma cópia (até `max_corpo` bytes)."""
+
+    def __init__(self, send: Send, max_corpo: int) -> None:
+        self._send = send
+        self.max_corpo = max_corpo
+        self.status: Optional[int] = None
+        self.content_type: Optional[str] = None
+        self.partes: list[bytes] = []
+        self.tamanho = 0
+        self.completa = False
+        self.excedeu = False
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.status = message["status"]
+            self.content_type = Headers(raw=message.get("headers", [])).get("content-type")
+        elif message["type"] == "http.response.body":
+            corpo = message.get("body", b"")
+            self.tamanho += len(corpo)
+            if self.tamanho > self.max_corpo:
+                self.excedeu = True
+                self.partes = []
+            elif corpo:
+                self.partes.append(corpo)
+            if not message.get("more_body", False):
+                self.completa = True
+        await self._send(message)
+
+
+class IdempotencyMiddleware:
+    def __init__(self, app: ASGIApp, ttl_horas: int = 24, max_corpo: int = 256 * 1024) -> None:
+        self.app = app
+        self.ttl = timedelta(hours=ttl_horas)
+        self.max_corpo = max_corpo
+        self._reservas = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in _METODOS:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        chave = (headers.get("idempotency-key") or "").strip()
+        if not chave:
+            await self.app(scope, receive, send)
+            return
+        if len(chave) > 255:
+            await _erro(send, 400, "Idempotency-Key muito longa (máx. 255 caracteres)")
+            return
+        escopo = (headers.get("x-tenant-id") or "").strip()[:64]
+
+        corpo, receive = await _ler_corpo(receive)
+        digest = hashlib.sha256()
+        digest.update(f"{scope['method']} {scope['path']}?{scope.get('query_string', b'').decode('latin-1')}\n".encode())
+        digest.update(corpo)
+        hash_requisicao = digest.hexdigest()
+
+        try:
+            registro = await self._buscar(escopo, chave)
+            reservada = False
+            if registro is None:
+                reservada = await self._reservar(escopo, chave, hash_requisicao)
+                if not reservada:
+                    registro = await self._buscar(escopo, chave)
+        except Exception:
+            logger.exception("Idempotency-Key: falha ao consultar a chave; seguindo sem idempotência")
+            await self.app(scope, receive, send)
+            return
+
+        if not reservada:
+            if registro is not None and registro.hash_requisicao != hash_requisicao:
+                await _erro(send, 422, "Idempotency-Key já usada com outra requisição")
+            elif registro is None or registro.status_code is None:
+                await _erro(send, 409, "Requisição com esta Idempotency-Key ainda em andamento")
+            else:
+                await _responder(
+                    send,
+                    registro.status_code,
+                    zlib.decompress(registro.corpo) if registro.corpo else b"",
+                    registro.content_type,
+                    extra=[(b"idempotency-replayed", b"true")],
+                )
+            return
+
+        captura = _Captura(send, self.max_corpo)
+        try:
+            await self.app(scope, receive, captura.send)
+        except Exception:
+            await self._liberar(escopo, chave)
+            raise
+        if captura.status is not None and captura.status < 500 and captura.completa and not captura.excedeu:
+            await self._gravar(escopo, chave, captura)
+        else:
+            await self._liberar(escopo, chave)
+
+    async def _buscar(self, escopo: str, chave: str):
+        async with async_session() as db:
+            result = await db.execute(
+                select(
+                    ChaveIdempotencia.hash_requisicao,
+                    ChaveIdempotencia.status_code,
+                    ChaveIdempotencia.content_type,
+                    ChaveIdempotencia.corpo,
+                ).where(
+                    ChaveIdempotencia.escopo == escopo,
+                    ChaveIdempotencia.chave == chave,
+                    ChaveIdempotencia.expira_em > func.now(),
+                )
+            )
+            return result.first()
+
+    async def _reservar(self, escopo: str, chave: str, hash_requisicao: str) -> bool:
+        """Reserva a chave; retoma chaves expiradas. False se outra requisição já a tem."""
+        stmt = pg_insert(ChaveIdempotencia).values(
+            escopo=escopo,
+            chave=chave,
+            hash_requisicao=hash_requisicao,
+            expira_em=func.now() + timedelta(seconds=RESERVA_SEGUNDOS),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ChaveIdempotencia.escopo, ChaveIdempotencia.chave],
+            set_={
+                "hash_requisicao": stmt.excluded.hash_requisicao,
+                "status_code": None,
+                "content_type": None,
+                "corpo": None,
+                "expira_em": stmt.excluded.expira_em,
+                "created_at": func.now(),
+            },
+            where=ChaveIdempotencia.expira_em <= func.now(),
+        ).returning(ChaveIdempotencia.id)
+        async with async_session() as db:
+            reservada = (await db.execute(stmt)).first() is not None
+            self._reservas += 1
+            if self._reservas % _LIMPAR_A_CADA == 0:
+                expiradas = select(ChaveIdempotencia.id).where(ChaveIdempotencia.expira_em < func.now()).limit(_LOTE_LIMPEZA)
+                await db.execute(
+                    delete(ChaveIdempotencia)
+                    .where(ChaveIdempotencia.id.in_(expiradas))
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+        return reservada
+
+    async def _gravar(self, escopo: str, chave: str, captura: _Captura) -> None:
+        try:
+            async with async_session() as db:
+                await db.execute(
+                    update(ChaveIdempotencia)
+                    .where(ChaveIdempotencia.escopo == escopo, ChaveIdempotencia.chave == chave)
+                    .values(
+                        status_code=captura.status,
+                        content_type=(captura.content_type or "")[:100] or None,
+                        corpo=zlib.compress(b"".join(captura.partes)),
+                        expira_em=func.now() + self.ttl,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Idempotency-Key: falha ao gravar a resposta de %s", chave)
+
+    async def _liberar(self, escopo: str, chave: str) -> None:
+        try:
+            async with async_session() as db:
+                await db.execute(
+                    delete(ChaveIdempotencia).where(
+                        ChaveIdempotencia.escopo == escopo,
+                        ChaveIdempotencia.chave == chave,
+                        ChaveIdempotencia.status_code.is_(None),
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+        except Exception:
+            logger.exception("Idempotency-Key: falha ao liberar a chave %s", chave)
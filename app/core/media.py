@@ -0,0 +1,339 @@
+"""Armazenamento e entrega de mídia (imagens de produtos).
+
+- Upload gravado em streaming (chunks) fora do event loop, com limite de tamanho.
+- Nome do arquivo endereçado por conteúdo (`<produto_id>.<sha256[:16]><ext>`):
+  cada reenvio gera uma URL nova, então a URL pode ser cacheada para sempre.
+- Variantes (miniaturas WebP em tamanhos fixos) geradas em background com Pillow.
+- URLs das variantes derivadas do caminho da imagem original; variante ainda não
+  gerada (upload recente, imagem antiga) aponta para o original. Imagens antigas
+  sem variantes são convertidas em background no startup (`iniciar_backfill`).
+- `MediaFiles` serve /media com Cache-Control imutável, ETag e Range.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import uuid
+from typing import Optional
+
+import anyio
+from fastapi import HTTPException, UploadFile, status
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - dependência opcional
+    Image = None
+    ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
+MEDIA_URL_PREFIX = "/media"
+
+# Lado maior (px) de cada variante WebP gerada a partir do original
+VARIANT_SIZES = {
+    "thumb": 64,
+    "small": 256,
+    "medium": 800,
+}
+VARIANT_EXT = ".webp"
+
+ALLOWED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+UPLOAD_CHUNK_SIZE = 64 * 1024
+CONTENT_HASH_LEN = 16
+
+# '<stem>.<hash>[_<variante>].<ext>' -> nome endereçado por conteúdo
+_HASHED_NAME_RE = re.compile(r"\.([0-9a-f]{%d})(?:_[a-z]+)?\.[a-z0-9]+$" % CONTENT_HASH_LEN)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Arquivos antigos (<produto_id>.<ext>) mudam sem trocar de URL: revalidar sempre
+LEGACY_CACHE_CONTROL = "no-cache"
+
+
+def _looks_like_image(head: bytes) -> bool:
+    """Confere a assinatura (magic bytes) de JPEG, PNG ou WebP."""
+    return (
+        head.startswith(b"\xff\xd8\xff")
+        or head.startswith(b"\x89PNG\r\n\x1a\n")
+        or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+    )
+
+
+def media_abs_path(url_path: str) -> str:
+    """Converte '/media/produtos/...' no caminho absoluto dentro de MEDIA_DIR."""
+    rel = url_path[len(MEDIA_URL_PREFIX):] if url_path.startswith(MEDIA_URL_PREFIX) else url_path
+    return os.path.join(MEDIA_DIR, rel.lstrip("/"))
+
+
+def variant_url(imagem_path: str, nome: str) -> str:
+    base, _ = os.path.splitext(imagem_path)
+    return f"{base}_{nome}{VARIANT_EXT}"
+
+
+# Variantes já vistas no disco (não somem sem a imagem mudar de nome)
+_variantes_existentes: set[str] = set()
+
+
+def _variante_existe(url: str) -> bool:
+    if url in _variantes_existentes:
+        return True
+    if os.path.exists(media_abs_path(url)):
+        _variantes_existentes.add(url)
+        return True
+    return False
+
+
+def variant_urls(imagem_path: Optional[str]) -> Optional[dict[str, str]]:
+    """URLs das variantes (original + WebP por tamanho) de uma imagem.
+
+    Variante que ainda não existe no disco aponta para o original.
+    """
+    if not imagem_path:
+        return None
+    urls = {"original": imagem_path}
+    local = imagem_path.startswith(f"{MEDIA_URL_PREFIX}/")
+    for nome in VARIANT_SIZES:
+        url = variant_url(imagem_path, nome)
+        urls[nome] = url if local and _variante_existe(url) else imagem_path
+    return urls
+
+
+async def save_upload(
+    file: UploadFile,
+    dest_dir: str,
+    stem: str,
+    ext: str,
+    max_bytes: Optional[int] = None,
+) -> str:
+    """Grava o upload em `dest_dir` em chunks e retorna o nome final do arquivo.
+
+    O SHA-256 é calculado durante a escrita e o arquivo temporário é movido para
+    `<stem>.<hash><ext>` no fim, para que leitores nunca vejam uma imagem pela
+    metade. Lança 413 se exceder `max_bytes` e 400 se o conteúdo não for uma
+    imagem suportada.
+    """
+    if max_bytes is None:
+        max_bytes = settings.MEDIA_MAX_UPLOAD_MB * 1024 * 1024
+
+    os.makedirs(dest_dir, exist_ok=True)
+    tmp_path = os.path.join(dest_dir, f"{stem}.{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    total = 0
+    out = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            if total == 0 and not _looks_like_image(chunk[:16]):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Arquivo não é uma imagem válida")
+            total += len(chunk)
+            if total > max_bytes:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Imagem excede o limite de {max_bytes // (1024 * 1024)} MB",
+                )
+            digest.update(chunk)
+            await run_in_threadpool(out.write, chunk)
+        if total == 0:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Arquivo vazio")
+        await run_in_threadpool(out.close)
+        out_name = f"{stem}.{digest.hexdigest()[:CONTENT_HASH_LEN]}{ext}"
+        await run_in_threadpool(os.replace, tmp_path, os.path.join(dest_dir, out_name))
+        return out_name
+    except BaseException:
+        await run_in_threadpool(out.close)
+        try:
+            await run_in_threadpool(os.remove, tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def _remove_image_sync(imagem_path: str) -> None:
+    urls = [imagem_path] + [variant_url(imagem_path, nome) for nome in VARIANT_SIZES]
+    for url in urls:
+        _variantes_existentes.discard(url)
+        try:
+            os.remove(media_abs_path(url))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("Falha ao remover %s: %s", url, e)
+
+
+async def remove_image(imagem_path: Optional[str]) -> None:
+    """Remove a imagem original e todas as variantes (imagem trocada ou produto excluído)."""
+    if not imagem_path or not imagem_path.startswith(f"{MEDIA_URL_PREFIX}/"):
+        return
+    await run_in_threadpool(_remove_image_sync, imagem_path)
+
+
+def _generate_variants_sync(abs_path: str) -> None:
+    if Image is None:
+        logger.warning("Pillow não instalado: variantes de imagem não geradas")
+        return
+    base, _ = os.path.splitext(abs_path)
+    with Image.open(abs_path) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        for nome, lado in VARIANT_SIZES.items():
+            variante = img.copy()
+            variante.thumbnail((lado, lado), Image.LANCZOS)
+            destino = f"{base}_{nome}{VARIANT_EXT}"
+            tmp = f"{destino}.part"
+            variante.save(tmp, format="WEBP", quality=80, method=4)
+            os.replace(tmp, destino)
+
+
+# Limita quantas conversões rodam ao mesmo tempo (Pillow é CPU-bound)
+_variants_semaphore = asyncio.Semaphore(2)
+
+
+async def generate_variants(abs_path: str) -> None:
+    """Gera as variantes WebP em thread separada (usado como BackgroundTask)."""
+    async with _variants_semaphore:
+        try:
+            await run_in_threadpool(_generate_variants_sync, abs_path)
+        except Exception as e:
+            logger.warning("Falha ao gerar variantes de %s: %s", abs_path, e)
+
+
+_backfill: Optional[asyncio.Task] = None
+
+
+async def _gerar_faltantes(imagens: list[str]) -> None:
+    gerados = 0
+    for imagem_path in imagens:
+        if not imagem_path or not imagem_path.startswith(f"{MEDIA_URL_PREFIX}/"):
+            continue
+        abs_path = media_abs_path(imagem_path)
+        faltando = [n for n in VARIANT_SIZES if not os.path.exists(media_abs_path(variant_url(imagem_path, n)))]
+        if faltando and os.path.exists(abs_path):
+            await generate_variants(abs_path)
+            gerados += 1
+    if gerados:
+        logger.info("Variantes geradas para %s imagens antigas", gerados)
+
+
+async def iniciar_backfill(imagens: list[str]) -> None:
+    """Gera em background as variantes que faltam (imagens anteriores às variantes)."""
+    global _backfill
+    if _backfill is None and imagens and Image is not None:
+        _backfill = asyncio.create_task(_gerar_faltantes(imagens))
+
+
+async def parar_backfill() -> None:
+    global _backfill
+    if _backfill is not None:
+        _backfill.cancel()
+        await asyncio.gather(_backfill, return_exceptions=True)
+        _backfill = None
+
+
+def _parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """Interpreta 'bytes=a-b' (faixa única). Retorna (inicio, fim) inclusivo.
+
+    Retorna None para cabeçalhos que não entendemos (multi-faixa etc.): nesse caso
+    o arquivo inteiro é servido, o que o RFC 9110 permite. Lança ValueError para
+    faixas insatisfatíveis (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # Sufixo: últimos N bytes
+            n = int(last)
+            if n <= 0:
+                raise ValueError("faixa vazia")
+            return max(0, size - n), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        raise ValueError("faixa inválida")
+    if start >= size or start > end:
+        raise ValueError("faixa fora do arquivo")
+    return start, min(end, size - 1)
+
+
+class _RangeFileResponse(FileResponse):
+    """FileResponse 206 que envia apenas [start, end] do arquivo."""
+
+    def __init__(self, path: str, start: int, end: int, size: int, headers: dict, stat_result: os.stat_result) -> None:
+        super().__init__(path, status_code=206, headers=headers, stat_result=stat_result)
+        self.start = start
+        self.end = end
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(end - start + 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        restante = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while restante > 0:
+                chunk = await file.read(min(self.chunk_size, restante))
+                if not chunk:
+                    break
+                restante -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": restante > 0})
+        if restante > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class MediaFiles(StaticFiles):
+    """StaticFiles com cache imutável para nomes com hash, ETag de conteúdo e Range."""
+
+    def file_response(
+        self,
+        full_path,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = {"accept-ranges": "bytes"}
+
+        match = _HASHED_NAME_RE.search(os.path.basename(str(full_path)))
+        if match:
+            headers["cache-control"] = IMMUTABLE_CACHE_CONTROL
+            # O hash está no nome, mas variantes compartilham o hash do original
+            headers["etag"] = f'"{os.path.basename(str(full_path))}"'
+        else:
+            headers["cache-control"] = LEGACY_CACHE_CONTROL
+
+        response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+
+        range_header = request_headers.get("range")
+        if status_code != 200 or not range_header:
+            return response
+
+        # If-Range: só honrar a faixa se o ETag ainda for o mesmo
+        if_range = request_headers.get("if-range")
+        if if_range and if_range.strip() != response.headers["etag"]:
+            return response
+
+        size = stat_result.st_size
+        try:
+            faixa = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"content-range": f"bytes */{size}", **headers})
+        if faixa is None:
+            return response
+        return _RangeFileResponse(str(full_path), faixa[0], faixa[1], size, headers, stat_result)
@@ -0,0 +1,26 @@
+"""Cursores opacos para paginação por keyset.
+
+O cursor carrega os valores da chave de ordenação do último registro da página
+(ex.: data_divida + id). A próxima página é lida com `WHERE (chave) < (cursor)`
+sobre um índice na mesma ordem, sem OFFSET: o custo não cresce com a página.
+"""
+from typing import Any
+import base64
+import json
+
+
+def codificar_cursor(*valores: Any) -> str:
+    bruto = json.dumps([str(v) if v is not None else None for v in valores], separators=(",", ":"))
+    return base64.urlsafe_b64encode(bruto.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str, quantidade: int) -> list:
+    """Valores (como texto) de um cursor; ValueError se inválido."""
+    try:
+        preenchido = cursor + "=" * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(preenchido.encode("ascii")).decode("utf-8"))
+    except Exception:
+        raise ValueError("Cursor inválido")
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        raise ValueError("Cursor inválido")
+    return valores
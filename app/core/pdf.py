@@ -0,0 +1,198 @@
+"""Renderização de relatórios PDF (ReportLab) com recursos pré-compilados.
+
+Montar a folha de estilos, as TableStyles e decodificar o logo custa mais do que
+um relatório pequeno inteiro. Aqui isso é feito uma vez por processo:
+- `estilos()`: folha de estilos (getSampleStyleSheet) criada uma única vez;
+- `TABELA_*`: TableStyles prontas, compartilhadas entre documentos (o ReportLab
+  só lê os comandos, não altera o objeto);
+- logo decodificado e reduzido ao tamanho de impressão uma vez por arquivo
+  (chave: caminho + mtime), por tenant via `EmpresaConfig.logo_path`.
+As fontes são as Type1 embutidas (Helvetica), que não precisam de registro.
+"""
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+import logging
+import os
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import StyleSheet1, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import Flowable, Paragraph, SimpleDocTemplate, Spacer, TableStyle
+
+from app.core.media import MEDIA_URL_PREFIX, media_abs_path
+
+try:
+    from PIL import Image as PILImage
+except ImportError:  # pragma: no cover - dependência opcional
+    PILImage = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parents[2]
+LOGO_PADRAO = BASE_DIR / "img" / "vuchada.png"
+LOGO_LADO = 25 * mm
+# Resolução com que o logo é guardado (pontos -> pixels a 150 dpi)
+LOGO_DPI = 150
+
+COR_CABECALHO = colors.HexColor("#0f766e")
+
+
+@lru_cache(maxsize=1)
+def estilos() -> StyleSheet1:
+    """Folha de estilos padrão, criada uma vez por processo."""
+    return getSampleStyleSheet()
+
+
+def _tabela_lista(fonte_cabecalho: int, fonte_corpo: int, padding: int) -> TableStyle:
+    return TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), COR_CABECALHO),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), fonte_cabecalho),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), padding),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+        ("FONTSIZE", (0, 1), (-1, -1), fonte_corpo),
+    ])
+
+
+# Lista com cabeçalho colorido (produtos)
+TABELA_LISTA = _tabela_lista(10, 9, 8)
+# Lista compacta (vendas e itens)
+TABELA_LISTA_COMPACTA = _tabela_lista(9, 8, 6)
+# Pares rótulo/valor (resumo financeiro)
+TABELA_RESUMO = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), COR_CABECALHO),
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("FONTSIZE", (0, 0), (-1, 0), 10),
+    ("ALIGN", (0, 0), (-1, -1), "LEFT"),
+    ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+])
+
+
+def novo_documento(buffer: BytesIO, margem_mm: float = 20) -> SimpleDocTemplate:
+    margem = margem_mm * mm
+    return SimpleDocTemplate(buffer, pagesize=A4, leftMargin=margem, rightMargin=margem,
+                             topMargin=margem, bottomMargin=margem)
+
+
+class _Logo(Flowable):
+    """Desenha um ImageReader já decodificado (sem reabrir o arquivo)."""
+
+    def __init__(self, reader: ImageReader, largura: float, altura: float) -> None:
+        super().__init__()
+        self.reader = reader
+        self.width = largura
+        self.height = altura
+        self.hAlign = "CENTER"
+
+    def wrap(self, availWidth, availHeight):
+        return self.width, self.height
+
+    def draw(self) -> None:
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask="auto")
+
+
+_logos: dict[tuple[str, float], Optional[ImageReader]] = {}
+_logos_lock = Lock()
+
+
+def resolver_logo(logo_path: Optional[str]) -> Optional[str]:
+    """Caminho no disco do logo do tenant ('/media/...', absoluto ou relativo ao projeto)."""
+    if logo_path:
+        if logo_path.startswith(f"{MEDIA_URL_PREFIX}/"):
+            caminho = media_abs_path(logo_path)
+        elif os.path.isabs(logo_path):
+            caminho = logo_path
+        else:
+            caminho = str(BASE_DIR / logo_path)
+        if os.path.exists(caminho):
+            return caminho
+    return str(LOGO_PADRAO) if LOGO_PADRAO.exists() else None
+
+
+def _decodificar_logo(caminho: str) -> ImageReader:
+    if PILImage is None:
+        return ImageReader(caminho)
+    lado_px = int(LOGO_LADO / 72 * LOGO_DPI)
+    with PILImage.open(caminho) as img:
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.thumbnail((lado_px, lado_px), PILImage.LANCZOS)
+        reader = ImageReader(img.copy())
+    # Força a conversão para RGB agora; os próximos documentos só reusam os bytes
+    reader.getRGBData()
+    return reader
+
+
+def logo(logo_path: Optional[str]) -> Optional[Flowable]:
+    """Flowable do logo do tenant; o arquivo é decodificado só na primeira vez."""
+    caminho = resolver_logo(logo_path)
+    if caminho is None:
+        return None
+    try:
+        chave = (caminho, os.path.getmtime(caminho))
+    except OSError:
+        return None
+    reader = _logos.get(chave)
+    if reader is None and chave not in _logos:
+        with _logos_lock:
+            if chave not in _logos:
+                try:
+                    _logos[chave] = _decodificar_logo(caminho)
+                except Exception as e:
+                    logger.warning("Logo inválido em %s: %s", caminho, e)
+                    _logos[chave] = None
+            reader = _logos[chave]
+    if reader is None:
+        return None
+    return _Logo(reader, LOGO_LADO, LOGO_LADO)
+
+
+def cabecalho(story: list, titulo: str, subtitulo: Optional[str] = None, empresa=None) -> None:
+    """Adiciona cabeçalho padrão com logo + dados da empresa + título/subtítulo."""
+    styles = estilos()
+
+    # Logo (do tenant ou padrão, se existir)
+    imagem = logo(getattr(empresa, "logo_path", None))
+    if imagem is not None:
+        story.append(imagem)
+        story.append(Spacer(1, 4))
+
+    # Dados da empresa
+    if empresa is not None:
+        linha1 = (empresa.nome or "").strip()
+
+        detalhes = []
+        if empresa.nuit:
+            detalhes.append(f"NUIT: {empresa.nuit}")
+        if empresa.telefone:
+            detalhes.append(f"Tel: {empresa.telefone}")
+        if empresa.email:
+            detalhes.append(f"Email: {empresa.email}")
+
+        linha2 = " | ".join(detalhes) if detalhes else ""
+        linha3 = (empresa.endereco or "").strip()
+
+        if linha1:
+            story.append(Paragraph(linha1, styles["Heading3"]))
+        if linha2:
+            story.append(Paragraph(linha2, styles["Normal"]))
+        if linha3:
+            story.append(Paragraph(linha3, styles["Normal"]))
+        if linha1 or linha2 or linha3:
+            story.append(Spacer(1, 6))
+
+    # Título e subtítulo do relatório
+    story.append(Paragraph(titulo, styles["Title"]))
+    if subtitulo:
+        story.append(Paragraph(subtitulo, styles["Normal"]))
+
+    story.append(Spacer(1, 8))
@@ -1,4 +1,4 @@
-from typing import Dict, Set, Any
+from typing import Dict, Optional, Set, Any
 from fastapi import WebSocket
 from asyncio import Lock
 import json
@@ -6,19 +6,24 @@ import json
 class ConnectionManager:
     def __init__(self) -> None:
         self.active_connections: Set[WebSocket] = set()
+        # Tenant de cada conexão (None se o cliente não informou)
+        self._tenants: Dict[WebSocket, Optional[str]] = {}
         self._lock = Lock()
 
-    async def connect(self, websocket: WebSocket) -> None:
+    async def connect(self, websocket: WebSocket, tenant_id: Optional[str] = None) -> None:
         await websocket.accept()
         async with self._lock:
             self.active_connections.add(websocket)
+            self._tenants[websocket] = tenant_id
 
     async def disconnect(self, websocket: WebSocket) -> None:
         async with self._lock:
             if websocket in self.active_connections:
                 self.active_connections.remove(websocket)
+            self._tenants.pop(websocket, None)
 
-    async def broadcast(self, event_type: str, payload: Dict[str, Any]) -> None:
+    async def broadcast(self, event_type: str, payload: Dict[str, Any], tenant_id: Optional[str] = None) -> None:
+        """Envia o evento às conexões; com `tenant_id`, só às conexões desse tenant."""
         message = json.dumps({
             "type": event_type,
             "ts": payload.get("ts"),
@@ -29,6 +34,8 @@ class ConnectionManager:
         dead: Set[WebSocket] = set()
         async with self._lock:
             for ws in self.active_connections:
+                if tenant_id is not None and self._tenants.get(ws) != tenant_id:
+                    continue
                 try:
                     await ws.send_text(message)
                 except Exception:
@@ -38,5 +45,6 @@ class ConnectionManager:
                     self.active_connections.remove(ws)
                 except KeyError:
                     pass
+                self._tenants.pop(ws, None)
 
 manager = ConnectionManager()
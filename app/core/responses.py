@@ -0,0 +1,31 @@
+"""Resposta JSON rápida (orjson) usada como classe padrão da aplicação.
+
+orjson serializa UUID e datetime nativamente e é bem mais rápido que o encoder
+padrão em listas grandes (vendas, produtos, sync). Se a lib não estiver
+instalada, cai para o JSONResponse padrão do Starlette.
+"""
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa para bytes JSON usando orjson quando disponível."""
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    import json
+    return json.dumps(content, ensure_ascii=False, default=str, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return dumps(content)
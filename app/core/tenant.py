@@ -0,0 +1,93 @@
+"""Isolamento por tenant nas consultas ORM da sessão.
+
+O tenant é vinculado uma vez por requisição à sessão (`vincular`, chamado por
+get_tenant_id; routers de dados por tenant declaram get_tenant_id como
+dependência do router). A partir daí, todo SELECT/UPDATE/DELETE do ORM na
+sessão recebe `tenant_id = :tenant` em cada modelo com coluna tenant_id — no
+WHERE ou no ON dos JOINs, via with_loader_criteria — e usa os índices
+(tenant_id, ...).
+
+Consultas entre tenants (login, usuário do token) usam
+`.execution_options(**TODOS_TENANTS)`. SQL textual (text()) não é alterado:
+continua passando o tenant como parâmetro.
+
+Verificação: em sessões de requisição (get_db_session) sem tenant vinculado,
+uma consulta ORM a modelo com tenant_id é registrada no log (uma vez por
+conjunto de tabelas) ou, com TENANT_ESCOPO_ESTRITO=true, falha com
+EscopoTenantAusente — para rodar em desenvolvimento e achar rotas sem escopo.
+"""
+import logging
+from typing import Optional
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import ORMExecuteState, Session, with_loader_criteria
+
+from app.core.config import settings
+from app.db.base import DeclarativeBase
+
+
+logger = logging.getLogger(__name__)
+
+CHAVE_TENANT = "tenant_id"
+CHAVE_REQUISICAO = "requisicao"
+TODOS_TENANTS = {"todos_tenants": True}
+
+_modelos: Optional[list] = None
+_avisados: set = set()
+
+
+class EscopoTenantAusente(RuntimeError):
+    pass
+
+
+def modelos_com_tenant() -> list:
+    """Classes mapeadas que têm coluna tenant_id."""
+    global _modelos
+    if _modelos is None:
+        _modelos = [m.class_ for m in DeclarativeBase.registry.mappers if "tenant_id" in m.columns]
+    return _modelos
+
+
+def vincular(session, tenant_id: uuid.UUID) -> None:
+    """Vincula o tenant à sessão (AsyncSession ou Session)."""
+    session.info[CHAVE_TENANT] = tenant_id
+
+
+def tenant_da_sessao(session) -> Optional[uuid.UUID]:
+    return session.info.get(CHAVE_TENANT)
+
+
+def _criterios(tenant_id: uuid.UUID) -> list:
+    return [
+        with_loader_criteria(modelo, lambda cls: cls.tenant_id == tenant_id, include_aliases=True)
+        for modelo in modelos_com_tenant()
+    ]
+
+
+def _sem_escopo(estado: ORMExecuteState) -> None:
+    tabelas = sorted({m.local_table.name for m in estado.all_mappers if "tenant_id" in m.columns})
+    if not tabelas:
+        return
+    if settings.TENANT_ESCOPO_ESTRITO:
+        raise EscopoTenantAusente(f"Consulta sem tenant vinculado à sessão: {', '.join(tabelas)}")
+    if tuple(tabelas) not in _avisados:
+        _avisados.add(tuple(tabelas))
+        logger.warning("Consulta sem tenant vinculado à sessão: %s", ", ".join(tabelas))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _aplicar_tenant(estado: ORMExecuteState) -> None:
+    if not estado.is_orm_statement or not (estado.is_select or estado.is_update or estado.is_delete):
+        return
+    if estado.is_column_load or estado.is_relationship_load:
+        # Carregamentos de coluna/relacionamento herdam o critério da consulta original
+        return
+    if estado.execution_options.get("todos_tenants"):
+        return
+    tenant_id = estado.session.info.get(CHAVE_TENANT)
+    if tenant_id is None:
+        if estado.session.info.get(CHAVE_REQUISICAO):
+            _sem_escopo(estado)
+        return
+    estado.statement = estado.statement.options(*_criterios(tenant_id))
@@ -3,12 +3,15 @@ Database session management for dependency injection.
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.db.session import async_session
+from app.core.tenant import CHAVE_REQUISICAO
 
 async def get_db_session() -> AsyncSession:
     """
     Dependency to get database session for FastAPI endpoints.
     """
     async with async_session() as session:
+        # Sessão de requisição: o tenant é vinculado por get_tenant_id (ver app/core/tenant.py)
+        session.info[CHAVE_REQUISICAO] = True
         try:
             yield session
         finally:
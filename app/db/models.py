@@ -1,9 +1,9 @@
-from sqlalchemy import Column, String, Boolean, Integer, Float, Text, DateTime, ForeignKey
+from sqlalchemy import Column, String, Boolean, Integer, BigInteger, Float, Text, DateTime, Date, ForeignKey, Identity, Index, LargeBinary, UniqueConstraint, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, ARRAY
 from app.db.base import DeclarativeBase
-from datetime import datetime
+from datetime import datetime, date
 from typing import Optional
 import uuid
 
@@ -59,7 +59,11 @@ class Produto(DeclarativeBase):
 
 class Cliente(DeclarativeBase):
     __tablename__ = "clientes"
-    __table_args__ = {"schema": PDV_SCHEMA}
+    __table_args__ = (
+        # Listagem por keyset (nome, id); telefone/documento/trigram de nome são criados no lifespan
+        Index("ix_clientes_tenant_nome", "tenant_id", "nome", "id"),
+        {"schema": PDV_SCHEMA},
+    )
 
     tenant_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=True, index=True)
     nome: Mapped[str] = mapped_column(String(100), nullable=False)
@@ -71,7 +75,11 @@ class Cliente(DeclarativeBase):
 
 class Venda(DeclarativeBase):
     __tablename__ = "vendas"
-    __table_args__ = {"schema": PDV_SCHEMA}
+    __table_args__ = (
+        # Verificação de venda duplicada (app/services/duplicidade_vendas.py)
+        Index("ix_vendas_tenant_assinatura", "tenant_id", "assinatura"),
+        {"schema": PDV_SCHEMA},
+    )
 
     tenant_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=True, index=True)
     usuario_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey(f"{PDV_SCHEMA}.usuarios.id"), nullable=True)
@@ -81,6 +89,8 @@ class Venda(DeclarativeBase):
     forma_pagamento: Mapped[str] = mapped_column(String(50), nullable=False)
     observacoes: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     cancelada: Mapped[bool] = mapped_column(Boolean, default=False)
+    # md5 do conteúdo (vendedor, cliente, total, pagamento, janela de tempo, itens), gravado na inserção
+    assinatura: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
     
     # Relacionamentos
     usuario: Mapped[Optional["User"]] = relationship("User")
@@ -102,6 +112,8 @@ class ItemVenda(DeclarativeBase):
     taxa_iva: Mapped[float] = mapped_column(Float, default=0.0)
     base_iva: Mapped[float] = mapped_column(Float, default=0.0)
     valor_iva: Mapped[float] = mapped_column(Float, default=0.0)
+    # Código de imposto do produto no momento da venda (histórico fiscal)
+    codigo_imposto: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)
     
     # Relacionamentos
     venda: Mapped["Venda"] = relationship("Venda", back_populates="itens")
@@ -119,6 +131,14 @@ class EmpresaConfig(DeclarativeBase):
     email: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
     endereco: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     logo_path: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # Regras de estoque baixo do tenant: limite usado quando o produto não tem
+    # estoque_minimo próprio e categorias sem controle de estoque (ex.: Serviços = 15)
+    estoque_baixo_padrao: Mapped[float] = mapped_column(Float, default=5.0, server_default="5")
+    categorias_sem_estoque: Mapped[Optional[list[int]]] = mapped_column(ARRAY(Integer), nullable=True, server_default="{15}")
+
+
+# Data usada para ordenar/paginar dívidas sem data_divida (vão para o fim da listagem)
+DATA_DIVIDA_AUSENTE_SQL = "TIMESTAMPTZ '1970-01-01 00:00:00+00'"
 
 
 class Divida(DeclarativeBase):
@@ -129,7 +149,13 @@ class Divida(DeclarativeBase):
     """
 
     __tablename__ = "dividas"
-    __table_args__ = {"schema": PDV_SCHEMA}
+    __table_args__ = (
+        # Idempotência do sync: cada id_local do PDV entra uma vez por tenant
+        UniqueConstraint("tenant_id", "id_local", name="uq_dividas_tenant_id_local"),
+        Index("ix_dividas_tenant_cliente", "tenant_id", "cliente_id"),
+        Index("ix_dividas_tenant_ordem", "tenant_id", text(f"coalesce(data_divida, {DATA_DIVIDA_AUSENTE_SQL})"), "id"),
+        {"schema": PDV_SCHEMA},
+    )
 
     tenant_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=True, index=True)
     # ID local opcional (inteiro) para mapear com o SQLite do PDV3
@@ -180,5 +206,158 @@ class PagamentoDivida(DeclarativeBase):
     usuario: Mapped[Optional["User"]] = relationship("User")
 
 
+class SaldoCliente(DeclarativeBase):
+    """Saldo de dívidas por cliente (total devido, pago, em aberto, dívida aberta mais antiga).
+
+    Recalculado na mesma transação que cria dívidas ou registra pagamentos
+    (app/services/saldos_clientes.py), para as telas de cobrança lerem uma
+    linha por cliente em vez de todas as dívidas.
+    """
+
+    __tablename__ = "saldos_cliente"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "cliente_id", name="uq_saldos_cliente_chave"),
+        Index("ix_saldos_cliente_tenant_saldo", "tenant_id", "saldo"),
+        {"schema": PDV_SCHEMA},
+    )
+
+    tenant_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
+    cliente_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey(f"{PDV_SCHEMA}.clientes.id"), nullable=False)
+    total_divida: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    total_pago: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    saldo: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    qtd_abertas: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    aberta_desde: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+
+class Alteracao(DeclarativeBase):
+    """Change-log das entidades sincronizadas (uma linha por registro alterado em cada comando).
+
+    Preenchida por triggers (app/services/alteracoes.py). `versao` é global e
+    crescente; `transacao` é o txid de quem gravou, usado pelo pull para só ler
+    alterações de transações já encerradas.
+    """
+
+    __tablename__ = "alteracoes"
+    __table_args__ = (
+        Index("ix_alteracoes_pull", "tenant_id", "entidade", "transacao", "versao"),
+        Index("ix_alteracoes_registro", "tenant_id", "entidade", "registro_id", "versao"),
+        Index("ix_alteracoes_versao", "versao"),
+        {"schema": PDV_SCHEMA},
+    )
+
+    versao: Mapped[int] = mapped_column(BigInteger, Identity(), nullable=False)
+    transacao: Mapped[int] = mapped_column(BigInteger, server_default=text("txid_current()"), nullable=False)
+    tenant_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    entidade: Mapped[str] = mapped_column(String(30), nullable=False)
+    registro_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    operacao: Mapped[str] = mapped_column(String(10), nullable=False)
+
+
+class ChaveIdempotencia(DeclarativeBase):
+    """Respostas gravadas por Idempotency-Key (app/core/idempotencia.py).
+
+    `status_code` nulo = requisição em andamento. `corpo` é a resposta
+    comprimida (zlib). Linhas expiradas são retomadas ou apagadas em lotes.
+    """
+
+    __tablename__ = "idempotencia"
+    __table_args__ = (
+        UniqueConstraint("escopo", "chave", name="uq_idempotencia_chave"),
+        Index("ix_idempotencia_expira_em", "expira_em"),
+        {"schema": PDV_SCHEMA},
+    )
+
+    escopo: Mapped[str] = mapped_column(String(64), nullable=False, default="")
+    chave: Mapped[str] = mapped_column(String(255), nullable=False)
+    hash_requisicao: Mapped[str] = mapped_column(String(64), nullable=False)
+    status_code: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    content_type: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
+    corpo: Mapped[Optional[bytes]] = mapped_column(LargeBinary, nullable=True)
+    expira_em: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+
+class MovimentoEstoque(DeclarativeBase):
+    """Livro-razão de estoque: o estoque de um produto é a soma das quantidades.
+
+    `quantidade` é assinada (saída negativa, entrada positiva). `origem` indica o
+    tipo do movimento (abertura, venda, venda_estorno, divida, ajuste, sync) e
+    `referencia_id` aponta para a venda/dívida de origem, quando houver.
+    Sem FK para produtos/vendas para não bloquear exclusões e preservar histórico.
+    """
+
+    __tablename__ = "movimentos_estoque"
+    __table_args__ = (
+        Index("ix_movimentos_estoque_produto_created", "produto_id", "created_at"),
+        Index("ix_movimentos_estoque_referencia", "referencia_id"),
+        {"schema": PDV_SCHEMA},
+    )
+
+    tenant_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=True, index=True)
+    produto_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    quantidade: Mapped[float] = mapped_column(Float, nullable=False)
+    origem: Mapped[str] = mapped_column(String(30), nullable=False)
+    referencia_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
+    usuario_id: Mapped[Optional[uuid.UUID]] = mapped_column(UUID(as_uuid=True), nullable=True)
+
+
+class IvaDiario(DeclarativeBase):
+    """Rollup diário de IVA por tenant/taxa/código de imposto.
+
+    Mantido de forma incremental (venda criada soma, venda cancelada subtrai)
+    para que o resumo de IVA de um mês leia ~30 linhas por taxa em vez de
+    todos os itens vendidos.
+    """
+
+    __tablename__ = "iva_diario"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "dia", "taxa_iva", "codigo_imposto", name="uq_iva_diario_chave"),
+        {"schema": PDV_SCHEMA},
+    )
+
+    tenant_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
+    dia: Mapped[date] = mapped_column(Date, nullable=False)
+    taxa_iva: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    # '' quando o produto não tem código (NULL quebraria a chave única)
+    codigo_imposto: Mapped[str] = mapped_column(String(20), nullable=False, default="")
+    base_total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    iva_total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    qtd_itens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+
+# Usuário "sem vendedor" no rollup de vendas (NULL quebraria a chave única)
+USUARIO_NULO = uuid.UUID(int=0)
+# Produto da linha de nível de venda no rollup (uma por venda, pelo mesmo motivo)
+PRODUTO_NULO = uuid.UUID(int=0)
+
+
+class VendaHora(DeclarativeBase):
+    """Rollup horário de vendas por tenant/vendedor/forma de pagamento/produto.
+
+    Mantido na transação da venda, como o de IVA. As métricas de nível de venda
+    (qtd_vendas, total, desconto) ficam numa linha própria com produto_id =
+    PRODUTO_NULO (inclusive vendas sem itens); as linhas de produto só têm as
+    métricas de item (qtd_itens, quantidade, receita).
+    """
+
+    __tablename__ = "vendas_hora"
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "hora", "usuario_id", "forma_pagamento", "produto_id", name="uq_vendas_hora_chave"),
+        {"schema": PDV_SCHEMA},
+    )
+
+    tenant_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), ForeignKey("tenants.id"), nullable=False)
+    hora: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    usuario_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False, default=USUARIO_NULO)
+    forma_pagamento: Mapped[str] = mapped_column(String(50), nullable=False, default="")
+    produto_id: Mapped[uuid.UUID] = mapped_column(UUID(as_uuid=True), nullable=False)
+    qtd_vendas: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    desconto: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    qtd_itens: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    quantidade: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+    receita: Mapped[float] = mapped_column(Float, nullable=False, default=0.0)
+
 # Adicionar relacionamentos reversos
 Cliente.vendas = relationship("Venda", back_populates="cliente")
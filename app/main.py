@@ -1,6 +1,5 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
 import os
 import uuid
@@ -9,8 +8,20 @@ from app.routers import health, produtos, usuarios, clientes, vendas, auth, cate
 from app.routers import metricas, relatorios, empresa_config, admin, dividas
 from app.db.session import engine, AsyncSessionLocal
 from app.db.base import DeclarativeBase
-from app.db.models import User
+from app.db.models import DATA_DIVIDA_AUSENTE_SQL, User
 from app.core.security import get_password_hash
+from app.core.config import settings
+from app.core.compression import CompressionMiddleware
+from app.core.idempotencia import IdempotencyMiddleware
+from app.core.responses import FastJSONResponse
+from app.core import media
+from app.core.media import MEDIA_DIR, MediaFiles
+from app.services.estoque import garantir_abertura
+from app.services.iva import garantir_rollup as garantir_rollup_iva
+from app.services.metricas_vendas import garantir_rollup as garantir_rollup_vendas
+from app.services.saldos_clientes import garantir_saldos
+from app.services import alteracoes, relatorios_jobs
+from app.services.alteracoes import garantir_alteracoes, instalar_captura
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -100,6 +111,55 @@ async def lifespan(app: FastAPI):
 
             await conn.execute(text("ALTER TABLE pdv.produtos ADD COLUMN IF NOT EXISTS imagem_path VARCHAR(255)"))
 
+            await conn.execute(text("ALTER TABLE pdv.itens_venda ADD COLUMN IF NOT EXISTS codigo_imposto VARCHAR(20)"))
+
+            # Assinatura de conteúdo das vendas (detecção de duplicadas); vendas antigas são
+            # preenchidas pelo job de deduplicação (scripts/dedupe_vendas.py)
+            await conn.execute(text("ALTER TABLE pdv.vendas ADD COLUMN IF NOT EXISTS assinatura VARCHAR(32)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_vendas_tenant_assinatura ON pdv.vendas (tenant_id, assinatura)"))
+
+            # Índices para agregações por período (relatórios/métricas)
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pdv_vendas_created_at ON pdv.vendas (created_at)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_pdv_itens_venda_venda_id ON pdv.itens_venda (venda_id)"))
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_dividas_tenant_cliente ON pdv.dividas (tenant_id, cliente_id)"))
+            # Listagem paginada de dívidas (keyset em data_divida, id; sem data = fim da lista)
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_dividas_tenant_ordem ON pdv.dividas "
+                f"(tenant_id, (coalesce(data_divida, {DATA_DIVIDA_AUSENTE_SQL})), id)"
+            ))
+
+            # Clientes: listagem por nome (keyset) e busca no caixa por telefone (só dígitos) / documento
+            await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_clientes_tenant_nome ON pdv.clientes (tenant_id, nome, id)"))
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_clientes_tenant_telefone_digitos ON pdv.clientes "
+                "(tenant_id, (regexp_replace(telefone, '[^0-9]', '', 'g')) text_pattern_ops))"
+            ))
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_clientes_tenant_documento ON pdv.clientes "
+                "(tenant_id, documento varchar_pattern_ops) WHERE documento IS NOT NULL"
+            ))
+            # Busca por nome com trigram (pg_trgm); sem permissão para a extensão, a busca usa ILIKE sem índice
+            try:
+                async with conn.begin_nested():
+                    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    await conn.execute(text(
+                        "CREATE INDEX IF NOT EXISTS ix_clientes_nome_trgm ON pdv.clientes USING gin (nome gin_trgm_ops)"
+                    ))
+            except Exception as e:
+                print(f"Aviso: índice trigram de clientes não criado (pg_trgm): {e}")
+
+            # Regras de estoque baixo por tenant + índices parciais usados pela consulta em SQL
+            await conn.execute(text("ALTER TABLE pdv.empresa_config ADD COLUMN IF NOT EXISTS estoque_baixo_padrao DOUBLE PRECISION DEFAULT 5"))
+            await conn.execute(text("ALTER TABLE pdv.empresa_config ADD COLUMN IF NOT EXISTS categorias_sem_estoque INTEGER[] DEFAULT '{15}'"))
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_produtos_baixo_estoque_minimo ON pdv.produtos "
+                "(tenant_id, (estoque - estoque_minimo)) WHERE ativo = true AND estoque_minimo > 0"
+            ))
+            await conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_produtos_baixo_estoque_padrao ON pdv.produtos "
+                "(tenant_id, estoque) WHERE ativo = true AND (estoque_minimo IS NULL OR estoque_minimo <= 0)"
+            ))
+
             # Preencher tenant_id default em registros existentes (mantém compatibilidade)
             for table in [
                 "pdv.usuarios",
@@ -114,6 +174,67 @@ async def lifespan(app: FastAPI):
             ]:
                 await conn.execute(text(f"UPDATE {table} SET tenant_id = :tid WHERE tenant_id IS NULL"), {"tid": tenant_uuid})
 
+            # Idempotência do sync de dívidas: (tenant_id, id_local) único (o sync usa
+            # ON CONFLICT nesse índice). Duplicados antigos: a dívida mais antiga fica
+            # com o id_local; as cópias perdem o id_local (nada é apagado) e ganham nota.
+            existe = await conn.scalar(text("SELECT to_regclass('pdv.uq_dividas_tenant_id_local') IS NOT NULL"))
+            if not existe:
+                result = await conn.execute(text(
+                    """
+                    UPDATE pdv.dividas d
+                    SET observacao = concat_ws(' ', d.observacao, '[id_local ' || d.id_local || ' duplicado]'),
+                        id_local = NULL
+                    FROM (
+                        SELECT id, row_number() OVER (
+                            PARTITION BY tenant_id, id_local ORDER BY data_divida NULLS LAST, created_at, id
+                        ) AS n
+                        FROM pdv.dividas
+                        WHERE id_local IS NOT NULL
+                    ) c
+                    WHERE d.id = c.id AND c.n > 1
+                    """
+                ))
+                if result.rowcount:
+                    print(f"Aviso: {result.rowcount} dívida(s) com id_local duplicado ficaram sem id_local")
+                await conn.execute(text(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS uq_dividas_tenant_id_local ON pdv.dividas (tenant_id, id_local)"
+                ))
+
+            # Change-log do sync (triggers de captura em produtos, clientes, usuarios, vendas, dividas)
+            await instalar_captura(conn)
+
+        # Change-log do sync: backfill na primeira execução
+        async with AsyncSessionLocal() as session:
+            await garantir_alteracoes(session)
+            await session.commit()
+
+        # Livro-razão de estoque: saldo de abertura para produtos sem movimentos
+        async with AsyncSessionLocal() as session:
+            await garantir_abertura(session)
+            await session.commit()
+
+        # Rollup diário de IVA: backfill na primeira execução
+        async with AsyncSessionLocal() as session:
+            await garantir_rollup_iva(session)
+            await session.commit()
+
+        # Rollup horário de vendas (métricas do dashboard): backfill na primeira execução
+        async with AsyncSessionLocal() as session:
+            await garantir_rollup_vendas(session)
+            await session.commit()
+
+        # Saldos de dívida por cliente: backfill na primeira execução
+        async with AsyncSessionLocal() as session:
+            await garantir_saldos(session)
+            await session.commit()
+
+        # Variantes WebP de imagens enviadas antes delas existirem (gera em background)
+        async with AsyncSessionLocal() as session:
+            imagens = (await session.execute(
+                text("SELECT DISTINCT imagem_path FROM pdv.produtos WHERE imagem_path IS NOT NULL")
+            )).scalars().all()
+        await media.iniciar_backfill(list(imagens))
+
         # Garantir usuário técnico Neotrix para autoLogin do PDV online
         async with AsyncSessionLocal() as session:
             result = await session.execute(
@@ -143,11 +264,19 @@ async def lifespan(app: FastAPI):
         print(f"Erro ao conectar com o banco: {e}")
         # Continue mesmo com erro de banco para permitir healthcheck
         pass
-    
+
+    # Workers da fila de relatórios em background
+    await relatorios_jobs.iniciar()
+    # Compactação periódica do change-log do sync
+    await alteracoes.iniciar_compactacao()
+
     yield
     
     # Shutdown
     print("Encerrando backend...")
+    await relatorios_jobs.parar()
+    await alteracoes.parar_compactacao()
+    await media.parar_backfill()
     try:
         await engine.dispose()
     except:
@@ -157,12 +286,19 @@ app = FastAPI(
     title="PDV3 Hybrid Backend",
     description="API for PDV3 online/offline synchronization.",
     version="0.1.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse,
 )
 
-MEDIA_DIR = os.getenv("MEDIA_DIR", "media")
 os.makedirs(MEDIA_DIR, exist_ok=True)
-app.mount("/media", StaticFiles(directory=MEDIA_DIR), name="media")
+app.mount("/media", MediaFiles(directory=MEDIA_DIR), name="media")
+
+# Idempotency-Key em POST/PUT/PATCH/DELETE (registrado antes do CORS para as respostas repetidas passarem por ele)
+app.add_middleware(
+    IdempotencyMiddleware,
+    ttl_horas=settings.IDEMPOTENCIA_TTL_HORAS,
+    max_corpo=settings.IDEMPOTENCIA_MAX_CORPO,
+)
 
 # CORS (Cross-Origin Resource Sharing)
 app.add_middleware(
@@ -173,6 +309,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compressão negociada (br/gzip) para respostas grandes (listagens, sync, CSV)
+if settings.COMPRESSION_MIN_SIZE > 0:
+    app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+
 # Incluir routers
 app.include_router(health.router)
 app.include_router(categorias.router)
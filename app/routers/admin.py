@@ -3,7 +3,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
 from app.db.database import get_db_session
-from app.core.deps import get_current_admin_user
+from app.core.deps import get_current_admin_user, get_tenant_id
+from app.services.estoque import garantir_abertura, recalcular_estoque
+from app.services import iva as iva_service
+import uuid
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
@@ -43,3 +46,48 @@ async def reset_dados_online(
             status_code=500,
             detail=f"Erro ao resetar banco de dados: {str(e)}",
         )
+
+
+@router.post("/estoque/recalcular")
+async def recalcular_estoque_livro_razao(
+    todos_tenants: bool = False,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+    user=Depends(get_current_admin_user),
+):
+    """Recalcula o estoque dos produtos a partir do livro-razão (movimentos_estoque).
+
+    Corrige divergências causadas por escritas fora do livro-razão (scripts,
+    edições manuais no banco). Por padrão atua só no tenant atual.
+    """
+    try:
+        await garantir_abertura(db)
+        corrigidos = await recalcular_estoque(db, None if todos_tenants else tenant_id)
+        await db.commit()
+        return {"status": "ok", "produtos_corrigidos": corrigidos}
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao recalcular estoque: {str(e)}",
+        )
+
+
+@router.post("/iva/reconstruir")
+async def reconstruir_rollup_iva(
+    todos_tenants: bool = False,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+    user=Depends(get_current_admin_user),
+):
+    """Recria o rollup diário de IVA (pdv.iva_diario) a partir dos itens de venda."""
+    try:
+        await iva_service.reconstruir_rollup(db, None if todos_tenants else tenant_id)
+        await db.commit()
+        return {"status": "ok"}
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Erro ao reconstruir rollup de IVA: {str(e)}",
+        )
@@ -9,7 +9,7 @@ from app.core.deps import get_tenant_id
 from app.db.database import get_db_session
 from app.db.models import Tenant
 
-router = APIRouter(prefix="/api/categorias", tags=["categorias"])
+router = APIRouter(prefix="/api/categorias", tags=["categorias"], dependencies=[Depends(get_tenant_id)])
 
 
 class CategoriaOut(BaseModel):
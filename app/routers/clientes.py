@@ -1,32 +1,96 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, update, delete
-from typing import List
+from sqlalchemy import select, update, delete, tuple_
+from typing import List, Optional
 import uuid
 from datetime import datetime
 
 from ..db.database import get_db_session
 from ..db.models import Cliente
+from app.core.deps import get_tenant_id
+from app.core.paginacao import codificar_cursor, decodificar_cursor
 from app.core.realtime import manager as realtime_manager
+from app.services import sync_delta
+from app.services.busca_clientes import buscar_clientes
 from ..schemas.cliente import ClienteCreate, ClienteUpdate, ClienteResponse
 
-router = APIRouter(prefix="/api/clientes", tags=["clientes"])
+router = APIRouter(prefix="/api/clientes", tags=["clientes"], dependencies=[Depends(get_tenant_id)])
+
+ENTIDADE_SYNC = "cliente"
+_CAMPOS_SYNC = ["nome", "documento", "telefone", "endereco", "ativo"]
 
 @router.get("/", response_model=List[ClienteResponse])
-async def listar_clientes(db: AsyncSession = Depends(get_db_session)):
-    """Lista todos os clientes."""
+async def listar_clientes(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    incluir_inativos: bool = False,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Lista os clientes do tenant em ordem de nome.
+
+    Sem `limit` nem `cursor` devolve a lista completa (compatibilidade). Com um
+    deles, pagina por keyset (página padrão de 500): se houver mais registros,
+    o cursor da próxima página vem no header X-Next-Cursor (repassar em ?cursor=).
+    """
+    paginar = limit is not None or cursor is not None
+    if limit is None:
+        limit = 500
+    if limit < 1 or limit > 1000:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 1000")
     try:
-        result = await db.execute(select(Cliente).where(Cliente.ativo == True))
+        stmt = select(Cliente).where(Cliente.tenant_id == tenant_id)
+        if not incluir_inativos:
+            stmt = stmt.where(Cliente.ativo == True)
+        if cursor:
+            try:
+                nome, id_txt = decodificar_cursor(cursor, 2)
+                stmt = stmt.where(tuple_(Cliente.nome, Cliente.id) > tuple_(nome, uuid.UUID(id_txt)))
+            except (ValueError, TypeError):
+                raise HTTPException(status_code=400, detail="Cursor inválido")
+
+        stmt = stmt.order_by(Cliente.nome, Cliente.id)
+        if not paginar:
+            return (await db.execute(stmt)).scalars().all()
+
+        # Uma linha a mais indica se há próxima página
+        result = await db.execute(stmt.limit(limit + 1))
         clientes = result.scalars().all()
+        if len(clientes) > limit:
+            clientes = clientes[:limit]
+            response.headers["X-Next-Cursor"] = codificar_cursor(clientes[-1].nome, clientes[-1].id)
         return clientes
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar clientes: {str(e)}")
 
+@router.get("/buscar", response_model=List[ClienteResponse])
+async def buscar(
+    q: str,
+    limit: int = 20,
+    incluir_inativos: bool = False,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Busca clientes por telefone, documento (NUIT) ou nome; melhores resultados primeiro."""
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 100")
+    try:
+        return await buscar_clientes(db, tenant_id, q, limite=limit, incluir_inativos=incluir_inativos)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar clientes: {str(e)}")
+
 @router.get("/{cliente_id}", response_model=ClienteResponse)
-async def obter_cliente(cliente_id: str, db: AsyncSession = Depends(get_db_session)):
+async def obter_cliente(
+    cliente_id: str,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
     """Obtém um cliente específico por UUID."""
     try:
-        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id))
+        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id, Cliente.tenant_id == tenant_id))
         cliente = result.scalar_one_or_none()
         
         if not cliente:
@@ -39,7 +103,11 @@ async def obter_cliente(cliente_id: str, db: AsyncSession = Depends(get_db_sessi
         raise HTTPException(status_code=500, detail=f"Erro ao obter cliente: {str(e)}")
 
 @router.post("/", response_model=ClienteResponse)
-async def criar_cliente(cliente: ClienteCreate, db: AsyncSession = Depends(get_db_session)):
+async def criar_cliente(
+    cliente: ClienteCreate,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
     """Cria um novo cliente."""
     try:
         # Criar novo cliente
@@ -52,6 +120,7 @@ async def criar_cliente(cliente: ClienteCreate, db: AsyncSession = Depends(get_d
         
         novo_cliente = Cliente(
             id=cliente_uuid,
+            tenant_id=tenant_id,
             nome=cliente.nome,
             documento=cliente.documento,
             telefone=cliente.telefone,
@@ -84,11 +153,16 @@ async def criar_cliente(cliente: ClienteCreate, db: AsyncSession = Depends(get_d
         raise HTTPException(status_code=500, detail=f"Erro ao criar cliente: {str(e)}")
 
 @router.put("/{cliente_id}", response_model=ClienteResponse)
-async def atualizar_cliente(cliente_id: str, cliente: ClienteUpdate, db: AsyncSession = Depends(get_db_session)):
+async def atualizar_cliente(
+    cliente_id: str,
+    cliente: ClienteUpdate,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
     """Atualiza um cliente existente."""
     try:
         # Buscar cliente existente
-        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id))
+        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id, Cliente.tenant_id == tenant_id))
         cliente_existente = result.scalar_one_or_none()
         
         if not cliente_existente:
@@ -107,12 +181,12 @@ async def atualizar_cliente(cliente_id: str, cliente: ClienteUpdate, db: AsyncSe
         update_data["updated_at"] = datetime.utcnow()
 
         await db.execute(
-            update(Cliente).where(Cliente.id == cliente_id).values(update_data)
+            update(Cliente).where(Cliente.id == cliente_id, Cliente.tenant_id == tenant_id).values(update_data)
         )
         await db.commit()
         
         # Retornar cliente atualizado
-        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id))
+        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id, Cliente.tenant_id == tenant_id))
         cliente_atualizado = result.scalar_one()
 
         # Broadcast realtime: cliente atualizado
@@ -137,19 +211,23 @@ async def atualizar_cliente(cliente_id: str, cliente: ClienteUpdate, db: AsyncSe
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar cliente: {str(e)}")
 
 @router.delete("/{cliente_id}")
-async def deletar_cliente(cliente_id: str, db: AsyncSession = Depends(get_db_session)):
+async def deletar_cliente(
+    cliente_id: str,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
     """Deleta um cliente (hard delete)."""
     try:
         # Buscar cliente existente (independente de ativo)
-        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id))
+        result = await db.execute(select(Cliente).where(Cliente.id == cliente_id, Cliente.tenant_id == tenant_id))
         cliente_existente = result.scalar_one_or_none()
         
         if not cliente_existente:
             raise HTTPException(status_code=404, detail="Cliente não encontrado")
         
-        # Hard delete (remoção física)
+        # Hard delete (remoção física); o change-log registra a exclusão para o sync/pull
         await db.execute(
-            delete(Cliente).where(Cliente.id == cliente_id)
+            delete(Cliente).where(Cliente.id == cliente_id, Cliente.tenant_id == tenant_id)
         )
         await db.commit()
 
@@ -169,3 +247,85 @@ async def deletar_cliente(cliente_id: str, db: AsyncSession = Depends(get_db_ses
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao deletar cliente: {str(e)}")
+
+# Endpoints de sincronização
+def _cliente_sync_dict(cliente: Cliente) -> dict:
+    return {
+        "uuid": str(cliente.id),
+        "nome": cliente.nome,
+        "documento": cliente.documento,
+        "telefone": cliente.telefone,
+        "endereco": cliente.endereco,
+        "ativo": cliente.ativo,
+        "created_at": cliente.created_at.isoformat() if cliente.created_at else None,
+        "updated_at": cliente.updated_at.isoformat() if cliente.updated_at else None,
+    }
+
+@router.get("/sync/pull")
+async def sync_pull_clientes(
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Clientes alterados desde o cursor e ids removidos (excluídos ou desativados).
+
+    Repetir com ?cursor=next_cursor enquanto has_more; guardar o último
+    next_cursor para o próximo sync.
+    """
+    if limit < 1 or limit > 5000:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 5000")
+    try:
+        delta = await sync_delta.pull(db, Cliente, ENTIDADE_SYNC, tenant_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar clientes para sincronização: {str(e)}")
+    return {
+        "clientes": [_cliente_sync_dict(c) for c in delta["registros"]],
+        "removidos": delta["removidos"],
+        "next_cursor": delta["next_cursor"],
+        "has_more": delta["has_more"],
+        "sync_timestamp": datetime.utcnow().isoformat(),
+    }
+
+@router.post("/sync/push")
+async def sync_push_clientes(
+    clientes: List[dict],
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Recebe clientes criados/alterados no dispositivo (upsert em lote, last-write-wins por updated_at)."""
+    registros, errors = [], []
+    for item in clientes:
+        ref = item.get("uuid") or item.get("id")
+        try:
+            nome = (item.get("nome") or "").strip()
+            if not nome:
+                raise ValueError("nome é obrigatório")
+            registros.append({
+                "id": uuid.UUID(str(ref)),
+                "nome": nome[:100],
+                "documento": item.get("documento"),
+                "telefone": item.get("telefone"),
+                "endereco": item.get("endereco"),
+                "ativo": bool(item.get("ativo", True)),
+                "updated_at": sync_delta.parse_instante(item.get("updated_at")),
+            })
+        except (ValueError, TypeError) as e:
+            errors.append({"uuid": ref or "unknown", "error": str(e)})
+
+    try:
+        resultado = await sync_delta.upsert_lww(db, Cliente, tenant_id, registros, _CAMPOS_SYNC)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro na sincronização: {str(e)}")
+
+    errors += [{"uuid": e["id"], "error": e["error"]} for e in resultado["erros"]]
+    return {
+        "synced_count": len(resultado["aplicados"]),
+        "ignored": resultado["ignorados"],
+        "errors": errors,
+        "message": f'{len(resultado["aplicados"])} clientes sincronizados com sucesso',
+    }
@@ -1,15 +1,22 @@
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import date, datetime
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import case, func, insert, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 import uuid
 
+from app.core.deps import get_tenant_id
+from app.core.paginacao import codificar_cursor, decodificar_cursor
 from app.db.database import get_db_session
-from app.db.models import Divida, ItemDivida, PagamentoDivida, Produto, Cliente, User
+from app.db.models import DATA_DIVIDA_AUSENTE_SQL, Divida, ItemDivida, PagamentoDivida, Produto, Cliente, User
+from app.services.estoque import ORIGEM_DIVIDA, notificar_baixo_estoque, registrar_saida, registrar_saidas_em_lote
+from app.services import saldos_clientes
 
 
-router = APIRouter(prefix="/api/dividas", tags=["dividas"])
+router = APIRouter(prefix="/api/dividas", tags=["dividas"], dependencies=[Depends(get_tenant_id)])
 
 
 class ItemDividaIn(BaseModel):
@@ -33,6 +40,16 @@ class PagamentoDividaIn(BaseModel):
     valor: float
     forma_pagamento: str
     usuario_id: Optional[str] = None
+    # UUID gerado no PDV: reenviar o mesmo pagamento não soma duas vezes
+    id: Optional[str] = None
+
+
+class PagamentoLoteItem(PagamentoDividaIn):
+    divida_id: str
+
+
+class PagamentoLoteRequest(BaseModel):
+    data: List[PagamentoLoteItem]
 
 
 class DividaSyncRequest(BaseModel):
@@ -72,8 +89,26 @@ def _parse_uuid(value: Optional[str]) -> Optional[uuid.UUID]:
         return None
 
 
+def _valores_divida(payload: DividaCreate) -> dict:
+    """Valores calculados da dívida (original, desconto e total) a partir dos itens."""
+    valor_original = sum(float(i.subtotal) for i in payload.itens)
+    desconto_aplicado = float(payload.desconto_aplicado or 0.0)
+    if payload.percentual_desconto and payload.percentual_desconto > 0:
+        desconto_aplicado = valor_original * (float(payload.percentual_desconto) / 100.0)
+    return {
+        "valor_original": valor_original,
+        "desconto_aplicado": desconto_aplicado,
+        "percentual_desconto": float(payload.percentual_desconto or 0.0),
+        "valor_total": max(0.0, valor_original - desconto_aplicado),
+    }
+
+
 @router.post("/", response_model=DividaOut, status_code=201)
-async def criar_divida(payload: DividaCreate, db: AsyncSession = Depends(get_db_session)):
+async def criar_divida(
+    payload: DividaCreate,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
     """Cria uma nova dívida com itens, alinhada ao modelo local do PDV3."""
     if not payload.itens:
         raise HTTPException(status_code=400, detail="É necessário informar pelo menos um item na dívida.")
@@ -83,24 +118,15 @@ async def criar_divida(payload: DividaCreate, db: AsyncSession = Depends(get_db_
         cliente_uuid = _parse_uuid(payload.cliente_id)
         usuario_uuid = _parse_uuid(payload.usuario_id)
 
-        # Calcular valores
-        valor_original = sum(float(i.subtotal) for i in payload.itens)
-        desconto_aplicado = float(payload.desconto_aplicado or 0.0)
-        if payload.percentual_desconto and payload.percentual_desconto > 0:
-            desconto_aplicado = valor_original * (float(payload.percentual_desconto) / 100.0)
-        valor_total = max(0.0, valor_original - desconto_aplicado)
-
         nova_divida = Divida(
+            tenant_id=tenant_id,
             id_local=payload.id_local,
             cliente_id=cliente_uuid,
             usuario_id=usuario_uuid,
-            valor_total=valor_total,
-            valor_original=valor_original,
-            desconto_aplicado=desconto_aplicado,
-            percentual_desconto=float(payload.percentual_desconto or 0.0),
             valor_pago=0.0,
             status="Pendente",
             observacao=payload.observacao,
+            **_valores_divida(payload),
         )
 
         db.add(nova_divida)
@@ -127,9 +153,24 @@ async def criar_divida(payload: DividaCreate, db: AsyncSession = Depends(get_db_
                 )
             )
 
+        # Baixa de estoque dos itens levados a crédito
+        movimentos = await registrar_saida(
+            db,
+            [(_parse_uuid(i.produto_id), float(i.quantidade)) for i in payload.itens],
+            ORIGEM_DIVIDA,
+            referencia_id=nova_divida.id,
+            usuario_id=usuario_uuid,
+        )
+        await saldos_clientes.atualizar_saldos(db, tenant_id, [cliente_uuid])
+
         await db.commit()
         await db.refresh(nova_divida)
 
+        try:
+            await notificar_baixo_estoque(db, movimentos)
+        except Exception:
+            pass
+
         # Injetar nome do cliente, se carregado
         try:
             setattr(nova_divida, 'cliente_nome', getattr(getattr(nova_divida, 'cliente', None), 'nome', None))
@@ -140,110 +181,184 @@ async def criar_divida(payload: DividaCreate, db: AsyncSession = Depends(get_db_
     except HTTPException:
         await db.rollback()
         raise
+    except IntegrityError as ie:
+        await db.rollback()
+        msg = str(ie.orig) if getattr(ie, 'orig', None) else str(ie)
+        if "uq_dividas_tenant_id_local" in msg:
+            raise HTTPException(status_code=409, detail=f"Dívida já existe para id_local {payload.id_local}")
+        raise HTTPException(status_code=400, detail=f"Violação de integridade ao criar dívida: {msg}")
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao criar dívida: {str(e)}")
 
 
-@router.post("/sync")
-async def sync_dividas(payload: DividaSyncRequest, db: AsyncSession = Depends(get_db_session)):
-    """Sincroniza dívidas em lote a partir do PDV, usando id_local como chave.
+# Linhas por INSERT multi-VALUES (limite de parâmetros por comando do PostgreSQL)
+_DIVIDAS_POR_INSERT = 1000
+
+
+def _erro_sync(idx: int, item: DividaCreate, detail: str) -> dict:
+    return {"index": idx, "id_local": item.id_local, "detail": detail}
+
+
+async def _inserir_lote_dividas(db: AsyncSession, lote: list) -> tuple[list, list, list]:
+    """Insere dívidas, itens e baixas de estoque de um lote com um INSERT por tabela.
 
-    Para cada registro em payload.data:
-    - Se existir uma dívida com mesmo id_local, é ignorada (idempotente).
-    - Caso contrário, é criada usando a mesma lógica da rota criar_divida.
+    `lote` são tuplas (idx, item, produto_uuids, linha_divida). Dívidas cujo
+    (tenant_id, id_local) já existe são ignoradas pelo banco (ON CONFLICT) e
+    voltam na segunda lista. Retorna (inseridas, já_existentes, linhas de estoque).
+    """
+    ids: set[uuid.UUID] = set()
+    for i in range(0, len(lote), _DIVIDAS_POR_INSERT):
+        result = await db.execute(
+            pg_insert(Divida)
+            .values([linha for *_, linha in lote[i:i + _DIVIDAS_POR_INSERT]])
+            .on_conflict_do_nothing(index_elements=[Divida.tenant_id, Divida.id_local])
+            .returning(Divida.id)
+        )
+        ids.update(result.scalars().all())
+    inseridas = [n for n in lote if n[3]["id"] in ids]
+    existentes = [n for n in lote if n[3]["id"] not in ids]
+    if not inseridas:
+        return inseridas, existentes, []
+
+    await db.execute(
+        insert(ItemDivida),
+        [
+            {
+                "divida_id": linha["id"],
+                "produto_id": produto_uuid,
+                "quantidade": float(it.quantidade),
+                "preco_unitario": float(it.preco_unitario),
+                "subtotal": float(it.subtotal),
+            }
+            for _, item, produtos, linha in inseridas
+            for it, produto_uuid in zip(item.itens, produtos)
+        ],
+    )
+    movimentos = await registrar_saidas_em_lote(
+        db,
+        [
+            (linha["id"], linha["usuario_id"], [(p, float(it.quantidade)) for it, p in zip(item.itens, produtos)])
+            for _, item, produtos, linha in inseridas
+        ],
+        ORIGEM_DIVIDA,
+    )
+    return inseridas, existentes, movimentos
+
+
+@router.post("/sync")
+async def sync_dividas(
+    payload: DividaSyncRequest,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Sincroniza dívidas em lote a partir do PDV, usando (tenant, id_local) como chave.
+
+    - Dívidas com id_local já existente são ignoradas (idempotente; garantido
+      pela constraint única no banco, não por leitura prévia).
+    - id_locals existentes e produtos conhecidos são buscados em duas consultas;
+      dívidas, itens e baixas de estoque do lote vão em um INSERT/UPDATE por tabela.
+    - Se o lote falhar no banco (ex.: cliente inexistente), cada dívida é
+      gravada no seu próprio savepoint: só as com erro ficam de fora.
     """
     if not payload.data:
         return {"status": "ok", "created": 0, "skipped": 0, "errors": []}
 
-    created = 0
     skipped = 0
     errors: List[dict] = []
 
+    # Validação que não depende do banco
+    candidatos = []
+    vistos: set[int] = set()
     for idx, item in enumerate(payload.data):
-        try:
-            # Verificar se já existe dívida com mesmo id_local
-            if item.id_local is not None:
-                stmt = select(Divida).where(Divida.id_local == item.id_local)
-                result = await db.execute(stmt)
-                existente = result.scalar_one_or_none()
-                if existente:
-                    skipped += 1
-                    continue
-
-            # Reusar lógica básica de criação (sem duplicar validações de forma exata)
-            if not item.itens:
-                raise HTTPException(status_code=400, detail="Dívida sem itens não pode ser sincronizada.")
-
-            cliente_uuid = _parse_uuid(item.cliente_id)
-            usuario_uuid = _parse_uuid(item.usuario_id)
-
-            valor_original = sum(float(i.subtotal) for i in item.itens)
-            desconto_aplicado = float(item.desconto_aplicado or 0.0)
-            if item.percentual_desconto and item.percentual_desconto > 0:
-                desconto_aplicado = valor_original * (float(item.percentual_desconto) / 100.0)
-            valor_total = max(0.0, valor_original - desconto_aplicado)
-
-            nova_divida = Divida(
-                id_local=item.id_local,
-                cliente_id=cliente_uuid,
-                usuario_id=usuario_uuid,
-                valor_total=valor_total,
-                valor_original=valor_original,
-                desconto_aplicado=desconto_aplicado,
-                percentual_desconto=float(item.percentual_desconto or 0.0),
-                valor_pago=0.0,
-                status="Pendente",
-                observacao=item.observacao,
-            )
+        if not item.itens:
+            errors.append(_erro_sync(idx, item, "Dívida sem itens não pode ser sincronizada."))
+            continue
+        produtos = [_parse_uuid(it.produto_id) for it in item.itens]
+        invalido = next((it.produto_id for it, p in zip(item.itens, produtos) if p is None), None)
+        if invalido is not None:
+            errors.append(_erro_sync(idx, item, f"produto_id inválido: {invalido}"))
+            continue
+        if item.id_local is not None:
+            if item.id_local in vistos:
+                skipped += 1
+                continue
+            vistos.add(item.id_local)
+        candidatos.append((idx, item, produtos))
+
+    # Duas consultas: id_locals já sincronizados e produtos existentes
+    existentes: set[int] = set()
+    if vistos:
+        result = await db.execute(
+            select(Divida.id_local).where(Divida.tenant_id == tenant_id, Divida.id_local.in_(vistos))
+        )
+        existentes = set(result.scalars().all())
+    produto_ids = {p for _, _, produtos in candidatos for p in produtos}
+    conhecidos: set[uuid.UUID] = set()
+    if produto_ids:
+        result = await db.execute(select(Produto.id).where(Produto.id.in_(produto_ids)))
+        conhecidos = set(result.scalars().all())
+
+    lote = []
+    for idx, item, produtos in candidatos:
+        if item.id_local is not None and item.id_local in existentes:
+            skipped += 1
+            continue
+        faltando = next((it.produto_id for it, p in zip(item.itens, produtos) if p not in conhecidos), None)
+        if faltando is not None:
+            errors.append(_erro_sync(idx, item, f"Produto inexistente no servidor: {faltando}"))
+            continue
+        linha = {
+            "id": uuid.uuid4(),
+            "tenant_id": tenant_id,
+            "id_local": item.id_local,
+            "cliente_id": _parse_uuid(item.cliente_id),
+            "usuario_id": _parse_uuid(item.usuario_id),
+            "valor_pago": 0.0,
+            "status": "Pendente",
+            "observacao": item.observacao,
+            **_valores_divida(item),
+        }
+        lote.append((idx, item, produtos, linha))
 
-            db.add(nova_divida)
-            await db.flush()
-
-            # Criar itens associados
-            for it in item.itens:
-                prod_uuid = _parse_uuid(it.produto_id)
-                if not prod_uuid:
-                    raise HTTPException(status_code=400, detail=f"produto_id inválido: {it.produto_id}")
-
-                result_prod = await db.execute(select(Produto).where(Produto.id == prod_uuid))
-                if not result_prod.scalar_one_or_none():
-                    raise HTTPException(status_code=400, detail=f"Produto inexistente no servidor: {it.produto_id}")
-
-                db.add(
-                    ItemDivida(
-                        divida_id=nova_divida.id,
-                        produto_id=prod_uuid,
-                        quantidade=float(it.quantidade),
-                        preco_unitario=float(it.preco_unitario),
-                        subtotal=float(it.subtotal),
-                    )
-                )
+    created = 0
+    movimentos: list = []
+    clientes: set[uuid.UUID] = set()
+    if lote:
+        try:
+            async with db.begin_nested():
+                inseridas, repetidas, movs = await _inserir_lote_dividas(db, lote)
+            created += len(inseridas)
+            skipped += len(repetidas)
+            movimentos += movs
+            clientes.update(n[3]["cliente_id"] for n in inseridas)
+        except Exception:
+            # Isolar o(s) registro(s) com problema: um savepoint por dívida
+            for n in lote:
+                try:
+                    async with db.begin_nested():
+                        inseridas, repetidas, movs = await _inserir_lote_dividas(db, [n])
+                    created += len(inseridas)
+                    skipped += len(repetidas)
+                    movimentos += movs
+                    clientes.update(i[3]["cliente_id"] for i in inseridas)
+                except Exception as ex:
+                    msg = str(getattr(ex, "orig", None) or ex)
+                    errors.append(_erro_sync(n[0], n[1], msg))
 
-            created += 1
-        except HTTPException as he:
-            # Erro específico deste registro; acumular mas continuar os demais
-            errors.append({
-                "index": idx,
-                "id_local": item.id_local,
-                "detail": he.detail,
-            })
-            await db.rollback()
-        except Exception as ex:
-            errors.append({
-                "index": idx,
-                "id_local": item.id_local,
-                "detail": str(ex),
-            })
-            await db.rollback()
-
-    # Commit uma vez ao final para as dívidas bem sucedidas
     try:
+        await saldos_clientes.atualizar_saldos(db, tenant_id, clientes)
         await db.commit()
     except Exception as ex:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao finalizar sync de dívidas: {str(ex)}")
 
+    try:
+        await notificar_baixo_estoque(db, movimentos)
+    except Exception:
+        pass
+
+    errors.sort(key=lambda e: e["index"])
     return {
         "status": "ok" if not errors else "partial",
         "created": created,
@@ -252,18 +367,205 @@ async def sync_dividas(payload: DividaSyncRequest, db: AsyncSession = Depends(ge
     }
 
 
+@router.get("/saldos")
+async def listar_saldos_clientes(
+    apenas_em_aberto: bool = True,
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Saldo de dívidas por cliente (total, pago, em aberto, aberta desde), maior saldo primeiro."""
+    if limit < 1 or limit > 1000 or offset < 0:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 1000 e offset >= 0")
+    try:
+        return await saldos_clientes.listar_saldos(db, tenant_id, apenas_em_aberto, limit, offset)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao listar saldos: {str(e)}")
+
+
+@router.get("/aging")
+async def aging_dividas(
+    data_referencia: Optional[str] = None,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Valores em aberto por faixa de atraso (0–30, 31–60, 61–90, 90+ dias), totais e por cliente."""
+    referencia = None
+    if data_referencia:
+        try:
+            referencia = date.fromisoformat(data_referencia)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Parâmetro de data inválido. Use YYYY-MM-DD")
+    if limit < 1 or limit > 1000:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 1000")
+    try:
+        return await saldos_clientes.aging(db, tenant_id, referencia, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular aging: {str(e)}")
+
+
+# Campos que a listagem pode projetar (?campos=...): nome -> expressão
+_CAMPOS_LISTAGEM = {
+    "id_local": Divida.id_local,
+    "cliente_id": Divida.cliente_id,
+    "usuario_id": Divida.usuario_id,
+    "cliente_nome": Cliente.nome,
+    "data_divida": Divida.data_divida,
+    "valor_total": Divida.valor_total,
+    "valor_original": Divida.valor_original,
+    "desconto_aplicado": Divida.desconto_aplicado,
+    "percentual_desconto": Divida.percentual_desconto,
+    "valor_pago": Divida.valor_pago,
+    "status": Divida.status,
+    "observacao": Divida.observacao,
+}
+_INCLUDES = ("itens", "pagamentos")
+_STATUS_LISTAGEM = ("todas", "abertas", "quitadas")
+_IN_POR_CONSULTA = 1000
+
+
+def _lista_param(valor: Optional[str], permitidos, nome: str) -> list[str]:
+    itens = [v.strip() for v in (valor or "").split(",") if v.strip()]
+    invalidos = [v for v in itens if v not in permitidos]
+    if invalidos:
+        raise HTTPException(status_code=400, detail=f"{nome} inválido(s): {', '.join(invalidos)} (use {', '.join(permitidos)})")
+    return itens
+
+
+def _json_valor(valor):
+    if isinstance(valor, uuid.UUID):
+        return str(valor)
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+async def _carregar_por_divida(db: AsyncSession, colunas: tuple, coluna_divida, ordem, ids: list) -> dict:
+    """Linhas filhas (itens/pagamentos) das dívidas da página, em consultas IN por lote."""
+    por_divida: dict = {i: [] for i in ids}
+    for i in range(0, len(ids), _IN_POR_CONSULTA):
+        result = await db.execute(
+            select(*colunas).where(coluna_divida.in_(ids[i:i + _IN_POR_CONSULTA])).order_by(ordem)
+        )
+        for r in result.mappings():
+            linha = {k: _json_valor(v) for k, v in r.items()}
+            por_divida[r["divida_id"]].append(linha)
+    return por_divida
+
+
+@router.get("/")
+async def listar_dividas(
+    status: str = "todas",
+    cliente_id: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    incluir: Optional[str] = None,
+    campos: Optional[str] = None,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Lista dívidas do tenant, mais recentes primeiro, paginadas por keyset.
+
+    - status: todas | abertas | quitadas
+    - cursor: `next_cursor` da página anterior (data_divida + id do último registro)
+    - incluir: itens,pagamentos (carregados em consultas IN para a página toda)
+    - campos: projeção (ex.: cliente_nome,valor_total,valor_pago,status); `id` vem sempre
+    """
+    if status not in _STATUS_LISTAGEM:
+        raise HTTPException(status_code=400, detail=f"status inválido (use {', '.join(_STATUS_LISTAGEM)})")
+    if limit < 1 or limit > 500:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 500")
+    includes = _lista_param(incluir, _INCLUDES, "incluir")
+    selecionados = _lista_param(campos, tuple(_CAMPOS_LISTAGEM), "campos") or list(_CAMPOS_LISTAGEM)
+
+    # Mesma expressão do índice ix_dividas_tenant_ordem: dívidas sem data no fim
+    data_ordem = func.coalesce(Divida.data_divida, literal_column(DATA_DIVIDA_AUSENTE_SQL))
+    colunas = [Divida.id, data_ordem.label("_cursor_data")]
+    colunas += [_CAMPOS_LISTAGEM[c].label(c) for c in selecionados]
+    stmt = select(*colunas).where(Divida.tenant_id == tenant_id)
+    if "cliente_nome" in selecionados:
+        stmt = stmt.outerjoin(Cliente, Divida.cliente_id == Cliente.id)
+    if status == "abertas":
+        stmt = stmt.where(Divida.status != "Quitado")
+    elif status == "quitadas":
+        stmt = stmt.where(Divida.status == "Quitado")
+    if cliente_id:
+        cliente_uuid = _parse_uuid(cliente_id)
+        if not cliente_uuid:
+            raise HTTPException(status_code=400, detail="cliente_id inválido.")
+        stmt = stmt.where(Divida.cliente_id == cliente_uuid)
+    if cursor:
+        try:
+            data_txt, id_txt = decodificar_cursor(cursor, 2)
+            cursor_data = datetime.fromisoformat(data_txt)
+            cursor_id = uuid.UUID(id_txt)
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        stmt = stmt.where(tuple_(data_ordem, Divida.id) < tuple_(cursor_data, cursor_id))
+
+    try:
+        # Uma linha a mais indica se há próxima página
+        rows = (await db.execute(
+            stmt.order_by(data_ordem.desc(), Divida.id.desc()).limit(limit + 1)
+        )).mappings().all()
+        pagina = rows[:limit]
+        ids = [r["id"] for r in pagina]
+
+        itens = pagamentos = None
+        if "itens" in includes and ids:
+            itens = await _carregar_por_divida(
+                db,
+                (ItemDivida.id, ItemDivida.divida_id, ItemDivida.produto_id,
+                 select(Produto.nome).where(Produto.id == ItemDivida.produto_id).scalar_subquery().label("produto_nome"),
+                 ItemDivida.quantidade, ItemDivida.preco_unitario, ItemDivida.subtotal),
+                ItemDivida.divida_id, ItemDivida.created_at, ids,
+            )
+        if "pagamentos" in includes and ids:
+            pagamentos = await _carregar_por_divida(
+                db,
+                (PagamentoDivida.id, PagamentoDivida.divida_id, PagamentoDivida.data_pagamento,
+                 PagamentoDivida.valor, PagamentoDivida.forma_pagamento, PagamentoDivida.usuario_id),
+                PagamentoDivida.divida_id, PagamentoDivida.data_pagamento, ids,
+            )
+
+        data = []
+        for r in pagina:
+            item = {"id": str(r["id"])}
+            for c in selecionados:
+                item[c] = _json_valor(r[c])
+            if "itens" in includes:
+                item["itens"] = itens.get(r["id"], []) if itens else []
+            if "pagamentos" in includes:
+                item["pagamentos"] = pagamentos.get(r["id"], []) if pagamentos else []
+            data.append(item)
+
+        next_cursor = None
+        if len(rows) > limit:
+            ultimo = pagina[-1]
+            next_cursor = codificar_cursor(ultimo["_cursor_data"].isoformat(), ultimo["id"])
+        return {"data": data, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao listar dívidas: {str(e)}")
+
+
 @router.get("/abertas", response_model=List[DividaOut])
 async def listar_dividas_abertas(
     cliente_id: Optional[str] = None,
     db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
-    """Lista dívidas com status diferente de 'Quitado', opcionalmente filtrando por cliente."""
+    """Lista dívidas com status diferente de 'Quitado', opcionalmente filtrando por cliente.
+
+    Sem paginação (compatibilidade); telas novas devem usar GET /api/dividas/?status=abertas.
+    """
     try:
-        # Join com Cliente para obter nome
         stmt = (
-            select(Divida, Cliente.nome.label("cliente_nome"))
-            .join(Cliente, Divida.cliente_id == Cliente.id, isouter=True)
-            .where(Divida.status != "Quitado")
+            select(*_COLUNAS_DIVIDA_OUT)
+            .where(Divida.tenant_id == tenant_id, Divida.status != "Quitado")
         )
 
         cliente_uuid = _parse_uuid(cliente_id)
@@ -271,67 +573,187 @@ async def listar_dividas_abertas(
             stmt = stmt.where(Divida.cliente_id == cliente_uuid)
 
         result = await db.execute(stmt.order_by(Divida.data_divida.desc()))
-        rows = result.all()
-
-        resposta: list[DividaOut] = []
-        for divida, cli_nome in rows:
-            try:
-                setattr(divida, 'cliente_nome', cli_nome)
-            except Exception:
-                setattr(divida, 'cliente_nome', None)
-            resposta.append(DividaOut.model_validate(divida))
-        return resposta
+        return [_divida_out(r) for r in result.all()]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar dívidas: {str(e)}")
 
 
-@router.post("/{divida_id}/pagamentos", response_model=DividaOut)
-async def registrar_pagamento_divida(divida_id: str, payload: PagamentoDividaIn, db: AsyncSession = Depends(get_db_session)):
-    """Registra um pagamento (parcial ou total) para uma dívida existente."""
+# Colunas devolvidas pelo UPDATE do pagamento (nome do cliente via subconsulta,
+# sem recarregar a dívida nem o relacionamento depois do commit)
+_COLUNAS_DIVIDA_OUT = (
+    Divida.id,
+    Divida.id_local,
+    Divida.cliente_id,
+    Divida.usuario_id,
+    select(Cliente.nome).where(Cliente.id == Divida.cliente_id).scalar_subquery().label("cliente_nome"),
+    Divida.data_divida,
+    Divida.valor_total,
+    Divida.valor_original,
+    Divida.desconto_aplicado,
+    Divida.percentual_desconto,
+    Divida.valor_pago,
+    Divida.status,
+    Divida.observacao,
+)
+
+
+def _divida_out(r) -> DividaOut:
+    return DividaOut(
+        id=str(r.id),
+        id_local=r.id_local,
+        cliente_id=str(r.cliente_id) if r.cliente_id else None,
+        usuario_id=str(r.usuario_id) if r.usuario_id else None,
+        cliente_nome=r.cliente_nome,
+        data_divida=r.data_divida.isoformat() if r.data_divida else "",
+        valor_total=float(r.valor_total or 0),
+        valor_original=float(r.valor_original or 0),
+        desconto_aplicado=float(r.desconto_aplicado or 0),
+        percentual_desconto=float(r.percentual_desconto or 0),
+        valor_pago=float(r.valor_pago or 0),
+        status=r.status,
+        observacao=r.observacao,
+    )
+
+
+class _PagamentoInvalido(Exception):
+    def __init__(self, status_code: int, detail: str) -> None:
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+async def _aplicar_pagamento(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    divida_uuid: uuid.UUID,
+    payload: PagamentoDividaIn,
+):
+    """Registra o pagamento e soma na dívida sem ler antes (seguro com caixas concorrentes).
+
+    - o pagamento é inserido primeiro; com `id` já gravado (reenvio do PDV) nada
+      é somado e a dívida é devolvida como está — 409 se esse pagamento é de
+      outra dívida;
+    - `UPDATE ... SET valor_pago = valor_pago + :valor` com o status calculado na
+      mesma instrução: o lock de linha do UPDATE serializa pagamentos simultâneos.
+    Lança _PagamentoInvalido; não faz commit.
+    """
     if payload.valor <= 0:
-        raise HTTPException(status_code=400, detail="Valor do pagamento deve ser maior que zero.")
-
-    try:
-        divida_uuid = _parse_uuid(divida_id)
-        if not divida_uuid:
-            raise HTTPException(status_code=400, detail="ID de dívida inválido.")
-
-        result = await db.execute(select(Divida).where(Divida.id == divida_uuid))
-        divida = result.scalar_one_or_none()
-        if not divida:
-            raise HTTPException(status_code=404, detail="Dívida não encontrada.")
-
-        # Registrar pagamento
-        usuario_uuid = _parse_uuid(payload.usuario_id)
-        pagamento = PagamentoDivida(
-            divida_id=divida.id,
-            valor=float(payload.valor),
+        raise _PagamentoInvalido(400, "Valor do pagamento deve ser maior que zero.")
+    pagamento_id = uuid.uuid4()
+    if payload.id:
+        pagamento_id = _parse_uuid(payload.id)
+        if pagamento_id is None:
+            raise _PagamentoInvalido(400, "ID de pagamento inválido.")
+
+    valor = float(payload.valor)
+    inserido = await db.execute(
+        pg_insert(PagamentoDivida)
+        .values(
+            id=pagamento_id,
+            divida_id=divida_uuid,
+            valor=valor,
             forma_pagamento=payload.forma_pagamento,
-            usuario_id=usuario_uuid,
+            usuario_id=_parse_uuid(payload.usuario_id),
         )
-        db.add(pagamento)
-
-        # Atualizar valores agregados da dívida
-        novo_valor_pago = float(divida.valor_pago or 0.0) + float(payload.valor)
-        divida.valor_pago = novo_valor_pago
-        if novo_valor_pago >= float(divida.valor_total) - 0.01:
-            divida.status = "Quitado"
-        else:
-            divida.status = "Parcial"
+        .on_conflict_do_nothing(index_elements=[PagamentoDivida.id])
+        .returning(PagamentoDivida.id)
+    )
+    filtro = (Divida.id == divida_uuid, Divida.tenant_id == tenant_id)
+    if inserido.first() is None:
+        existente = await db.scalar(select(PagamentoDivida.divida_id).where(PagamentoDivida.id == pagamento_id))
+        if existente != divida_uuid:
+            raise _PagamentoInvalido(409, f"Pagamento {pagamento_id} já registrado em outra dívida.")
+        row = (await db.execute(select(*_COLUNAS_DIVIDA_OUT).where(*filtro))).first()
+    else:
+        novo_valor_pago = func.coalesce(Divida.valor_pago, 0.0) + valor
+        row = (await db.execute(
+            update(Divida)
+            .where(*filtro)
+            .values(
+                valor_pago=novo_valor_pago,
+                status=case((novo_valor_pago >= Divida.valor_total - 0.01, "Quitado"), else_="Parcial"),
+                updated_at=func.now(),
+            )
+            .returning(*_COLUNAS_DIVIDA_OUT)
+            .execution_options(synchronize_session=False)
+        )).first()
+    if row is None:
+        raise _PagamentoInvalido(404, "Dívida não encontrada.")
+    return row
 
-        await db.commit()
-        await db.refresh(divida)
 
-        # Injetar nome do cliente, se disponível
-        try:
-            setattr(divida, 'cliente_nome', getattr(getattr(divida, 'cliente', None), 'nome', None))
-        except Exception:
-            setattr(divida, 'cliente_nome', None)
+@router.post("/{divida_id}/pagamentos", response_model=DividaOut)
+async def registrar_pagamento_divida(
+    divida_id: str,
+    payload: PagamentoDividaIn,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Registra um pagamento (parcial ou total) para uma dívida existente."""
+    divida_uuid = _parse_uuid(divida_id)
+    if not divida_uuid:
+        raise HTTPException(status_code=400, detail="ID de dívida inválido.")
 
-        return DividaOut.model_validate(divida)
-    except HTTPException:
+    try:
+        row = await _aplicar_pagamento(db, tenant_id, divida_uuid, payload)
+        await saldos_clientes.atualizar_saldos(db, tenant_id, [row.cliente_id])
+        await db.commit()
+        return _divida_out(row)
+    except _PagamentoInvalido as e:
         await db.rollback()
-        raise
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except IntegrityError:
+        # FK de divida_id: dívida inexistente
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="Dívida não encontrada.")
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao registrar pagamento da dívida: {str(e)}")
+
+
+@router.post("/pagamentos/lote")
+async def registrar_pagamentos_lote(
+    payload: PagamentoLoteRequest,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Aplica pagamentos em lote (reenvio de pagamentos feitos offline no PDV).
+
+    Cada pagamento roda no seu savepoint: os inválidos voltam em `errors` e não
+    impedem os demais. Pagamentos com `id` já registrado não somam de novo.
+    Os locks são tomados em ordem de divida_id (evita deadlock entre lotes).
+    """
+    resultados: list[Optional[dict]] = [None] * len(payload.data)
+    errors: List[dict] = []
+    clientes: set[uuid.UUID] = set()
+    ordem = sorted(range(len(payload.data)), key=lambda i: payload.data[i].divida_id)
+    for idx in ordem:
+        item = payload.data[idx]
+        divida_uuid = _parse_uuid(item.divida_id)
+        if not divida_uuid:
+            errors.append({"index": idx, "divida_id": item.divida_id, "detail": "ID de dívida inválido."})
+            continue
+        try:
+            async with db.begin_nested():
+                row = await _aplicar_pagamento(db, tenant_id, divida_uuid, item)
+            resultados[idx] = _divida_out(row).model_dump()
+            clientes.add(row.cliente_id)
+        except _PagamentoInvalido as e:
+            errors.append({"index": idx, "divida_id": item.divida_id, "detail": e.detail})
+        except IntegrityError:
+            errors.append({"index": idx, "divida_id": item.divida_id, "detail": "Dívida não encontrada."})
+
+    try:
+        await saldos_clientes.atualizar_saldos(db, tenant_id, clientes)
+        await db.commit()
+    except Exception as ex:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro ao finalizar pagamentos em lote: {str(ex)}")
+
+    errors.sort(key=lambda e: e["index"])
+    return {
+        "status": "ok" if not errors else "partial",
+        "applied": sum(1 for r in resultados if r is not None),
+        "dividas": [r for r in resultados if r is not None],
+        "errors": errors,
+    }
@@ -7,22 +7,24 @@ from sqlalchemy import select
 from app.db.database import get_db_session
 from app.db.models import EmpresaConfig
 from app.core.deps import get_current_admin_user, get_tenant_id
+from app.services import empresa as empresa_service
 import uuid
 
-router = APIRouter(prefix="/api/config", tags=["configuracao"])
+router = APIRouter(prefix="/api/config", tags=["configuracao"], dependencies=[Depends(get_tenant_id)])
 
 
-async def _get_singleton_config(db: AsyncSession, tenant_id: uuid.UUID) -> EmpresaConfig:
-  """Retorna o registro único de configuração de empresa por tenant, criando se não existir."""
+async def _get_or_create_config(db: AsyncSession, tenant_id: uuid.UUID) -> EmpresaConfig:
+  """Registro de configuração do tenant para escrita; criado (sem commit) se não existir."""
   result = await db.execute(
-    select(EmpresaConfig).where(EmpresaConfig.tenant_id == tenant_id)
+    select(EmpresaConfig)
+    .where(EmpresaConfig.tenant_id == tenant_id)
+    .order_by(EmpresaConfig.created_at)
+    .limit(1)
   )
   cfg = result.scalar_one_or_none()
   if cfg is None:
     cfg = EmpresaConfig(tenant_id=tenant_id)
     db.add(cfg)
-    await db.commit()
-    await db.refresh(cfg)
   return cfg
 
 
@@ -31,16 +33,9 @@ async def get_empresa_config(
   db: AsyncSession = Depends(get_db_session),
   tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
-  cfg = await _get_singleton_config(db, tenant_id)
-  return {
-    "id": str(cfg.id),
-    "nome": cfg.nome,
-    "nuit": cfg.nuit,
-    "telefone": cfg.telefone,
-    "email": cfg.email,
-    "endereco": cfg.endereco,
-    "logo_path": cfg.logo_path,
-  }
+  # Leitura pura: perfil do cache (ou padrão, se o tenant ainda não configurou)
+  perfil = await empresa_service.obter_perfil(db, tenant_id)
+  return perfil.to_dict()
 
 
 @router.put("/empresa")
@@ -50,25 +45,30 @@ async def update_empresa_config(
   tenant_id: uuid.UUID = Depends(get_tenant_id),
   user=Depends(get_current_admin_user),
 ):
-  cfg = await _get_singleton_config(db, tenant_id)
+  cfg = await _get_or_create_config(db, tenant_id)
 
   cfg.nome = payload.get("nome", cfg.nome)
   cfg.nuit = payload.get("nuit", cfg.nuit)
   cfg.telefone = payload.get("telefone", cfg.telefone)
   cfg.email = payload.get("email", cfg.email)
   cfg.endereco = payload.get("endereco", cfg.endereco)
+  if payload.get("estoque_baixo_padrao") is not None:
+    try:
+      cfg.estoque_baixo_padrao = float(payload["estoque_baixo_padrao"])
+    except (TypeError, ValueError):
+      raise HTTPException(status_code=400, detail="estoque_baixo_padrao inválido")
+  if "categorias_sem_estoque" in payload:
+    try:
+      cfg.categorias_sem_estoque = [int(c) for c in (payload["categorias_sem_estoque"] or [])]
+    except (TypeError, ValueError):
+      raise HTTPException(status_code=400, detail="categorias_sem_estoque deve ser uma lista de ids")
 
   db.add(cfg)
-  await db.commit()
+  try:
+    await db.commit()
+  finally:
+    empresa_service.invalidar(tenant_id)
   await db.refresh(cfg)
 
-  return {
-    "id": str(cfg.id),
-    "nome": cfg.nome,
-    "nuit": cfg.nuit,
-    "telefone": cfg.telefone,
-    "email": cfg.email,
-    "endereco": cfg.endereco,
-    "logo_path": cfg.logo_path,
-  }
-
+  perfil = empresa_service.atualizar_cache(cfg)
+  return perfil.to_dict()
@@ -2,29 +2,41 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi import Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import asyncio
+import uuid
 
 from ..db.database import get_db_session
 from ..db.models import Venda, ItemVenda, Produto
+from ..core.deps import get_tenant_id
+from ..services import metricas_vendas
 
-router = APIRouter(prefix="/api/metricas", tags=["metricas"]) 
+router = APIRouter(prefix="/api/metricas", tags=["metricas"], dependencies=[Depends(get_tenant_id)])
 
-# Cache em memória simples para suavizar cold start (TTL curto)
-_metrics_cache = {
-    "vendas_dia": {"value": None, "ts": 0.0},
-    "vendas_mes": {"value": None, "ts": 0.0},
-}
+# Cache em memória simples para suavizar cold start (TTL curto), por (métrica, tenant, período)
+_metrics_cache: dict = {}
 _cache_ttl_seconds = 15
 _cache_lock = asyncio.Lock()
 
 def _now_ts() -> float:
     return datetime.utcnow().timestamp()
 
+def _cache_get(chave, fresco: bool = True):
+    entrada = _metrics_cache.get(chave)
+    if entrada is None or (fresco and (_now_ts() - entrada["ts"]) >= _cache_ttl_seconds):
+        return None
+    return entrada["value"]
+
+def _cache_set(chave, valor) -> None:
+    if len(_metrics_cache) >= 1000:
+        _metrics_cache.clear()
+    _metrics_cache[chave] = {"value": valor, "ts": _now_ts()}
+
 @router.get("/vendas-dia")
 async def vendas_dia(
     data: str | None = Query(default=None, description="Data no formato YYYY-MM-DD (timezone do cliente)"),
-    db: AsyncSession = Depends(get_db_session)
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
     """Retorna o total de vendas (não canceladas) do dia informado (ou dia atual)."""
     # Data alvo: usar a recebida do cliente ou o dia do servidor
@@ -32,10 +44,12 @@ async def vendas_dia(
         alvo = date.fromisoformat(data) if data else date.today()
     except Exception:
         alvo = date.today()
+    chave = ("vendas_dia", tenant_id, alvo)
     # Servir cache se fresco
     async with _cache_lock:
-        if _metrics_cache["vendas_dia"]["value"] is not None and (_now_ts() - _metrics_cache["vendas_dia"]["ts"]) < _cache_ttl_seconds:
-            return {"data": str(alvo), "total": float(_metrics_cache["vendas_dia"]["value"]) }
+        cached = _cache_get(chave)
+    if cached is not None:
+        return {"data": str(alvo), "total": float(cached)}
 
     stmt = select(func.coalesce(func.sum(Venda.total), 0.0)).where(
         Venda.cancelada == False,
@@ -47,7 +61,7 @@ async def vendas_dia(
             result = await db.execute(stmt)
             total = float(result.scalar() or 0.0)
             async with _cache_lock:
-                _metrics_cache["vendas_dia"] = {"value": total, "ts": _now_ts()}
+                _cache_set(chave, total)
             return {"data": str(alvo), "total": total}
         except Exception:
             if attempt == 0:
@@ -55,26 +69,28 @@ async def vendas_dia(
                 continue
             # Fallback: servir cache antigo se existir, senão 0
             async with _cache_lock:
-                cached = _metrics_cache["vendas_dia"]["value"]
+                cached = _cache_get(chave, fresco=False)
             return {"data": str(alvo), "total": float(cached or 0.0), "warning": "cached"}
 
 @router.get("/vendas-mes")
 async def vendas_mes(
     ano_mes: str | None = Query(default=None, description="Ano-mês no formato YYYY-MM (timezone do cliente)"),
-    db: AsyncSession = Depends(get_db_session)
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
     """Retorna o total de vendas (não canceladas) do mês informado (ou mês atual)."""
-    try:
-        if ano_mes:
-            try:
-                ano, mes = map(int, ano_mes.split("-"))
-                primeiro_dia = date(ano, mes, 1)
-            except Exception:
-                dnow = datetime.utcnow()
-                primeiro_dia = date(dnow.year, dnow.month, 1)
-        else:
+    if ano_mes:
+        try:
+            ano, mes = map(int, ano_mes.split("-"))
+            primeiro_dia = date(ano, mes, 1)
+        except Exception:
             dnow = datetime.utcnow()
             primeiro_dia = date(dnow.year, dnow.month, 1)
+    else:
+        dnow = datetime.utcnow()
+        primeiro_dia = date(dnow.year, dnow.month, 1)
+    chave = ("vendas_mes", tenant_id, primeiro_dia)
+    try:
         # próximo mês
         proximo_mes = date(
             primeiro_dia.year + (1 if primeiro_dia.month == 12 else 0),
@@ -89,28 +105,56 @@ async def vendas_mes(
         )
         # Servir cache se fresco
         async with _cache_lock:
-            if _metrics_cache["vendas_mes"]["value"] is not None and (_now_ts() - _metrics_cache["vendas_mes"]["ts"]) < _cache_ttl_seconds:
-                return {"ano_mes": primeiro_dia.strftime("%Y-%m"), "total": float(_metrics_cache["vendas_mes"]["value"]) }
+            cached = _cache_get(chave)
+        if cached is not None:
+            return {"ano_mes": primeiro_dia.strftime("%Y-%m"), "total": float(cached)}
 
         for attempt in range(2):
             try:
                 result = await db.execute(stmt)
                 total = float(result.scalar() or 0.0)
                 async with _cache_lock:
-                    _metrics_cache["vendas_mes"] = {"value": total, "ts": _now_ts()}
+                    _cache_set(chave, total)
                 return {"ano_mes": primeiro_dia.strftime("%Y-%m"), "total": total}
             except Exception:
                 if attempt == 0:
                     await asyncio.sleep(0.2)
                     continue
                 async with _cache_lock:
-                    cached = _metrics_cache["vendas_mes"]["value"]
+                    cached = _cache_get(chave, fresco=False)
                 return {"ano_mes": primeiro_dia.strftime("%Y-%m"), "total": float(cached or 0.0), "warning": "cached"}
     except Exception:
-        # Falha inesperada: retornar cache ou zero
+        # Falha inesperada: servir cache antigo se existir, senão 0
         async with _cache_lock:
-            cached = _metrics_cache["vendas_mes"]["value"]
-        return {"ano_mes": datetime.utcnow().strftime("%Y-%m"), "total": float(cached or 0.0), "warning": "cached"}
+            cached = _cache_get(chave, fresco=False)
+        return {"ano_mes": primeiro_dia.strftime("%Y-%m"), "total": float(cached or 0.0), "warning": "cached"}
+
+@router.get("/vendas/agregado")
+async def vendas_agregado(
+    data_inicio: str = Query(..., description="Data inicial YYYY-MM-DD"),
+    data_fim: str = Query(..., description="Data final YYYY-MM-DD (inclusiva)"),
+    bucket: str = Query(default="day", description="hour, day, week ou month"),
+    dimensoes: str | None = Query(default=None, description="Lista separada por vírgula: usuario, produto, forma_pagamento, categoria"),
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Somas e contagens de vendas agrupadas por bucket de tempo e dimensões.
+
+    Calculado no banco a partir do rollup horário. Com produto/categoria nas
+    dimensões só há métricas de item (itens, quantidade, receita); sem elas
+    vêm também vendas, total, desconto e ticket_medio.
+    """
+    try:
+        d1 = date.fromisoformat(data_inicio)
+        d2 = date.fromisoformat(data_fim)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Parâmetro de data inválido. Use YYYY-MM-DD")
+    if d2 < d1:
+        raise HTTPException(status_code=400, detail="data_fim deve ser maior ou igual a data_inicio")
+    try:
+        return await metricas_vendas.agregar_vendas(db, tenant_id, d1, d2 + timedelta(days=1), bucket, dimensoes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/estoque")
 async def metricas_estoque(
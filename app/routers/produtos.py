@@ -1,9 +1,9 @@
 """Endpoints para gerenciamento de produtos com sincronização."""
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete, or_
 from sqlalchemy.exc import IntegrityError
-from typing import List, Optional
+from typing import Dict, List, Optional
 import uuid
 from datetime import datetime
 import os
@@ -12,9 +12,19 @@ from app.db.database import get_db_session
 from app.db.models import Produto
 from app.core.realtime import manager as realtime_manager
 from app.core.deps import get_tenant_id
+from app.services import sync_delta
+from app.services.estoque import (
+    ORIGEM_ABERTURA,
+    ORIGEM_SYNC,
+    aplicar_movimentos,
+    filtro_baixo_estoque,
+    obter_limites,
+    registrar_ajuste,
+)
+from app.core.media import ALLOWED_EXTENSIONS, MEDIA_DIR, save_upload, generate_variants, remove_image, variant_urls
 from pydantic import BaseModel
 
-router = APIRouter(prefix="/api/produtos", tags=["Produtos"])
+router = APIRouter(prefix="/api/produtos", tags=["Produtos"], dependencies=[Depends(get_tenant_id)])
 
 # Schemas Pydantic
 class ProdutoCreate(BaseModel):
@@ -61,6 +71,8 @@ class ProdutoResponse(BaseModel):
     taxa_iva: float
     ativo: bool
     imagem_path: Optional[str] = None
+    # URLs por variante: original, thumb (64px), small (256px), medium (800px)
+    imagem_variantes: Optional[Dict[str, str]] = None
     created_at: datetime
     updated_at: datetime
 
@@ -84,6 +96,7 @@ class ProdutoResponse(BaseModel):
             taxa_iva=getattr(obj, "taxa_iva", 0.0),
             ativo=obj.ativo,
             imagem_path=getattr(obj, "imagem_path", None),
+            imagem_variantes=variant_urls(getattr(obj, "imagem_path", None)),
             created_at=obj.created_at,
             updated_at=obj.updated_at
         )
@@ -113,6 +126,28 @@ async def get_produtos(
             detail=f"Erro ao buscar produtos: {str(e)}"
         )
 
+@router.get("/baixo-estoque", response_model=List[ProdutoResponse])
+async def get_produtos_baixo_estoque(
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+    limit: int = 500,
+):
+    """Lista produtos ativos com estoque baixo, avaliando a regra do tenant no banco."""
+    try:
+        limites = await obter_limites(db, tenant_id)
+        result = await db.execute(
+            select(Produto)
+            .where(Produto.tenant_id == tenant_id, filtro_baixo_estoque(limites))
+            .order_by(Produto.estoque, Produto.nome)
+            .limit(max(1, min(limit, 5000)))
+        )
+        return [ProdutoResponse.from_orm(p) for p in result.scalars().all()]
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erro ao buscar produtos com baixo estoque: {str(e)}"
+        )
+
 @router.get("/{produto_uuid}", response_model=ProdutoResponse)
 async def get_produto(
     produto_uuid: str,
@@ -184,7 +219,8 @@ async def create_produto(
             descricao=produto_data.descricao,
             preco_custo=produto_data.preco_custo,
             preco_venda=produto_data.preco_venda,
-            estoque=produto_data.estoque,
+            # Estoque inicial entra pelo livro-razão (movimento de abertura)
+            estoque=0.0,
             estoque_minimo=produto_data.estoque_minimo,
             categoria_id=produto_data.categoria_id,
             venda_por_peso=produto_data.venda_por_peso,
@@ -194,6 +230,8 @@ async def create_produto(
         )
         
         db.add(produto)
+        await db.flush()
+        await aplicar_movimentos(db, [(produto.id, produto_data.estoque)], ORIGEM_ABERTURA)
         await db.commit()
         await db.refresh(produto)
         
@@ -253,6 +291,13 @@ async def update_produto(
         
         # Atualizar campos fornecidos
         update_data = produto_data.dict(exclude_unset=True)
+        # Estoque absoluto vira ajuste no livro-razão (delta calculado com a linha bloqueada)
+        estoque_novo = update_data.pop('estoque', None)
+        if estoque_novo is not None:
+            await registrar_ajuste(db, produto_id, estoque_novo)
+            if not update_data:
+                await db.commit()
+                await db.refresh(produto)
         if update_data:
             update_data['updated_at'] = datetime.utcnow()
             
@@ -302,10 +347,12 @@ async def update_produto(
 @router.post("/{produto_uuid}/imagem", response_model=ProdutoResponse)
 async def upload_imagem_produto(
     produto_uuid: str,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     db: AsyncSession = Depends(get_db_session),
     tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
+    """Recebe a imagem do produto em streaming e agenda a geração das variantes WebP."""
     try:
         produto_id = uuid.UUID(produto_uuid)
         result = await db.execute(
@@ -321,21 +368,17 @@ async def upload_imagem_produto(
 
         filename = (file.filename or "").strip()
         ext = os.path.splitext(filename)[1].lower()
-        if ext not in [".jpg", ".jpeg", ".png", ".webp"]:
+        if ext not in ALLOWED_EXTENSIONS:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato inválido (use jpg, png ou webp)")
 
-        media_dir = os.getenv("MEDIA_DIR", "media")
-        rel_dir = os.path.join("produtos", str(tenant_id))
-        abs_dir = os.path.join(media_dir, rel_dir)
-        os.makedirs(abs_dir, exist_ok=True)
+        abs_dir = os.path.join(MEDIA_DIR, "produtos", str(tenant_id))
 
-        out_name = f"{produto_id}{ext}"
+        # Gravação em chunks fora do event loop (com limite de tamanho);
+        # o nome final leva o hash do conteúdo -> URL nova a cada reenvio
+        out_name = await save_upload(file, abs_dir, str(produto_id), ext)
         abs_path = os.path.join(abs_dir, out_name)
 
-        content = await file.read()
-        with open(abs_path, "wb") as f:
-            f.write(content)
-
+        imagem_anterior = produto.imagem_path
         imagem_path = f"/media/produtos/{tenant_id}/{out_name}"
         await db.execute(
             update(Produto)
@@ -344,6 +387,11 @@ async def upload_imagem_produto(
         )
         await db.commit()
 
+        # Miniaturas/WebP geradas depois da resposta; imagem anterior vira órfã
+        background_tasks.add_task(generate_variants, abs_path)
+        if imagem_anterior and imagem_anterior != imagem_path:
+            background_tasks.add_task(remove_image, imagem_anterior)
+
         result2 = await db.execute(
             select(Produto).where(Produto.id == produto_id, Produto.tenant_id == tenant_id)
         )
@@ -360,6 +408,7 @@ async def upload_imagem_produto(
 @router.delete("/{produto_uuid}")
 async def delete_produto(
     produto_uuid: str,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db_session),
     tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
@@ -383,6 +432,7 @@ async def delete_produto(
                 detail="Produto não encontrado"
             )
 
+        imagem_path = produto.imagem_path
         try:
             await db.execute(
                 delete(Produto)
@@ -399,6 +449,9 @@ async def delete_produto(
                 detail="Não foi possível excluir: produto já foi usado em vendas. Desative o produto em vez de excluir.",
             )
 
+        # Remover imagem e variantes do disco
+        background_tasks.add_task(remove_image, imagem_path)
+
         # Broadcast realtime: produto deletado
         try:
             await realtime_manager.broadcast("produto.deleted", {
@@ -433,7 +486,14 @@ async def sync_push_produtos(
     db: AsyncSession = Depends(get_db_session),
     tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
-    """Recebe produtos do cliente para sincronização."""
+    """Recebe produtos do cliente para sincronização.
+
+    Estoque: o servidor é a fonte da verdade (vendas e dívidas baixam o estoque
+    aqui). Para produtos já existentes, entradas/saídas feitas no caixa devem vir
+    em `estoque_delta`, aplicado de forma atômica no livro-razão. Caixas antigos
+    que só mandam o `estoque` absoluto têm o valor gravado como ajuste (como no
+    PUT). Produtos novos usam `estoque` como abertura.
+    """
     try:
         synced_count = 0
         errors = []
@@ -459,7 +519,6 @@ async def sync_push_produtos(
                         'descricao': produto_data.get('descricao', ''),
                         'preco_custo': produto_data.get('preco_custo', 0),
                         'preco_venda': produto_data.get('preco_venda', 0),
-                        'estoque': produto_data.get('estoque', 0),
                         'estoque_minimo': produto_data.get('estoque_minimo', 0),
                         'categoria_id': produto_data.get('categoria_id'),
                         'venda_por_peso': produto_data.get('venda_por_peso', False),
@@ -476,6 +535,12 @@ async def sync_push_produtos(
                         )
                         .values(**update_data)
                     )
+                    estoque_delta = produto_data.get('estoque_delta')
+                    if estoque_delta is not None:
+                        if estoque_delta:
+                            await aplicar_movimentos(db, [(produto_uuid, float(estoque_delta))], ORIGEM_SYNC)
+                    elif produto_data.get('estoque') is not None:
+                        await registrar_ajuste(db, produto_uuid, float(produto_data['estoque']), ORIGEM_SYNC)
                 else:
                     # Criar novo produto
                     produto = Produto(
@@ -486,7 +551,7 @@ async def sync_push_produtos(
                         descricao=produto_data.get('descricao', ''),
                         preco_custo=produto_data.get('preco_custo', 0),
                         preco_venda=produto_data.get('preco_venda', 0),
-                        estoque=produto_data.get('estoque', 0),
+                        estoque=0.0,
                         estoque_minimo=produto_data.get('estoque_minimo', 0),
                         categoria_id=produto_data.get('categoria_id'),
                         venda_por_peso=produto_data.get('venda_por_peso', False),
@@ -495,6 +560,8 @@ async def sync_push_produtos(
                         ativo=True
                     )
                     db.add(produto)
+                    await db.flush()
+                    await aplicar_movimentos(db, [(produto_uuid, float(produto_data.get('estoque', 0) or 0))], ORIGEM_ABERTURA)
                 
                 synced_count += 1
                 
@@ -519,13 +586,60 @@ async def sync_push_produtos(
             detail=f"Erro na sincronização: {str(e)}"
         )
 
+def _produto_sync_dict(produto: Produto) -> dict:
+    return {
+        'uuid': str(produto.id),
+        'codigo': produto.codigo,
+        'nome': produto.nome,
+        'descricao': produto.descricao,
+        'preco_custo': produto.preco_custo,
+        'preco_venda': produto.preco_venda,
+        'estoque': produto.estoque,
+        'estoque_minimo': produto.estoque_minimo,
+        'categoria_id': produto.categoria_id,
+        'venda_por_peso': produto.venda_por_peso,
+        'unidade_medida': produto.unidade_medida,
+        'taxa_iva': getattr(produto, 'taxa_iva', 0.0),
+        'ativo': produto.ativo,
+        'created_at': produto.created_at.isoformat(),
+        'updated_at': produto.updated_at.isoformat()
+    }
+
 @router.get("/sync/pull")
 async def sync_pull_produtos(
     last_sync: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = 1000,
     db: AsyncSession = Depends(get_db_session),
     tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
-    """Envia produtos atualizados para o cliente."""
+    """Envia produtos atualizados para o cliente.
+
+    Com `cursor` (vazio no primeiro sync) lê o change-log: devolve também os
+    ids removidos (excluídos/desativados), `next_cursor` e `has_more`.
+    Sem `cursor`, mantém o modo antigo por `last_sync`.
+    """
+    if cursor is not None:
+        if limit < 1 or limit > 5000:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="limit deve estar entre 1 e 5000")
+        try:
+            delta = await sync_delta.pull(db, Produto, "produto", tenant_id, cursor, limit)
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Erro ao buscar produtos para sincronização: {str(e)}"
+            )
+        return {
+            'produtos': [_produto_sync_dict(p) for p in delta["registros"]],
+            'removidos': delta["removidos"],
+            'count': len(delta["registros"]),
+            'next_cursor': delta["next_cursor"],
+            'has_more': delta["has_more"],
+            'sync_timestamp': datetime.utcnow().isoformat()
+        }
+
     try:
         query = select(Produto).where(
             Produto.ativo == True,
@@ -544,26 +658,7 @@ async def sync_pull_produtos(
         produtos = result.scalars().all()
         
         return {
-            'produtos': [
-                {
-                    'uuid': str(produto.id),
-                    'codigo': produto.codigo,
-                    'nome': produto.nome,
-                    'descricao': produto.descricao,
-                    'preco_custo': produto.preco_custo,
-                    'preco_venda': produto.preco_venda,
-                    'estoque': produto.estoque,
-                    'estoque_minimo': produto.estoque_minimo,
-                    'categoria_id': produto.categoria_id,
-                    'venda_por_peso': produto.venda_por_peso,
-                    'unidade_medida': produto.unidade_medida,
-                    'taxa_iva': getattr(produto, 'taxa_iva', 0.0),
-                    'ativo': produto.ativo,
-                    'created_at': produto.created_at.isoformat(),
-                    'updated_at': produto.updated_at.isoformat()
-                }
-                for produto in produtos
-            ],
+            'produtos': [_produto_sync_dict(produto) for produto in produtos],
             'count': len(produtos),
             'sync_timestamp': datetime.utcnow().isoformat()
         }
@@ -1,84 +1,40 @@
-from io import BytesIO, StringIO
-from typing import List
+from io import BytesIO
+from typing import Any, Dict, List
 from datetime import datetime, timedelta
+import os
 import uuid
-import csv
-from pathlib import Path
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
+from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func, case
 from sqlalchemy.orm import selectinload
+from starlette.concurrency import run_in_threadpool
 
 from app.db.database import get_db_session
-from app.db.models import Produto, Venda, ItemVenda, User, Cliente, EmpresaConfig
+from app.db.models import Produto, Venda, ItemVenda, User, Cliente
+from app.core.deps import get_tenant_id
+from app.services.empresa import PerfilEmpresa, obter_perfil
+from app.services.estoque import filtro_baixo_estoque, obter_limites
+from app.services import iva as iva_service
+from app.services import exportacao, ranking_produtos, saft
+from app.services import relatorios_jobs as jobs
 
-from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib import colors
+from reportlab.platypus import Paragraph, Spacer, Table
 
-router = APIRouter(prefix="/api/relatorios", tags=["relatorios"])
+from app.core import pdf
 
+router = APIRouter(prefix="/api/relatorios", tags=["relatorios"], dependencies=[Depends(get_tenant_id)])
 
-LOGO_PATH = Path(__file__).resolve().parents[2] / "img" / "vuchada.png"
 
-
-def _add_header(story, styles, titulo: str, subtitulo: str | None = None, empresa: EmpresaConfig | None = None):
-    """Adiciona cabeçalho padrão com logo + dados da empresa + título/subtítulo."""
-    # Logo (se existir)
-    if LOGO_PATH.exists():
-        try:
-            logo = Image(str(LOGO_PATH), width=25 * mm, height=25 * mm)
-            story.append(logo)
-            story.append(Spacer(1, 4))
-        except Exception:
-            pass
-
-    # Dados da empresa
-    if empresa is not None:
-        nome = (empresa.nome or "").strip()
-        linha1 = nome or ""
-
-        detalhes = []
-        if empresa.nuit:
-            detalhes.append(f"NUIT: {empresa.nuit}")
-        if empresa.telefone:
-            detalhes.append(f"Tel: {empresa.telefone}")
-        if empresa.email:
-            detalhes.append(f"Email: {empresa.email}")
-
-        linha2 = " | ".join(detalhes) if detalhes else ""
-        linha3 = (empresa.endereco or "").strip()
-
-        if linha1:
-            story.append(Paragraph(linha1, styles["Heading3"]))
-        if linha2:
-            story.append(Paragraph(linha2, styles["Normal"]))
-        if linha3:
-            story.append(Paragraph(linha3, styles["Normal"]))
-        if linha1 or linha2 or linha3:
-            story.append(Spacer(1, 6))
-
-    # Título e subtítulo do relatório
-    story.append(Paragraph(titulo, styles["Title"]))
-    if subtitulo:
-        story.append(Paragraph(subtitulo, styles["Normal"]))
-
-    story.append(Spacer(1, 8))
-
-
-def _build_produtos_pdf(produtos: List[Produto], titulo: str, empresa: EmpresaConfig | None = None) -> bytes:
+def _build_produtos_pdf(produtos: List[Produto], titulo: str, empresa: PerfilEmpresa | None = None) -> bytes:
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=20 * mm, rightMargin=20 * mm,
-                            topMargin=20 * mm, bottomMargin=20 * mm)
-
-    styles = getSampleStyleSheet()
+    doc = pdf.novo_documento(buffer, margem_mm=20)
     story = []
 
-    _add_header(story, styles, titulo, empresa=empresa)
+    pdf.cabecalho(story, titulo, empresa=empresa)
 
     data = [["Código", "Nome", "Preço venda", "Estoque", "Estoque mín."]]
     for p in produtos:
@@ -91,51 +47,58 @@ def _build_produtos_pdf(produtos: List[Produto], titulo: str, empresa: EmpresaCo
         ])
 
     table = Table(data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0f766e")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 10),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 8),
-        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
-        ("FONTSIZE", (0, 1), (-1, -1), 9),
-    ]))
+    table.setStyle(pdf.TABELA_LISTA)
 
     story.append(table)
     doc.build(story)
-    pdf = buffer.getvalue()
+    conteudo = buffer.getvalue()
     buffer.close()
-    return pdf
+    return conteudo
 
 
-@router.get("/produtos", response_class=StreamingResponse)
-async def relatorio_produtos(baixo_estoque: bool = False, db: AsyncSession = Depends(get_db_session)):
-    stmt = select(Produto).where(Produto.ativo == True)
-    result = await db.execute(stmt)
-    produtos = result.scalars().all()
+def _parse_uuid_opcional(value) -> uuid.UUID | None:
+    if value is None:
+        return None
+    try:
+        return uuid.UUID(str(value))
+    except Exception:
+        return None
 
-    if baixo_estoque:
-        def is_baixo(p: Produto) -> bool:
-            # Ignorar categoria "Serviços" (id 15) no cálculo de baixo estoque
-            try:
-                if getattr(p, "categoria_id", None) == 15:
-                    return False
-            except Exception:
-                pass
 
-            estoque = float(p.estoque or 0)
-            minimo = float(p.estoque_minimo or 0)
-            return (minimo > 0 and estoque <= minimo) or (minimo <= 0 and estoque <= 5)
+def _parse_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "sim", "yes")
+    return bool(value)
+
 
-        produtos = [p for p in produtos if is_baixo(p)]
+@jobs.registrar(
+    "produtos_pdf", ".pdf", "application/pdf",
+    tabelas=("produtos", "empresa_config"), parametros=("baixo_estoque",),
+)
+async def _gerar_produtos_pdf(db: AsyncSession, tenant_id: uuid.UUID, params: dict) -> bytes:
+    baixo_estoque = _parse_bool(params.get("baixo_estoque"))
+    stmt = select(Produto).where(Produto.tenant_id == tenant_id, Produto.ativo == True)
+    if baixo_estoque:
+        # Regra de baixo estoque (limites do tenant) avaliada no banco
+        limites = await obter_limites(db, tenant_id)
+        stmt = stmt.where(filtro_baixo_estoque(limites))
+    result = await db.execute(stmt.order_by(Produto.nome))
+    produtos = result.scalars().all()
 
     # Buscar dados da empresa
-    cfg_result = await db.execute(select(EmpresaConfig))
-    empresa = cfg_result.scalars().first()
+    empresa = await obter_perfil(db, tenant_id)
 
     titulo = "Produtos" if not baixo_estoque else "Produtos com baixo estoque"
-    pdf_bytes = _build_produtos_pdf(produtos, titulo, empresa=empresa)
+    return await run_in_threadpool(_build_produtos_pdf, produtos, titulo, empresa)
+
+
+@router.get("/produtos", response_class=StreamingResponse)
+async def relatorio_produtos(
+    baixo_estoque: bool = False,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    pdf_bytes = await _gerar_produtos_pdf(db, tenant_id, {"baixo_estoque": baixo_estoque})
 
     filename = "produtos.pdf" if not baixo_estoque else "produtos_baixo_estoque.pdf"
 
@@ -153,51 +116,15 @@ def _parse_date_ymd(value: str) -> datetime:
         raise HTTPException(status_code=400, detail="Parâmetro de data inválido. Use YYYY-MM-DD")
 
 
-@router.get("/vendas", response_class=StreamingResponse)
-async def relatorio_vendas(
-    data_inicio: str,
-    data_fim: str,
-    usuario_id: str | None = None,
-    db: AsyncSession = Depends(get_db_session),
-):
-    """Relatório detalhado de vendas em PDF para o período/usuário informado."""
-    d1 = _parse_date_ymd(data_inicio)
-    d2 = _parse_date_ymd(data_fim)
-    d2_exclusive = d2 + timedelta(days=1)
-
-    stmt = (
-        select(Venda)
-        .options(
-            selectinload(Venda.itens).selectinload(ItemVenda.produto),
-            selectinload(Venda.cliente),
-            selectinload(Venda.usuario),
-        )
-        .where(Venda.created_at >= d1, Venda.created_at < d2_exclusive, Venda.cancelada == False)
-    )
-
-    if usuario_id is not None:
-        try:
-            uid = uuid.UUID(usuario_id)
-            stmt = stmt.where(Venda.usuario_id == uid)
-        except Exception:
-            pass
-
-    result = await db.execute(stmt)
-    vendas = result.scalars().all()
-
+def _build_vendas_pdf(vendas: List[Venda], data_inicio: str, data_fim: str, empresa: PerfilEmpresa | None = None) -> bytes:
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=15 * mm, rightMargin=15 * mm,
-                            topMargin=15 * mm, bottomMargin=15 * mm)
-    styles = getSampleStyleSheet()
+    doc = pdf.novo_documento(buffer, margem_mm=15)
+    styles = pdf.estilos()
     story = []
 
-    # Dados da empresa
-    cfg_result = await db.execute(select(EmpresaConfig))
-    empresa = cfg_result.scalars().first()
-
     titulo = "Relatório de Vendas"
     subtitulo = f"Período: {data_inicio} a {data_fim}"
-    _add_header(story, styles, titulo, subtitulo, empresa=empresa)
+    pdf.cabecalho(story, titulo, subtitulo, empresa=empresa)
 
     header = ["Data", "Vendedor", "Cliente", "Forma pag.", "Total (MT)"]
     data = [header]
@@ -214,16 +141,7 @@ async def relatorio_vendas(
         data.append([data_str, vendedor, cliente, forma, f"MT {total:,.2f}"])
 
     table = Table(data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0f766e")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 9),
-        ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
-        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
-        ("FONTSIZE", (0, 1), (-1, -1), 8),
-    ]))
+    table.setStyle(pdf.TABELA_LISTA_COMPACTA)
 
     story.append(table)
     story.append(Spacer(1, 8))
@@ -253,93 +171,143 @@ async def relatorio_vendas(
         story.append(Spacer(1, 12))
         story.append(Paragraph("Itens vendidos", styles["Heading3"]))
         itens_table = Table(itens_data, repeatRows=1)
-        itens_table.setStyle(TableStyle([
-            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0f766e")),
-            ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-            ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-            ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-            ("FONTSIZE", (0, 0), (-1, 0), 9),
-            ("BOTTOMPADDING", (0, 0), (-1, 0), 6),
-            ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
-            ("FONTSIZE", (0, 1), (-1, -1), 8),
-        ]))
+        itens_table.setStyle(pdf.TABELA_LISTA_COMPACTA)
         story.append(itens_table)
 
     doc.build(story)
-    pdf_bytes = buffer.getvalue()
+    conteudo = buffer.getvalue()
     buffer.close()
+    return conteudo
+
+
+@jobs.registrar(
+    "vendas_pdf", ".pdf", "application/pdf",
+    tabelas=("vendas", "usuarios", "clientes", "produtos", "empresa_config"),
+    parametros=("data_inicio", "data_fim", "usuario_id"),
+    obrigatorios=("data_inicio", "data_fim"),
+)
+async def _gerar_vendas_pdf(db: AsyncSession, tenant_id: uuid.UUID, params: dict) -> bytes:
+    data_inicio = params.get("data_inicio")
+    data_fim = params.get("data_fim")
+    if not data_inicio or not data_fim:
+        raise HTTPException(status_code=400, detail="data_inicio e data_fim são obrigatórios")
+    d1 = _parse_date_ymd(data_inicio)
+    d2 = _parse_date_ymd(data_fim)
+    d2_exclusive = d2 + timedelta(days=1)
 
-    return StreamingResponse(
-        BytesIO(pdf_bytes),
-        media_type="application/pdf",
-        headers={"Content-Disposition": "attachment; filename=vendas_periodo.pdf"},
+    stmt = (
+        select(Venda)
+        .options(
+            selectinload(Venda.itens).selectinload(ItemVenda.produto),
+            selectinload(Venda.cliente),
+            selectinload(Venda.usuario),
+        )
+        .where(
+            Venda.tenant_id == tenant_id,
+            Venda.created_at >= d1,
+            Venda.created_at < d2_exclusive,
+            Venda.cancelada == False,
+        )
     )
 
+    uid = _parse_uuid_opcional(params.get("usuario_id"))
+    if uid is not None:
+        stmt = stmt.where(Venda.usuario_id == uid)
 
-@router.get("/financeiro", response_class=StreamingResponse)
-async def relatorio_financeiro(
+    result = await db.execute(stmt)
+    vendas = result.scalars().all()
+
+    # Dados da empresa
+    empresa = await obter_perfil(db, tenant_id)
+
+    return await run_in_threadpool(_build_vendas_pdf, vendas, data_inicio, data_fim, empresa)
+
+
+@router.get("/vendas", response_class=StreamingResponse)
+async def relatorio_vendas(
     data_inicio: str,
     data_fim: str,
     usuario_id: str | None = None,
     db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
-    """Relatório financeiro resumido (faturamento, custo, lucro, ticket etc.) em PDF."""
-    d1 = _parse_date_ymd(data_inicio)
-    d2 = _parse_date_ymd(data_fim)
-    d2_exclusive = d2 + timedelta(days=1)
+    """Relatório detalhado de vendas em PDF para o período/usuário informado."""
+    pdf_bytes = await _gerar_vendas_pdf(
+        db, tenant_id, {"data_inicio": data_inicio, "data_fim": data_fim, "usuario_id": usuario_id}
+    )
 
-    # Buscar vendas do período
-    stmt_v = (
-        select(Venda)
-        .options(selectinload(Venda.itens))
-        .where(Venda.created_at >= d1, Venda.created_at < d2_exclusive, Venda.cancelada == False)
+    return StreamingResponse(
+        BytesIO(pdf_bytes),
+        media_type="application/pdf",
+        headers={"Content-Disposition": "attachment; filename=vendas_periodo.pdf"},
     )
-    if usuario_id is not None:
-        try:
-            uid = uuid.UUID(usuario_id)
-            stmt_v = stmt_v.where(Venda.usuario_id == uid)
-        except Exception:
-            pass
 
-    result_v = await db.execute(stmt_v)
-    vendas = result_v.scalars().all()
 
-    # Mapear custos por produto
-    result_p = await db.execute(select(Produto))
-    produtos = result_p.scalars().all()
-    custo_por_produto = {str(p.id): float(p.preco_custo or 0) for p in produtos}
+async def _resumo_financeiro(
+    db: AsyncSession,
+    d1: datetime,
+    d2_exclusive: datetime,
+    usuario_id: uuid.UUID | None = None,
+    tenant_id: uuid.UUID | None = None,
+) -> dict:
+    """Faturamento, custo, lucro, nº de vendas, ticket médio e itens do período.
 
-    faturamento = 0.0
-    custo_total = 0.0
-    itens_total = 0.0
+    Tudo calculado numa única consulta agregada (itens JOIN vendas LEFT JOIN
+    produtos), devolvendo uma linha em vez de carregar vendas/itens/produtos.
+    Quantidade efetiva = peso_kg quando > 0, senão quantidade (como no PDV).
+    """
+    filtros = [Venda.created_at >= d1, Venda.created_at < d2_exclusive, Venda.cancelada == False]
+    if usuario_id is not None:
+        filtros.append(Venda.usuario_id == usuario_id)
+    if tenant_id is not None:
+        filtros.append(Venda.tenant_id == tenant_id)
 
-    for v in vendas:
-        for it in getattr(v, "itens", []) or []:
-            pid = str(it.produto_id)
-            preco_unit = float(it.preco_unitario or 0)
-            qtd = float(it.peso_kg or 0) if getattr(it, "peso_kg", 0) else float(it.quantidade or 0)
-            custo_unit = float(custo_por_produto.get(pid, 0))
-            faturamento += preco_unit * qtd
-            custo_total += custo_unit * qtd
-            itens_total += qtd
-
-    lucro = faturamento - custo_total
-    qtd_vendas = len(vendas)
-    ticket_medio = faturamento / qtd_vendas if qtd_vendas > 0 else 0.0
+    qtd = case((ItemVenda.peso_kg > 0, ItemVenda.peso_kg), else_=ItemVenda.quantidade)
+    qtd_vendas = (
+        select(func.count(Venda.id)).where(*filtros).correlate(None).scalar_subquery()
+    )
+    stmt = (
+        select(
+            func.coalesce(func.sum(ItemVenda.preco_unitario * qtd), 0.0).label("faturamento"),
+            func.coalesce(func.sum(func.coalesce(Produto.preco_custo, 0.0) * qtd), 0.0).label("custo"),
+            func.coalesce(func.sum(qtd), 0.0).label("itens"),
+            qtd_vendas.label("qtd_vendas"),
+        )
+        .select_from(ItemVenda)
+        .join(Venda, ItemVenda.venda_id == Venda.id)
+        .outerjoin(Produto, ItemVenda.produto_id == Produto.id)
+        .where(*filtros)
+    )
+    row = (await db.execute(stmt)).one()
+
+    faturamento = float(row.faturamento or 0)
+    custo = float(row.custo or 0)
+    n_vendas = int(row.qtd_vendas or 0)
+    return {
+        "faturamento": faturamento,
+        "custo": custo,
+        "lucro": faturamento - custo,
+        "qtd_vendas": n_vendas,
+        "ticket_medio": faturamento / n_vendas if n_vendas > 0 else 0.0,
+        "itens": float(row.itens or 0),
+    }
+
+
+def _build_financeiro_pdf(resumo: dict, data_inicio: str, data_fim: str, empresa: PerfilEmpresa | None = None) -> bytes:
+    faturamento = resumo["faturamento"]
+    custo_total = resumo["custo"]
+    lucro = resumo["lucro"]
+    qtd_vendas = resumo["qtd_vendas"]
+    ticket_medio = resumo["ticket_medio"]
+    itens_total = resumo["itens"]
 
     buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, leftMargin=20 * mm, rightMargin=20 * mm,
-                            topMargin=20 * mm, bottomMargin=20 * mm)
-    styles = getSampleStyleSheet()
+    doc = pdf.novo_documento(buffer, margem_mm=20)
     story = []
 
-    # Dados da empresa
-    cfg_result = await db.execute(select(EmpresaConfig))
-    empresa = cfg_result.scalars().first()
-
     titulo = "Relatório Financeiro"
     subtitulo = f"Período: {data_inicio} a {data_fim}"
-    _add_header(story, styles, titulo, subtitulo, empresa=empresa)
+    pdf.cabecalho(story, titulo, subtitulo, empresa=empresa)
 
     rows = [
         ["Faturamento", f"MT {faturamento:,.2f}"],
@@ -351,19 +319,50 @@ async def relatorio_financeiro(
     ]
 
     table = Table(rows, colWidths=[80 * mm, 80 * mm])
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0f766e")),
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("FONTSIZE", (0, 0), (-1, 0), 10),
-        ("ALIGN", (0, 0), (-1, -1), "LEFT"),
-        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
-    ]))
+    table.setStyle(pdf.TABELA_RESUMO)
 
     story.append(table)
     doc.build(story)
-    pdf_bytes = buffer.getvalue()
+    conteudo = buffer.getvalue()
     buffer.close()
+    return conteudo
+
+
+@jobs.registrar(
+    "financeiro_pdf", ".pdf", "application/pdf",
+    tabelas=("vendas", "produtos", "empresa_config"), parametros=("data_inicio", "data_fim", "usuario_id"),
+    obrigatorios=("data_inicio", "data_fim"),
+)
+async def _gerar_financeiro_pdf(db: AsyncSession, tenant_id: uuid.UUID, params: dict) -> bytes:
+    data_inicio = params.get("data_inicio")
+    data_fim = params.get("data_fim")
+    if not data_inicio or not data_fim:
+        raise HTTPException(status_code=400, detail="data_inicio e data_fim são obrigatórios")
+    d1 = _parse_date_ymd(data_inicio)
+    d2 = _parse_date_ymd(data_fim)
+    d2_exclusive = d2 + timedelta(days=1)
+
+    uid = _parse_uuid_opcional(params.get("usuario_id"))
+    resumo = await _resumo_financeiro(db, d1, d2_exclusive, uid, tenant_id=tenant_id)
+
+    # Dados da empresa
+    empresa = await obter_perfil(db, tenant_id)
+
+    return await run_in_threadpool(_build_financeiro_pdf, resumo, data_inicio, data_fim, empresa)
+
+
+@router.get("/financeiro", response_class=StreamingResponse)
+async def relatorio_financeiro(
+    data_inicio: str,
+    data_fim: str,
+    usuario_id: str | None = None,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Relatório financeiro resumido (faturamento, custo, lucro, ticket etc.) em PDF."""
+    pdf_bytes = await _gerar_financeiro_pdf(
+        db, tenant_id, {"data_inicio": data_inicio, "data_fim": data_fim, "usuario_id": usuario_id}
+    )
 
     return StreamingResponse(
         BytesIO(pdf_bytes),
@@ -372,15 +371,54 @@ async def relatorio_financeiro(
     )
 
 
+@router.get("/financeiro/resumo")
+async def resumo_financeiro(
+    data_inicio: str,
+    data_fim: str,
+    usuario_id: str | None = None,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Mesmos números do relatório financeiro, em JSON (para dashboards)."""
+    d1 = _parse_date_ymd(data_inicio)
+    d2_exclusive = _parse_date_ymd(data_fim) + timedelta(days=1)
+    uid = _parse_uuid_opcional(usuario_id)
+    resumo = await _resumo_financeiro(db, d1, d2_exclusive, uid, tenant_id=tenant_id)
+    return {"data_inicio": data_inicio, "data_fim": data_fim, **resumo}
+
+
+@router.get("/produtos/ranking")
+async def ranking_produtos_periodo(
+    data_inicio: str,
+    data_fim: str,
+    criterio: str = "receita",
+    limite: int = 20,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Top-N produtos por receita, quantidade ou margem, com curva ABC (JSON)."""
+    d1 = _parse_date_ymd(data_inicio).date()
+    d2_exclusive = _parse_date_ymd(data_fim).date() + timedelta(days=1)
+    if d2_exclusive <= d1:
+        raise HTTPException(status_code=400, detail="data_fim deve ser maior ou igual a data_inicio")
+    if limite < 1 or limite > 500:
+        raise HTTPException(status_code=400, detail="limite deve estar entre 1 e 500")
+    try:
+        return await ranking_produtos.ranking_produtos(db, tenant_id, d1, d2_exclusive, criterio, limite)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @router.get("/faturas-mensal", response_class=StreamingResponse)
 async def exportar_faturas_mensal(
     ano: int,
     mes: int,
-    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
     """Exporta faturas (vendas não canceladas) de um mês em CSV para apoio contabilístico/AT.
 
     Ainda não é SAF-T, mas já consolida os dados fiscais básicos por documento.
+    O CSV é gerado em streaming a partir de um cursor do banco.
     """
     try:
         # Período [inicio, fim+1d)
@@ -392,119 +430,180 @@ async def exportar_faturas_mensal(
     except Exception:
         raise HTTPException(status_code=400, detail="Parâmetros de ano/mês inválidos")
 
-    stmt = (
-        select(Venda)
-        .options(selectinload(Venda.itens), selectinload(Venda.cliente), selectinload(Venda.usuario))
-        .where(Venda.created_at >= d1, Venda.created_at < d2, Venda.cancelada == False)
-        .order_by(Venda.created_at.asc())
-    )
+    consulta = exportacao.consulta("vendas", tenant_id, d1, d2)
+    return exportacao.resposta_csv(consulta, f"faturas_{ano}_{mes:02d}.csv")
 
-    result = await db.execute(stmt)
-    vendas = result.scalars().all()
 
-    # Usar StringIO para escrever texto e depois codificar para bytes
-    text_buffer = StringIO()
-    writer = csv.writer(text_buffer, delimiter=';', lineterminator='\n')
-
-    # Cabeçalho CSV
-    writer.writerow([
-        "data_hora",
-        "id_venda",
-        "vendedor",
-        "cliente_nome",
-        "cliente_documento",
-        "forma_pagamento",
-        "total",
-        "desconto",
-        "observacoes",
-    ])
+@router.get("/exportar/{entidade}", response_class=StreamingResponse)
+async def exportar_csv(
+    entidade: str,
+    data_inicio: str | None = None,
+    data_fim: str | None = None,
+    incluir_canceladas: bool = False,
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Exporta vendas, itens, dividas ou clientes em CSV (streaming, memória constante).
 
-    for v in vendas:
-        dt = getattr(v, "created_at", None)
-        data_str = dt.strftime("%Y-%m-%d %H:%M:%S") if isinstance(dt, datetime) else ""
-        vendedor = getattr(getattr(v, "usuario", None), "nome", "") or "-"
-        cliente_nome = getattr(getattr(v, "cliente", None), "nome", "") or "-"
-        cliente_doc = getattr(getattr(v, "cliente", None), "documento", "") or ""
-        forma = v.forma_pagamento or "-"
-        total = float(v.total or 0)
-        desconto = float(v.desconto or 0)
-        obs = v.observacoes or ""
-
-        writer.writerow([
-            data_str,
-            str(getattr(v, "id", "")),
-            vendedor,
-            cliente_nome,
-            cliente_doc,
-            forma,
-            f"{total:.2f}",
-            f"{desconto:.2f}",
-            obs.replace('\n', ' ').replace('\r', ' '),
-        ])
+    `data_inicio`/`data_fim` (YYYY-MM-DD) filtram pela data do documento
+    (cadastro, para clientes). `incluir_canceladas` vale para vendas e itens.
+    """
+    d1 = _parse_date_ymd(data_inicio) if data_inicio else None
+    d2_exclusive = _parse_date_ymd(data_fim) + timedelta(days=1) if data_fim else None
+    try:
+        consulta = exportacao.consulta(entidade, tenant_id, d1, d2_exclusive, incluir_canceladas)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    csv_text = text_buffer.getvalue()
-    csv_bytes = csv_text.encode('utf-8')
-    buffer = BytesIO(csv_bytes)
-    filename = f"faturas_{ano}_{mes:02d}.csv"
+    sufixo = f"_{data_inicio or 'inicio'}_{data_fim or 'hoje'}" if (data_inicio or data_fim) else ""
+    return exportacao.resposta_csv(consulta, f"{entidade}{sufixo}.csv")
 
-    return StreamingResponse(
-        buffer,
-        media_type="text/csv",
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}",
-            "Cache-Control": "no-cache",
-        },
-    )
+
+@router.get("/saft", response_class=StreamingResponse)
+async def exportar_saft(
+    data_inicio: str,
+    data_fim: str,
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Exportação fiscal em XML no formato do SAF-T (faturas com IVA por linha).
+
+    Gerada incrementalmente a partir de um cursor do banco, sem montar o XML em memória.
+    """
+    d1 = _parse_date_ymd(data_inicio)
+    d2_exclusive = _parse_date_ymd(data_fim) + timedelta(days=1)
+    if d2_exclusive <= d1:
+        raise HTTPException(status_code=400, detail="data_fim deve ser maior ou igual a data_inicio")
+    return saft.resposta_saft(tenant_id, d1, d2_exclusive, f"saft_{data_inicio}_{data_fim}.xml")
 
 
 @router.get("/iva")
 async def resumo_iva(
     data_inicio: str,
     data_fim: str,
+    agrupar: str | None = None,
+    fonte: str = "rollup",
     db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
 ):
-    """Resumo de IVA por taxa em um período (base, imposto e faturamento)."""
+    """Resumo de IVA por taxa em um período (base, imposto e faturamento).
+
+    `agrupar` aceita combinações de taxa, mes e codigo_imposto (ex.: "mes,taxa").
+    Por padrão lê o rollup diário (pdv.iva_diario); `fonte=itens` agrega os itens
+    de venda diretamente no banco.
+    """
     d1 = _parse_date_ymd(data_inicio)
     d2 = _parse_date_ymd(data_fim)
     d2_exclusive = d2 + timedelta(days=1)
 
-    # Buscar itens de vendas não canceladas no período
-    stmt = (
-        select(ItemVenda)
-        .join(Venda, ItemVenda.venda_id == Venda.id)
-        .where(
-            Venda.created_at >= d1,
-            Venda.created_at < d2_exclusive,
-            Venda.cancelada == False,
-        )
-    )
+    if fonte not in ("rollup", "itens"):
+        raise HTTPException(status_code=400, detail="fonte inválida (use rollup ou itens)")
 
-    result = await db.execute(stmt)
-    itens = result.scalars().all()
-
-    resumo: dict[float, dict] = {}
-    for it in itens:
-        taxa = float(getattr(it, "taxa_iva", 0.0) or 0.0)
-        base = float(getattr(it, "base_iva", 0.0) or 0.0)
-        iva = float(getattr(it, "valor_iva", 0.0) or 0.0)
-        if taxa not in resumo:
-            resumo[taxa] = {"taxa_iva": taxa, "base_total": 0.0, "iva_total": 0.0}
-        resumo[taxa]["base_total"] += base
-        resumo[taxa]["iva_total"] += iva
-
-    # Converter para lista ordenada por taxa
-    resultado = []
-    for taxa in sorted(resumo.keys()):
-        base_total = resumo[taxa]["base_total"]
-        iva_total = resumo[taxa]["iva_total"]
-        faturamento_total = base_total + iva_total
-        resultado.append(
-            {
-                "taxa_iva": taxa,
-                "base_total": base_total,
-                "iva_total": iva_total,
-                "faturamento_total": faturamento_total,
-            }
+    try:
+        resultado = await iva_service.resumo_iva(
+            db, tenant_id, d1.date(), d2_exclusive.date(), agrupar=agrupar, fonte=fonte
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {"data_inicio": data_inicio, "data_fim": data_fim, "itens": resultado}
+
+
+# --- Exportações na fila de relatórios ---
+
+_TABELAS_CSV = {
+    "vendas": ("vendas", "clientes", "usuarios"),
+    "itens": ("vendas", "produtos"),
+    "dividas": ("dividas", "clientes", "usuarios"),
+    "clientes": ("clientes",),
+}
+
+
+def _registrar_csv(entidade: str) -> None:
+    @jobs.registrar(
+        f"csv_{entidade}", ".csv", "text/csv",
+        tabelas=_TABELAS_CSV[entidade], parametros=("data_inicio", "data_fim", "incluir_canceladas"),
+    )
+    async def _gerar(db: AsyncSession, tenant_id: uuid.UUID, params: dict):
+        d1 = _parse_date_ymd(params["data_inicio"]) if params.get("data_inicio") else None
+        d2_exclusive = _parse_date_ymd(params["data_fim"]) + timedelta(days=1) if params.get("data_fim") else None
+        consulta = exportacao.consulta(
+            entidade, tenant_id, d1, d2_exclusive, _parse_bool(params.get("incluir_canceladas"))
+        )
+        return exportacao.gerar_csv(consulta)
+
+
+for _entidade in exportacao.ENTIDADES:
+    _registrar_csv(_entidade)
+
+
+@jobs.registrar(
+    "saft", ".xml", "application/xml",
+    tabelas=("vendas", "clientes", "produtos", "empresa_config"), parametros=("data_inicio", "data_fim"),
+    obrigatorios=("data_inicio", "data_fim"),
+)
+async def _gerar_saft(db: AsyncSession, tenant_id: uuid.UUID, params: dict):
+    if not params.get("data_inicio") or not params.get("data_fim"):
+        raise HTTPException(status_code=400, detail="data_inicio e data_fim são obrigatórios")
+    d1 = _parse_date_ymd(params["data_inicio"])
+    d2_exclusive = _parse_date_ymd(params["data_fim"]) + timedelta(days=1)
+    return saft.gerar_saft(tenant_id, d1, d2_exclusive)
+
+
+class RelatorioJobCreate(BaseModel):
+    tipo: str
+    params: Dict[str, Any] = {}
+
+
+@router.post("/jobs", status_code=202)
+async def submeter_relatorio(
+    payload: RelatorioJobCreate,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Enfileira a geração de um relatório e retorna o job.
+
+    Acompanhar por GET /jobs/{id} ou pelo evento `relatorio.pronto` no /ws (conectado
+    com ?tenant_id= ou header X-Tenant-Id); quando
+    `status` = concluido, baixar em `download_url`. Pedidos iguais sobre os mesmos
+    dados são servidos do cache em disco (`cache` = true).
+    """
+    try:
+        job = await jobs.submeter(db, tenant_id, payload.tipo, payload.params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except jobs.FilaCheia as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
+    return job.to_dict()
+
+
+@router.get("/jobs")
+async def status_relatorios():
+    """Tipos de relatório disponíveis na fila e ocupação dos workers."""
+    return {"tipos": {nome: list(t.parametros) for nome, t in jobs.TIPOS.items()}, **jobs.status_fila()}
+
+
+@router.get("/jobs/{job_id}")
+async def obter_relatorio(
+    job_id: uuid.UUID,
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    job = jobs.obter(job_id, tenant_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job.to_dict()
+
+
+@router.get("/jobs/{job_id}/download")
+async def baixar_relatorio(
+    job_id: uuid.UUID,
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    job = jobs.obter(job_id, tenant_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if job.status == jobs.STATUS_ERRO:
+        raise HTTPException(status_code=500, detail=job.erro or "Falha ao gerar relatório")
+    if job.status != jobs.STATUS_CONCLUIDO:
+        raise HTTPException(status_code=409, detail="Relatório ainda em geração")
+    if not os.path.exists(job.arquivo):
+        raise HTTPException(status_code=410, detail="Arquivo expirado, submeta o relatório novamente")
+    return FileResponse(job.arquivo, media_type=job.tipo.media_type, filename=job.filename)
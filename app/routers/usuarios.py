@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete, func
-from typing import List
+from typing import List, Optional
 import uuid
 from datetime import datetime
 
@@ -9,6 +9,7 @@ from ..db.database import get_db_session
 from ..db.models import User
 from app.core.realtime import manager as realtime_manager
 from app.core.deps import get_tenant_id
+from app.services import sync_delta
 from ..schemas.usuario import UsuarioCreate, UsuarioUpdate, UsuarioResponse
 from werkzeug.security import generate_password_hash
 
@@ -20,7 +21,32 @@ def _looks_like_hash(value: str) -> bool:
     v = str(value)
     return v.startswith("pbkdf2:") or v.startswith("$2a$") or v.startswith("$2b$") or v.startswith("$2y$")
 
-router = APIRouter(prefix="/api/usuarios", tags=["usuarios"])
+
+def _usuario_dict(usuario: User) -> dict:
+    """Usuário para listagens/sync (sem o hash da senha)."""
+    return {
+        'uuid': str(usuario.id),
+        'id': str(usuario.id),
+        'nome': usuario.nome,
+        'usuario': usuario.usuario,
+        'is_admin': usuario.is_admin,
+        'ativo': usuario.ativo,
+        'nivel': usuario.nivel,
+        'salario': usuario.salario,
+        'pode_abastecer': usuario.pode_abastecer,
+        'pode_gerenciar_despesas': usuario.pode_gerenciar_despesas,
+        'pode_fazer_devolucao': getattr(usuario, 'pode_fazer_devolucao', False),
+        'created_at': usuario.created_at.isoformat(),
+        'updated_at': usuario.updated_at.isoformat()
+    }
+
+router = APIRouter(prefix="/api/usuarios", tags=["usuarios"], dependencies=[Depends(get_tenant_id)])
+
+ENTIDADE_SYNC = "usuario"
+_CAMPOS_SYNC = [
+    "nome", "usuario", "senha_hash", "is_admin", "ativo", "nivel", "salario",
+    "pode_abastecer", "pode_gerenciar_despesas", "pode_fazer_devolucao",
+]
 
 @router.get("/", response_model=List[dict])
 async def listar_usuarios(
@@ -37,27 +63,7 @@ async def listar_usuarios(
         )
         usuarios = result.scalars().all()
         
-        # Converter para dict com uuid
-        usuarios_dict = []
-        for usuario in usuarios:
-            usuario_dict = {
-                'uuid': str(usuario.id),
-                'id': str(usuario.id),
-                'nome': usuario.nome,
-                'usuario': usuario.usuario,
-                'is_admin': usuario.is_admin,
-                'ativo': usuario.ativo,
-                'nivel': usuario.nivel,
-                'salario': usuario.salario,
-                'pode_abastecer': usuario.pode_abastecer,
-                'pode_gerenciar_despesas': usuario.pode_gerenciar_despesas,
-                'pode_fazer_devolucao': getattr(usuario, 'pode_fazer_devolucao', False),
-                'created_at': usuario.created_at.isoformat(),
-                'updated_at': usuario.updated_at.isoformat()
-            }
-            usuarios_dict.append(usuario_dict)
-        
-        return usuarios_dict
+        return [_usuario_dict(usuario) for usuario in usuarios]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar usuários: {str(e)}")
 
@@ -395,3 +401,112 @@ async def ativar_usuario(
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao ativar usuário: {str(e)}")
+
+# Endpoints de sincronização
+@router.get("/sync/pull")
+async def sync_pull_usuarios(
+    cursor: Optional[str] = None,
+    limit: int = 1000,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Usuários alterados desde o cursor e ids removidos (desativados).
+
+    Repetir com ?cursor=next_cursor enquanto has_more; guardar o último
+    next_cursor para o próximo sync.
+    """
+    if limit < 1 or limit > 5000:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 5000")
+    try:
+        delta = await sync_delta.pull(db, User, ENTIDADE_SYNC, tenant_id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar usuários para sincronização: {str(e)}")
+    return {
+        "usuarios": [_usuario_dict(u) for u in delta["registros"]],
+        "removidos": delta["removidos"],
+        "next_cursor": delta["next_cursor"],
+        "has_more": delta["has_more"],
+        "sync_timestamp": datetime.utcnow().isoformat(),
+    }
+
+@router.post("/sync/push")
+async def sync_push_usuarios(
+    usuarios: List[dict],
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Recebe usuários criados/alterados no dispositivo (upsert em lote, last-write-wins por updated_at).
+
+    `senha` (texto ou hash) é obrigatória para usuários novos; sem ela, um
+    usuário existente mantém a senha atual.
+    """
+    errors = []
+    ids = []
+    for item in usuarios:
+        try:
+            ids.append(uuid.UUID(str(item.get("uuid") or item.get("id"))))
+        except (ValueError, TypeError):
+            ids.append(None)
+
+    try:
+        # Hash atual dos usuários já existentes no tenant (uma consulta)
+        existentes = {}
+        validos = [i for i in ids if i is not None]
+        if validos:
+            result = await db.execute(
+                select(User.id, User.senha_hash).where(User.id.in_(validos), User.tenant_id == tenant_id)
+            )
+            existentes = {r.id: r.senha_hash for r in result}
+
+        registros = []
+        for item, uid in zip(usuarios, ids):
+            ref = item.get("uuid") or item.get("id") or "unknown"
+            if uid is None:
+                errors.append({"uuid": ref, "error": "UUID inválido"})
+                continue
+            nome = (item.get("nome") or "").strip()
+            login = (item.get("usuario") or "").strip()
+            if not nome or len(login) < 3:
+                errors.append({"uuid": ref, "error": "nome e usuario (mín. 3 caracteres) são obrigatórios"})
+                continue
+            senha = item.get("senha")
+            if senha:
+                senha_hash = senha if _looks_like_hash(senha) else generate_password_hash(senha)
+            elif uid in existentes:
+                senha_hash = existentes[uid]
+            else:
+                errors.append({"uuid": ref, "error": "senha é obrigatória para usuário novo"})
+                continue
+            try:
+                registros.append({
+                    "id": uid,
+                    "nome": nome[:100],
+                    "usuario": login[:50],
+                    "senha_hash": senha_hash,
+                    "is_admin": bool(item.get("is_admin", False)),
+                    "ativo": bool(item.get("ativo", True)),
+                    "nivel": int(item.get("nivel") or 1),
+                    "salario": float(item.get("salario") or 0.0),
+                    "pode_abastecer": bool(item.get("pode_abastecer", False)),
+                    "pode_gerenciar_despesas": bool(item.get("pode_gerenciar_despesas", False)),
+                    "pode_fazer_devolucao": bool(item.get("pode_fazer_devolucao", False)),
+                    "updated_at": sync_delta.parse_instante(item.get("updated_at")),
+                })
+            except (ValueError, TypeError) as e:
+                errors.append({"uuid": ref, "error": str(e)})
+
+        resultado = await sync_delta.upsert_lww(db, User, tenant_id, registros, _CAMPOS_SYNC)
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"Erro na sincronização: {str(e)}")
+
+    errors += [{"uuid": e["id"], "error": e["error"]} for e in resultado["erros"]]
+    return {
+        "synced_count": len(resultado["aplicados"]),
+        "ignored": resultado["ignorados"],
+        "errors": errors,
+        "message": f'{len(resultado["aplicados"])} usuários sincronizados com sucesso',
+    }
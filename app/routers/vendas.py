@@ -1,40 +1,109 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete, func
-from sqlalchemy.orm import selectinload
 from typing import List
+from collections import defaultdict
+import logging
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 
 from ..db.database import get_db_session
 from sqlalchemy.exc import IntegrityError
-from app.db.models import Produto, Venda, ItemVenda, User
+from app.db.models import Produto, Venda, ItemVenda, User, Cliente
 from app.core.realtime import manager as realtime_manager
+from app.core.deps import get_tenant_id
+from app.services import iva as iva_service
+from app.services import duplicidade_vendas, metricas_vendas, ranking_produtos
+from app.services.estoque import ORIGEM_VENDA, estornar, notificar_baixo_estoque, quantidade_item, registrar_saida
 from ..schemas.venda import VendaCreate, VendaUpdate, VendaResponse
 
-router = APIRouter(prefix="/api/vendas", tags=["vendas"])
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/vendas", tags=["vendas"], dependencies=[Depends(get_tenant_id)])
+
+# Listagens projetam só as colunas do VendaResponse (nome do vendedor/cliente via
+# JOIN) e montam a resposta direto das linhas, sem carregar User/Cliente inteiros.
+_COLUNAS_VENDA = (
+    Venda.id,
+    Venda.usuario_id,
+    Venda.cliente_id,
+    Venda.total,
+    Venda.desconto,
+    Venda.forma_pagamento,
+    Venda.observacoes,
+    Venda.cancelada,
+    Venda.created_at,
+    Venda.updated_at,
+    User.nome.label("usuario_nome"),
+    Cliente.nome.label("cliente_nome"),
+)
+_COLUNAS_ITEM = (
+    ItemVenda.id,
+    ItemVenda.venda_id,
+    ItemVenda.produto_id,
+    ItemVenda.quantidade,
+    ItemVenda.peso_kg,
+    ItemVenda.preco_unitario,
+    ItemVenda.subtotal,
+    ItemVenda.created_at,
+    ItemVenda.updated_at,
+)
+_LOTE_ITENS = 1000
+
+
+def _uuid_texto(valor) -> str:
+    """UUID normalizado como gravado (assinatura da venda); texto original se inválido."""
+    try:
+        return str(uuid.UUID(str(valor)))
+    except ValueError:
+        return str(valor)
+
+
+def _select_vendas():
+    return (
+        select(*_COLUNAS_VENDA)
+        .select_from(Venda)
+        .outerjoin(User, Venda.usuario_id == User.id)
+        .outerjoin(Cliente, Venda.cliente_id == Cliente.id)
+    )
+
+
+async def _montar_vendas(db: AsyncSession, stmt, ignorar_invalidas: bool = False) -> List[VendaResponse]:
+    """Executa um SELECT de _select_vendas() e anexa os itens (uma consulta por lote de vendas).
+
+    Registro que não valida no VendaResponse propaga o erro; com
+    `ignorar_invalidas` (listagens por usuário/período) é pulado e registrado no log.
+    """
+    rows = (await db.execute(stmt)).mappings().all()
+    itens_por_venda: dict = defaultdict(list)
+    ids = [r["id"] for r in rows]
+    for i in range(0, len(ids), _LOTE_ITENS):
+        itens = await db.execute(
+            select(*_COLUNAS_ITEM).where(ItemVenda.venda_id.in_(ids[i:i + _LOTE_ITENS]))
+        )
+        for it in itens.mappings():
+            itens_por_venda[it["venda_id"]].append(dict(it))
+
+    respostas = []
+    for r in rows:
+        try:
+            respostas.append(VendaResponse.model_validate({**r, "itens": itens_por_venda.get(r["id"], [])}))
+        except Exception:
+            if not ignorar_invalidas:
+                raise
+            logger.warning("Venda %s ignorada na listagem: registro inválido", r["id"], exc_info=True)
+    return respostas
+
+
+async def _obter_venda_resposta(db: AsyncSession, venda_id: uuid.UUID) -> VendaResponse | None:
+    vendas = await _montar_vendas(db, _select_vendas().where(Venda.id == venda_id))
+    return vendas[0] if vendas else None
 
 @router.get("/", response_model=List[VendaResponse])
 async def listar_vendas(db: AsyncSession = Depends(get_db_session)):
     """Lista todas as vendas."""
     try:
-        result = await db.execute(
-            select(Venda)
-            .options(
-                selectinload(Venda.itens),
-                selectinload(Venda.cliente),
-                selectinload(Venda.usuario),
-            )
-            .where(Venda.cancelada == False)
-        )
-        vendas = result.scalars().all()
-        # Injetar nome do usuário (vendedor) para o schema incluir
-        for v in vendas:
-            try:
-                setattr(v, 'usuario_nome', getattr(getattr(v, 'usuario', None), 'nome', None))
-            except Exception:
-                setattr(v, 'usuario_nome', None)
-        return [VendaResponse.model_validate(v) for v in vendas]
+        return await _montar_vendas(db, _select_vendas().where(Venda.cancelada == False))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao listar vendas: {str(e)}")
 
@@ -42,33 +111,30 @@ async def listar_vendas(db: AsyncSession = Depends(get_db_session)):
 async def obter_venda(venda_id: str, db: AsyncSession = Depends(get_db_session)):
     """Obtém uma venda específica por UUID."""
     try:
-        result = await db.execute(
-            select(Venda)
-            .options(
-                selectinload(Venda.itens),
-                selectinload(Venda.cliente),
-                selectinload(Venda.usuario),
-            )
-            .where(Venda.id == venda_id)
-        )
-        venda = result.scalar_one_or_none()
-        
-        if not venda:
-            raise HTTPException(status_code=404, detail="Venda não encontrada")
-        
-        try:
-            setattr(venda, 'usuario_nome', getattr(getattr(venda, 'usuario', None), 'nome', None))
-        except Exception:
-            setattr(venda, 'usuario_nome', None)
-        return VendaResponse.model_validate(venda)
+        venda_uuid = uuid.UUID(venda_id)
     except ValueError:
         raise HTTPException(status_code=400, detail="ID de venda inválido")
+    try:
+        venda = await _obter_venda_resposta(db, venda_uuid)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao obter venda: {str(e)}")
+    if not venda:
+        raise HTTPException(status_code=404, detail="Venda não encontrada")
+    return venda
 
 @router.post("/", response_model=VendaResponse)
-async def criar_venda(venda: VendaCreate, db: AsyncSession = Depends(get_db_session)):
-    """Cria uma nova venda."""
+async def criar_venda(
+    venda: VendaCreate,
+    db: AsyncSession = Depends(get_db_session),
+    tenant_id: uuid.UUID = Depends(get_tenant_id),
+):
+    """Cria uma nova venda.
+
+    Uma venda igual (mesmo vendedor, cliente, total, pagamento e itens) registrada
+    nos últimos minutos não impede a gravação (pode ser uma venda repetida de
+    verdade): a outra venda vem em `possivel_duplicada_de`. Reenvios são
+    barrados pelo `uuid` da venda e pelo header Idempotency-Key.
+    """
     try:
         # Criar nova venda
         venda_uuid = uuid.uuid4()
@@ -94,8 +160,32 @@ async def criar_venda(venda: VendaCreate, db: AsyncSession = Depends(get_db_sess
             except ValueError:
                 usuario_uuid = None
 
+        criado_em = venda.created_at if getattr(venda, 'created_at', None) else datetime.now(timezone.utc)
+        assinaturas = [
+            duplicidade_vendas.assinatura(
+                usuario_uuid,
+                cliente_uuid,
+                venda.total,
+                venda.forma_pagamento,
+                criado_em,
+                [
+                    (
+                        _uuid_texto(item.produto_id),
+                        max(1, int(item.quantidade or 0)),
+                        getattr(item, 'peso_kg', 0.0),
+                        item.subtotal,
+                    )
+                    for item in (venda.itens or [])
+                ],
+                janelas_antes=janelas_antes,
+            )
+            for janelas_antes in (0, 1)
+        ]
+        original = await duplicidade_vendas.venda_duplicada(db, tenant_id, assinaturas)
+
         nova_venda = Venda(
             id=venda_uuid,
+            tenant_id=tenant_id,
             usuario_id=usuario_uuid,
             cliente_id=cliente_uuid,
             total=venda.total,
@@ -104,13 +194,15 @@ async def criar_venda(venda: VendaCreate, db: AsyncSession = Depends(get_db_sess
             observacoes=venda.observacoes,
             cancelada=False,
             # Preservar a data original da venda, se enviada pelo cliente
-            created_at=venda.created_at if getattr(venda, 'created_at', None) else None
+            created_at=criado_em,
+            assinatura=assinaturas[0],
         )
         
         db.add(nova_venda)
         await db.flush()  # Para obter o ID da venda
         
         # Criar itens da venda se fornecidos
+        saidas_estoque: list[tuple[uuid.UUID, float]] = []
         if hasattr(venda, 'itens') and venda.itens:
             for item_data in venda.itens:
                 # Validar UUID de produto individualmente para evitar 500 genérico
@@ -150,12 +242,33 @@ async def criar_venda(venda: VendaCreate, db: AsyncSession = Depends(get_db_sess
                     taxa_iva=taxa_iva,
                     base_iva=base_iva,
                     valor_iva=valor_iva,
+                    codigo_imposto=getattr(produto_db, 'codigo_imposto', None),
                 )
                 db.add(item)
-        
+                saidas_estoque.append((produto_uuid, quantidade_item(quantidade, peso_kg)))
+
+        # Baixa de estoque atômica (mesma transação da venda)
+        movimentos = await registrar_saida(db, saidas_estoque, ORIGEM_VENDA, referencia_id=nova_venda.id, usuario_id=usuario_uuid)
+
+        # Rollups diário de IVA e horário de vendas (mesma transação)
+        await db.flush()
+        await iva_service.acumular_venda(db, nova_venda.id, sinal=1)
+        await metricas_vendas.acumular_venda(db, nova_venda.id, sinal=1)
+
         await db.commit()
         await db.refresh(nova_venda)
 
+        # Venda sincronizada com data passada altera dias já fechados (em cache)
+        if nova_venda.created_at is not None and nova_venda.created_at.date() < datetime.utcnow().date():
+            metricas_vendas.invalidar(tenant_id)
+            ranking_produtos.invalidar(tenant_id)
+
+        # Avisar (realtime) produtos que cruzaram o limite de estoque baixo com esta venda
+        try:
+            await notificar_baixo_estoque(db, movimentos)
+        except Exception:
+            pass
+
         # Broadcast evento em tempo real para clientes conectados
         try:
             payload = {
@@ -174,6 +287,7 @@ async def criar_venda(venda: VendaCreate, db: AsyncSession = Depends(get_db_sess
             # Não falhar a requisição caso broadcast dê erro
             pass
 
+        nova_venda.possivel_duplicada_de = original
         return nova_venda
     except HTTPException as he:
         # Propagar erros HTTP explícitos (ex.: produto inexistente -> 400)
@@ -195,6 +309,11 @@ async def criar_venda(venda: VendaCreate, db: AsyncSession = Depends(get_db_sess
 async def atualizar_venda(venda_id: str, venda: VendaUpdate, db: AsyncSession = Depends(get_db_session)):
     """Atualiza uma venda existente."""
     try:
+        try:
+            venda_uuid = uuid.UUID(venda_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ID de venda inválido")
+
         # Buscar venda existente
         result = await db.execute(select(Venda).where(Venda.id == venda_id))
         venda_existente = result.scalar_one_or_none()
@@ -224,29 +343,58 @@ async def atualizar_venda(venda_id: str, venda: VendaUpdate, db: AsyncSession =
         if venda.observacoes is not None:
             update_data[Venda.observacoes] = venda.observacoes
         if venda.cancelada is not None:
-            update_data[Venda.cancelada] = venda.cancelada
+            # Transição atômica de cancelada: só quem efetivamente muda o estado mexe no estoque
+            transicao = await db.execute(
+                update(Venda)
+                .where(Venda.id == venda_uuid, Venda.cancelada == (not venda.cancelada))
+                .values({Venda.cancelada: venda.cancelada})
+                .returning(Venda.id)
+                .execution_options(synchronize_session=False)
+            )
+            if transicao.first() is not None:
+                await iva_service.acumular_venda(db, venda_uuid, sinal=-1 if venda.cancelada else 1)
+                await metricas_vendas.acumular_venda(db, venda_uuid, sinal=-1 if venda.cancelada else 1)
+                if venda.cancelada:
+                    await estornar(db, venda_uuid)
+                else:
+                    itens_result = await db.execute(
+                        select(ItemVenda.produto_id, ItemVenda.quantidade, ItemVenda.peso_kg)
+                        .where(ItemVenda.venda_id == venda_uuid)
+                    )
+                    await registrar_saida(
+                        db,
+                        [(pid, quantidade_item(q, peso)) for pid, q, peso in itens_result.all()],
+                        ORIGEM_VENDA,
+                        referencia_id=venda_uuid,
+                    )
         
         update_data[Venda.updated_at] = datetime.utcnow()
         
+        # Vendedor/forma de pagamento/valores fazem parte do rollup de vendas:
+        # venda ativa sai do rollup com os valores antigos e volta com os novos
+        refazer_rollup = any(c in update_data for c in (Venda.usuario_id, Venda.forma_pagamento, Venda.total, Venda.desconto))
+        if refazer_rollup:
+            refazer_rollup = (await db.scalar(select(Venda.cancelada).where(Venda.id == venda_uuid))) is False
+        if refazer_rollup:
+            await metricas_vendas.acumular_venda(db, venda_uuid, sinal=-1)
+
         # IMPORTANTE: passar o dicionário diretamente (chaves são Column)
         await db.execute(
             update(Venda).where(Venda.id == venda_id).values(update_data)
         )
+        if refazer_rollup:
+            await metricas_vendas.acumular_venda(db, venda_uuid, sinal=1)
         await db.commit()
+        # Pode ter alterado dias já fechados (servidos do cache por mais tempo)
+        metricas_vendas.invalidar()
+        ranking_produtos.invalidar()
         
         # Retornar venda atualizada
-        result = await db.execute(
-            select(Venda)
-            .options(selectinload(Venda.itens), selectinload(Venda.cliente), selectinload(Venda.usuario))
-            .where(Venda.id == venda_id)
-        )
-        venda_atualizada = result.scalar_one()
-        try:
-            setattr(venda_atualizada, 'usuario_nome', getattr(getattr(venda_atualizada, 'usuario', None), 'nome', None))
-        except Exception:
-            setattr(venda_atualizada, 'usuario_nome', None)
-        return venda_atualizada
+        return await _obter_venda_resposta(db, venda_uuid)
         
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
         await db.rollback()
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar venda: {str(e)}")
@@ -309,7 +457,7 @@ async def listar_vendas_usuario(
             usuario_uuid = None
 
         # Query base
-        stmt = select(Venda).options(selectinload(Venda.itens), selectinload(Venda.cliente), selectinload(Venda.usuario))
+        stmt = _select_vendas()
 
         # Filtrar por usuário
         if usuario_uuid is not None:
@@ -345,24 +493,7 @@ async def listar_vendas_usuario(
         # Ordenar por data mais recente
         stmt = stmt.order_by(Venda.created_at.desc())
         
-        result = await db.execute(stmt)
-        vendas = result.scalars().all()
-        
-        # Injetar atributo transitório 'usuario_nome' para o schema incluir
-        respostas = []
-        for v in vendas:
-            try:
-                setattr(v, 'usuario_nome', getattr(getattr(v, 'usuario', None), 'nome', None))
-            except Exception:
-                setattr(v, 'usuario_nome', None)
-            # Serialização resiliente: ignora registros quebrados
-            try:
-                respostas.append(VendaResponse.model_validate(v))
-            except Exception:
-                # opcional: logar
-                continue
-        
-        return respostas
+        return await _montar_vendas(db, stmt, ignorar_invalidas=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar vendas do usuário: {str(e)}")
 
@@ -388,7 +519,7 @@ async def listar_vendas_periodo(
         d2_exclusive = d2 + timedelta(days=1)
 
         # Query base
-        stmt = select(Venda).options(selectinload(Venda.itens), selectinload(Venda.cliente), selectinload(Venda.usuario))
+        stmt = _select_vendas()
 
         # Filtrar por período
         stmt = stmt.where(Venda.created_at >= d1, Venda.created_at < d2_exclusive)
@@ -412,53 +543,40 @@ async def listar_vendas_periodo(
         if limit:
             stmt = stmt.limit(limit).offset(offset)
         
-        result = await db.execute(stmt)
-        vendas = result.scalars().all()
-        
-        # Injetar atributo transitório 'usuario_nome' para o schema incluir
-        respostas = []
-        for v in vendas:
-            try:
-                setattr(v, 'usuario_nome', getattr(getattr(v, 'usuario', None), 'nome', None))
-            except Exception:
-                setattr(v, 'usuario_nome', None)
-            try:
-                respostas.append(VendaResponse.model_validate(v))
-            except Exception:
-                # Ignora registros com dados inconsistentes
-                continue
-        
-        return respostas
+        return await _montar_vendas(db, stmt, ignorar_invalidas=True)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar vendas do período: {str(e)}")
 
 @router.put("/{venda_id}/cancelar", response_model=VendaResponse)
 async def cancelar_venda(venda_id: str, db: AsyncSession = Depends(get_db_session)):
-    """Anula (cancela) uma venda (cancelada=True)."""
+    """Anula (cancela) uma venda (cancelada=True) e devolve os itens ao estoque."""
     try:
-        # Atualizar flag cancelada
-        await db.execute(
+        try:
+            venda_uuid = uuid.UUID(venda_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ID de venda inválido")
+
+        # Atualizar flag cancelada apenas se ainda não estava cancelada (evita estorno duplo)
+        transicao = await db.execute(
             update(Venda)
-            .where(Venda.id == venda_id)
+            .where(Venda.id == venda_uuid, Venda.cancelada == False)
             .values({Venda.cancelada: True, Venda.updated_at: datetime.utcnow()})
+            .returning(Venda.id)
+            .execution_options(synchronize_session=False)
         )
+        if transicao.first() is not None:
+            await estornar(db, venda_uuid)
+            await iva_service.acumular_venda(db, venda_uuid, sinal=-1)
+            await metricas_vendas.acumular_venda(db, venda_uuid, sinal=-1)
         await db.commit()
+        metricas_vendas.invalidar()
+        ranking_produtos.invalidar()
 
         # Retornar venda atualizada
-        result = await db.execute(
-            select(Venda)
-            .options(selectinload(Venda.itens), selectinload(Venda.cliente), selectinload(Venda.usuario))
-            .where(Venda.id == venda_id)
-        )
-        venda_atualizada = result.scalar_one_or_none()
+        venda_atualizada = await _obter_venda_resposta(db, venda_uuid)
         if not venda_atualizada:
             raise HTTPException(status_code=404, detail="Venda não encontrada")
 
-        try:
-            setattr(venda_atualizada, 'usuario_nome', getattr(getattr(venda_atualizada, 'usuario', None), 'nome', None))
-        except Exception:
-            setattr(venda_atualizada, 'usuario_nome', None)
-
         # Broadcast realtime: venda cancelada
         try:
             await realtime_manager.broadcast("venda.cancelled", {
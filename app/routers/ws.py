@@ -6,7 +6,9 @@ router = APIRouter(prefix="/ws", tags=["ws"])
 @router.websocket("")
 async def websocket_endpoint(websocket: WebSocket):
     # Futuro: validar token via query params: token = websocket.query_params.get("token")
-    await manager.connect(websocket)
+    # Tenant da conexão (query ?tenant_id= ou header X-Tenant-Id): eventos por tenant só vão para ele
+    tenant_id = websocket.query_params.get("tenant_id") or websocket.headers.get("x-tenant-id")
+    await manager.connect(websocket, tenant_id.strip().lower() if tenant_id else None)
     try:
         while True:
             # Mantém a conexão viva; receber mensagens do cliente (pings) se houver
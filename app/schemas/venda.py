@@ -67,12 +67,15 @@ class VendaUpdate(BaseModel):
 class VendaResponse(VendaBase):
     id: str
     usuario_nome: Optional[str] = None
+    cliente_nome: Optional[str] = None
     cancelada: bool
     created_at: datetime
     updated_at: datetime
     itens: List[ItemVendaResponse] = Field(default_factory=list)
+    # Só no POST: venda igual registrada há instantes (a nova é gravada mesmo assim)
+    possivel_duplicada_de: Optional[str] = None
 
-    @field_validator('id', 'usuario_id', 'cliente_id', mode='before')
+    @field_validator('id', 'usuario_id', 'cliente_id', 'possivel_duplicada_de', mode='before')
     @classmethod
     def convert_uuid_to_str(cls, v):
         if isinstance(v, uuid.UUID):
@@ -0,0 +1,165 @@
+"""Change-log das entidades sincronizadas (pdv.alteracoes).
+
+Todo INSERT/UPDATE/DELETE em produtos, clientes, usuarios, vendas e dividas
+grava, por trigger de comando (transition tables: uma inserção por comando,
+não por linha), uma linha (tenant_id, entidade, registro_id, operacao,
+versao, transacao). Triggers pegam também os UPDATE/DELETE em massa e o SQL
+textual, que um hook de sessão do SQLAlchemy não veria.
+
+Leitura (sync/pull): em ordem de (transacao, versao), só de transações já
+encerradas — transacao < txid_snapshot_xmin(txid_current_snapshot()). Nenhuma
+alteração nova pode surgir abaixo desse limite, então o cursor nunca passa por
+cima de uma transação que ainda vai fazer commit.
+
+Compactação: o pull entrega o estado atual do registro, então só a última
+alteração de cada registro importa; as anteriores são apagadas periodicamente
+em lotes por faixa de versao (`iniciar_compactacao`).
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import async_session
+
+
+logger = logging.getLogger(__name__)
+
+# entidade -> tabela
+ENTIDADES = {
+    "produto": "pdv.produtos",
+    "cliente": "pdv.clientes",
+    "usuario": "pdv.usuarios",
+    "venda": "pdv.vendas",
+    "divida": "pdv.dividas",
+}
+
+LOTE_COMPACTACAO = 5000
+
+_FUNCAO_TRIGGER = """
+CREATE OR REPLACE FUNCTION pdv.registrar_alteracoes() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO pdv.alteracoes (id, tenant_id, entidade, registro_id, operacao)
+        SELECT gen_random_uuid(), o.tenant_id, TG_ARGV[0], o.id, 'delete'
+        FROM antigos o WHERE o.tenant_id IS NOT NULL;
+    ELSE
+        INSERT INTO pdv.alteracoes (id, tenant_id, entidade, registro_id, operacao)
+        SELECT gen_random_uuid(), n.tenant_id, TG_ARGV[0], n.id, lower(TG_OP)
+        FROM novos n WHERE n.tenant_id IS NOT NULL;
+    END IF;
+    RETURN NULL;
+END
+$$
+"""
+
+# Transition tables exigem um trigger por evento
+_TRIGGERS = (
+    ("ins", "INSERT", "NEW TABLE AS novos"),
+    ("upd", "UPDATE", "NEW TABLE AS novos"),
+    ("del", "DELETE", "OLD TABLE AS antigos"),
+)
+
+
+async def instalar_captura(conn) -> None:
+    """Cria/atualiza a função e os triggers de captura (chamado no startup)."""
+    await conn.execute(text(_FUNCAO_TRIGGER))
+    for entidade, tabela in ENTIDADES.items():
+        for sufixo, evento, referencia in _TRIGGERS:
+            nome = f"tg_alteracoes_{sufixo}"
+            await conn.execute(text(f"DROP TRIGGER IF EXISTS {nome} ON {tabela}"))
+            await conn.execute(text(
+                f"CREATE TRIGGER {nome} AFTER {evento} ON {tabela} REFERENCING {referencia} "
+                f"FOR EACH STATEMENT EXECUTE FUNCTION pdv.registrar_alteracoes('{entidade}')"
+            ))
+
+
+async def garantir_alteracoes(db: AsyncSession) -> None:
+    """Backfill na primeira execução: uma alteração 'insert' por registro existente."""
+    vazio = await db.scalar(text("SELECT NOT EXISTS (SELECT 1 FROM pdv.alteracoes)"))
+    if vazio:
+        for entidade, tabela in ENTIDADES.items():
+            await db.execute(
+                text(
+                    f"INSERT INTO pdv.alteracoes (id, tenant_id, entidade, registro_id, operacao) "
+                    f"SELECT gen_random_uuid(), tenant_id, :entidade, id, 'insert' FROM {tabela} "
+                    f"WHERE tenant_id IS NOT NULL ORDER BY updated_at"
+                ),
+                {"entidade": entidade},
+            )
+
+
+async def compactar(db: AsyncSession, lote: int = LOTE_COMPACTACAO) -> int:
+    """Apaga alterações superadas por outra mais nova do mesmo registro.
+
+    Percorre a tabela em faixas de `lote` versões, com commit por faixa.
+    Devolve quantas linhas foram apagadas.
+    """
+    apagadas = 0
+    desde = 0
+    while True:
+        # Um processo por vez (vários workers podem rodar a compactação)
+        if not await db.scalar(text("SELECT pg_try_advisory_xact_lock(hashtext('alteracoes:compactar'))")):
+            await db.rollback()
+            return apagadas
+        ate = await db.scalar(
+            text(
+                "SELECT max(versao) FROM (SELECT versao FROM pdv.alteracoes WHERE versao > :desde "
+                "ORDER BY versao LIMIT :lote) s"
+            ),
+            {"desde": desde, "lote": lote},
+        )
+        if ate is None:
+            await db.commit()
+            return apagadas
+        result = await db.execute(
+            text("""
+                DELETE FROM pdv.alteracoes a
+                WHERE a.versao > :desde AND a.versao <= :ate
+                  AND EXISTS (
+                      SELECT 1 FROM pdv.alteracoes b
+                      WHERE b.tenant_id = a.tenant_id AND b.entidade = a.entidade
+                        AND b.registro_id = a.registro_id AND b.versao > a.versao
+                  )
+            """),
+            {"desde": desde, "ate": ate},
+        )
+        apagadas += result.rowcount or 0
+        await db.commit()
+        desde = ate
+
+
+_tarefa: Optional[asyncio.Task] = None
+
+
+async def _loop_compactacao(intervalo: int) -> None:
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            async with async_session() as db:
+                apagadas = await compactar(db)
+            if apagadas:
+                logger.info("Change-log compactado: %s alterações superadas removidas", apagadas)
+        except Exception:
+            logger.exception("Falha ao compactar o change-log")
+
+
+async def iniciar_compactacao(intervalo: Optional[int] = None) -> None:
+    """Agenda a compactação periódica (chamado no startup; 0 desativa)."""
+    global _tarefa
+    intervalo = settings.ALTERACOES_COMPACTAR_SEGUNDOS if intervalo is None else intervalo
+    if _tarefa is not None or intervalo <= 0:
+        return
+    _tarefa = asyncio.create_task(_loop_compactacao(intervalo))
+
+
+async def parar_compactacao() -> None:
+    global _tarefa
+    if _tarefa is not None:
+        _tarefa.cancel()
+        await asyncio.gather(_tarefa, return_exceptions=True)
+        _tarefa = None
@@ -0,0 +1,95 @@
+"""Busca de clientes no caixa (telefone, NUIT/documento ou nome), ordenada e limitada.
+
+Índices usados (criados no lifespan):
+- ix_clientes_tenant_telefone_digitos: (tenant_id, só dígitos do telefone) — igualdade e prefixo
+- ix_clientes_tenant_documento: (tenant_id, documento) — igualdade e prefixo
+- ix_clientes_nome_trgm: GIN trigram em nome (pg_trgm) — ILIKE '%termo%' e busca aproximada
+
+Sem a extensão pg_trgm a busca por nome continua funcionando (ILIKE), só
+sem índice e sem a ordenação por similaridade.
+"""
+import re
+from typing import Optional
+import uuid
+
+from sqlalchemy import case, func, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Cliente
+
+
+# Mínimo de dígitos para tratar o termo como telefone/documento
+MIN_DIGITOS = 3
+
+_trigram: Optional[bool] = None
+
+
+def telefone_digitos(coluna):
+    """Expressão SQL com só os dígitos do telefone (mesma do índice)."""
+    return func.regexp_replace(coluna, "[^0-9]", "", "g")
+
+
+async def _tem_trigram(db: AsyncSession) -> bool:
+    global _trigram
+    if _trigram is None:
+        _trigram = bool(await db.scalar(text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")))
+    return _trigram
+
+
+def _escapar_like(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def buscar_clientes(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    termo: str,
+    limite: int = 20,
+    incluir_inativos: bool = False,
+) -> list:
+    """Clientes do tenant que casam com o termo, melhores primeiro.
+
+    Ordem: telefone/documento exato, prefixo de telefone/documento, nome
+    começando pelo termo, nome contendo o termo (ou parecido, com pg_trgm).
+    """
+    termo = (termo or "").strip()
+    if not termo:
+        return []
+    digitos = re.sub(r"[^0-9]", "", termo)
+    like = _escapar_like(termo)
+    trigram = await _tem_trigram(db)
+
+    tel = telefone_digitos(Cliente.telefone)
+    condicoes = [
+        Cliente.documento == termo,
+        Cliente.documento.like(f"{like}%"),
+        Cliente.nome.ilike(f"%{like}%"),
+    ]
+    exato = [Cliente.documento == termo]
+    prefixo = [Cliente.documento.like(f"{like}%")]
+    if len(digitos) >= MIN_DIGITOS:
+        condicoes += [tel == digitos, tel.like(f"{digitos}%")]
+        exato.append(tel == digitos)
+        prefixo.append(tel.like(f"{digitos}%"))
+    if trigram and len(termo) >= 3:
+        condicoes.append(Cliente.nome.op("%")(termo))
+
+    rank = case(
+        (or_(*exato), 0),
+        (or_(*prefixo), 1),
+        (Cliente.nome.ilike(f"{like}%"), 2),
+        else_=3,
+    )
+    ordem = [rank]
+    if trigram:
+        ordem.append(func.similarity(Cliente.nome, termo).desc())
+
+    stmt = (
+        select(Cliente)
+        .where(Cliente.tenant_id == tenant_id, or_(*condicoes))
+        .order_by(*ordem, Cliente.nome, Cliente.id)
+        .limit(limite)
+    )
+    if not incluir_inativos:
+        stmt = stmt.where(Cliente.ativo == True)
+    return list((await db.execute(stmt)).scalars().all())
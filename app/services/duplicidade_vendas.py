@@ -0,0 +1,186 @@
+"""Detecção de vendas possivelmente duplicadas (mesmo carrinho registrado de novo).
+
+Cada venda grava na inserção uma assinatura do conteúdo em pdv.vendas.assinatura:
+md5 de (vendedor, cliente, total, forma de pagamento, janela de JANELA_SEGUNDOS
+do created_at, itens ordenados). Índice: ix_vendas_tenant_assinatura
+(tenant_id, assinatura).
+
+- Online (criar_venda): procura uma venda ativa do tenant com a assinatura da
+  janela atual ou da anterior (vendas iguais com até 1-2 janelas de diferença)
+  — uma leitura pelo índice. A venda é gravada sempre e a coincidência só é
+  informada (possivel_duplicada_de): a assinatura não distingue um reenvio de
+  duas vendas iguais no caixa. Reenvios ficam com o uuid da venda e o
+  Idempotency-Key.
+- Job (`deduplicar`, scripts/dedupe_vendas.py): preenche assinaturas ausentes e
+  percorre as vendas em lotes por (created_at, id), listando as que têm a mesma
+  assinatura de uma venda mais antiga. Nada é anulado: vendas iguais com uuids
+  diferentes podem ser vendas repetidas de verdade, e a anulação fica a cargo
+  de quem conferir a lista (cancelamento normal da venda).
+
+A assinatura é calculada em Python (`assinatura`) e em SQL (`_SQL_ASSINATURA`,
+usado no preenchimento); as duas precisam produzir o mesmo texto. Ela reflete a
+venda como foi criada: edições posteriores não a recalculam.
+"""
+from datetime import datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterable, Optional
+import hashlib
+import uuid
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.paginacao import codificar_cursor, decodificar_cursor
+from app.db.models import Venda
+
+
+JANELA_SEGUNDOS = 120
+LOTE_DEDUPLICACAO = 1000
+
+# Mesmo formato de `assinatura` (round numeric = meio para cima; itens em ordem "C")
+_SQL_ASSINATURA = f"""
+md5(concat_ws('|',
+    coalesce(v.usuario_id::text, ''),
+    coalesce(v.cliente_id::text, ''),
+    round(v.total::numeric, 2)::text,
+    coalesce(v.forma_pagamento, ''),
+    floor(extract(epoch FROM v.created_at) / {JANELA_SEGUNDOS})::bigint::text,
+    coalesce((
+        SELECT string_agg(s.item, ';' ORDER BY s.item COLLATE "C")
+        FROM (
+            SELECT concat_ws(':',
+                i.produto_id::text,
+                i.quantidade::text,
+                round(coalesce(i.peso_kg, 0)::numeric, 3)::text,
+                round(i.subtotal::numeric, 2)::text
+            ) AS item
+            FROM pdv.itens_venda i WHERE i.venda_id = v.id
+        ) s
+    ), '')
+))
+"""
+
+
+def _decimal(valor, casas: str) -> str:
+    return str(Decimal(str(float(valor or 0))).quantize(Decimal(casas), rounding=ROUND_HALF_UP))
+
+
+def _balde(criado_em: datetime) -> int:
+    if criado_em.tzinfo is None:
+        criado_em = criado_em.replace(tzinfo=timezone.utc)
+    return int(criado_em.timestamp() // JANELA_SEGUNDOS)
+
+
+def assinatura(
+    usuario_id: Optional[uuid.UUID],
+    cliente_id: Optional[uuid.UUID],
+    total: float,
+    forma_pagamento: Optional[str],
+    criado_em: datetime,
+    itens: Iterable[tuple],
+    janelas_antes: int = 0,
+) -> str:
+    """Assinatura da venda; `itens` são (produto_id, quantidade, peso_kg, subtotal) como gravados.
+
+    `janelas_antes` desloca a janela de tempo (1 = a janela anterior).
+    """
+    partes = sorted(
+        ":".join((str(pid), str(int(q)), _decimal(peso, "0.001"), _decimal(sub, "0.01")))
+        for pid, q, peso, sub in itens
+    )
+    bruto = "|".join((
+        str(usuario_id) if usuario_id else "",
+        str(cliente_id) if cliente_id else "",
+        _decimal(total, "0.01"),
+        forma_pagamento or "",
+        str(_balde(criado_em) - janelas_antes),
+        ";".join(partes),
+    ))
+    return hashlib.md5(bruto.encode("utf-8")).hexdigest()
+
+
+async def venda_duplicada(db: AsyncSession, tenant_id: uuid.UUID, assinaturas: list[str]) -> Optional[uuid.UUID]:
+    """Id da venda ativa mais antiga do tenant com uma das assinaturas, se houver."""
+    return await db.scalar(
+        select(Venda.id)
+        .where(Venda.tenant_id == tenant_id, Venda.assinatura.in_(assinaturas), Venda.cancelada == False)
+        .order_by(Venda.created_at, Venda.id)
+        .limit(1)
+    )
+
+
+async def preencher_assinaturas(db: AsyncSession, lote: int = LOTE_DEDUPLICACAO) -> int:
+    """Calcula a assinatura das vendas que não têm (anteriores à coluna), com commit por lote."""
+    total = 0
+    while True:
+        result = await db.execute(
+            text(
+                f"UPDATE pdv.vendas v SET assinatura = {_SQL_ASSINATURA} "
+                "WHERE v.id IN (SELECT id FROM pdv.vendas WHERE assinatura IS NULL LIMIT :lote)"
+            ),
+            {"lote": lote},
+        )
+        await db.commit()
+        total += result.rowcount or 0
+        if (result.rowcount or 0) < lote:
+            return total
+
+
+_SQL_LOTE = """
+WITH lote AS (
+    SELECT id, tenant_id, assinatura, created_at FROM pdv.vendas
+    WHERE cancelada = false AND tenant_id IS NOT NULL AND assinatura IS NOT NULL {apos}
+    ORDER BY created_at, id
+    LIMIT :lote
+)
+SELECT l.id, l.created_at, o.id AS original
+FROM lote l
+CROSS JOIN LATERAL (
+    SELECT v.id FROM pdv.vendas v
+    WHERE v.tenant_id = l.tenant_id AND v.assinatura = l.assinatura AND v.cancelada = false
+    ORDER BY v.created_at, v.id
+    LIMIT 1
+) o
+ORDER BY l.created_at, l.id
+"""
+
+
+async def deduplicar(
+    db: AsyncSession,
+    cursor: Optional[str] = None,
+    lote: int = LOTE_DEDUPLICACAO,
+) -> dict:
+    """Lista vendas possivelmente duplicadas depois do cursor (sem alterá-las).
+
+    Cada lote de `lote` vendas é uma consulta (cada venda contra o índice de
+    assinatura). Devolve {"verificadas", "duplicadas": [(id, original)],
+    "cursor"}; o cursor retoma a próxima execução de onde esta parou. Lança
+    ValueError para cursor inválido.
+    """
+    await preencher_assinaturas(db, lote)
+    apos = None
+    if cursor:
+        criado_em, venda_id = decodificar_cursor(cursor, 2)
+        apos = (datetime.fromisoformat(criado_em), uuid.UUID(venda_id))
+
+    verificadas, duplicadas = 0, []
+    while True:
+        params: dict = {"lote": lote}
+        filtro = ""
+        if apos is not None:
+            filtro = "AND (created_at, id) > (:apos_em, :apos_id)"
+            params.update(apos_em=apos[0], apos_id=apos[1])
+        linhas = (await db.execute(text(_SQL_LOTE.format(apos=filtro)), params)).all()
+        if not linhas:
+            break
+        verificadas += len(linhas)
+        duplicadas += [(linha.id, linha.original) for linha in linhas if linha.original != linha.id]
+        apos = (linhas[-1].created_at, linhas[-1].id)
+        if len(linhas) < lote:
+            break
+
+    return {
+        "verificadas": verificadas,
+        "duplicadas": duplicadas,
+        "cursor": codificar_cursor(apos[0].isoformat(), apos[1]) if apos else cursor,
+    }
@@ -0,0 +1,104 @@
+"""Perfil da empresa (EmpresaConfig) por tenant, com cache em memória.
+
+Relatórios, exportação fiscal, regras de estoque baixo e o endpoint de
+configuração leem daqui: a consulta ao banco acontece só na primeira vez (ou
+após `invalidar`, chamado no PUT /api/config/empresa). O cache guarda um
+snapshot imutável (`PerfilEmpresa`), nunca o objeto ORM, para poder ser
+compartilhado entre sessões.
+
+Com vários processos, a invalidação só atinge o processo que recebeu o PUT; o
+TTL limita por quanto tempo os outros podem servir o perfil anterior.
+"""
+from typing import NamedTuple, Optional
+import time
+import uuid
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import EmpresaConfig
+
+
+TTL_SEGUNDOS = 60
+
+
+class PerfilEmpresa(NamedTuple):
+    id: Optional[uuid.UUID] = None
+    tenant_id: Optional[uuid.UUID] = None
+    nome: str = ""
+    nuit: Optional[str] = None
+    telefone: Optional[str] = None
+    email: Optional[str] = None
+    endereco: Optional[str] = None
+    logo_path: Optional[str] = None
+    estoque_baixo_padrao: float = 5.0
+    categorias_sem_estoque: Optional[tuple[int, ...]] = (15,)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": str(self.id) if self.id else None,
+            "nome": self.nome,
+            "nuit": self.nuit,
+            "telefone": self.telefone,
+            "email": self.email,
+            "endereco": self.endereco,
+            "logo_path": self.logo_path,
+            "estoque_baixo_padrao": self.estoque_baixo_padrao,
+            "categorias_sem_estoque": list(self.categorias_sem_estoque) if self.categorias_sem_estoque is not None else None,
+        }
+
+
+_cache: dict[uuid.UUID, tuple[float, PerfilEmpresa]] = {}
+
+
+def _snapshot(cfg: EmpresaConfig) -> PerfilEmpresa:
+    padrao = PerfilEmpresa()
+    return PerfilEmpresa(
+        id=cfg.id,
+        tenant_id=cfg.tenant_id,
+        nome=cfg.nome or "",
+        nuit=cfg.nuit,
+        telefone=cfg.telefone,
+        email=cfg.email,
+        endereco=cfg.endereco,
+        logo_path=cfg.logo_path,
+        estoque_baixo_padrao=float(cfg.estoque_baixo_padrao) if cfg.estoque_baixo_padrao is not None else padrao.estoque_baixo_padrao,
+        categorias_sem_estoque=tuple(cfg.categorias_sem_estoque) if cfg.categorias_sem_estoque is not None else None,
+    )
+
+
+async def obter_perfil(db: AsyncSession, tenant_id: Optional[uuid.UUID]) -> PerfilEmpresa:
+    """Perfil do tenant (padrão se ainda não configurado). Não grava nada no banco."""
+    if tenant_id is None:
+        return PerfilEmpresa()
+    agora = time.monotonic()
+    item = _cache.get(tenant_id)
+    if item is not None and agora - item[0] < TTL_SEGUNDOS:
+        return item[1]
+
+    result = await db.execute(
+        select(EmpresaConfig)
+        .where(EmpresaConfig.tenant_id == tenant_id)
+        .order_by(EmpresaConfig.created_at)
+        .limit(1)
+    )
+    cfg = result.scalar_one_or_none()
+    perfil = _snapshot(cfg) if cfg is not None else PerfilEmpresa(tenant_id=tenant_id)
+    _cache[tenant_id] = (agora, perfil)
+    return perfil
+
+
+def atualizar_cache(cfg: EmpresaConfig) -> PerfilEmpresa:
+    """Guarda o perfil recém-gravado (chamar depois do commit)."""
+    perfil = _snapshot(cfg)
+    if cfg.tenant_id is not None:
+        _cache[cfg.tenant_id] = (time.monotonic(), perfil)
+    return perfil
+
+
+def invalidar(tenant_id: Optional[uuid.UUID] = None) -> None:
+    """Descarta o perfil de um tenant (ou de todos)."""
+    if tenant_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(tenant_id, None)
@@ -0,0 +1,341 @@
+"""Movimentação de estoque no servidor (livro-razão + atualização atômica).
+
+Toda alteração de `Produto.estoque` passa por aqui:
+- grava as linhas em `movimentos_estoque`;
+- aplica os deltas com um único `UPDATE ... SET estoque = estoque + v.delta
+  FROM (VALUES ...)`, sem ler o valor antes. Vendas concorrentes em caixas
+  diferentes somam-se corretamente em vez de sobrescrever umas às outras.
+
+As funções não fazem commit: participam da transação do chamador, de modo que a
+venda/dívida e o movimento de estoque são gravados (ou descartados) juntos.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+import uuid
+
+from sqlalchemy import Float, and_, column, func, insert, or_, select, text, update, values
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.realtime import manager as realtime_manager
+from app.db.models import MovimentoEstoque, Produto
+from app.services.empresa import obter_perfil
+
+
+ORIGEM_ABERTURA = "abertura"
+ORIGEM_VENDA = "venda"
+ORIGEM_VENDA_ESTORNO = "venda_estorno"
+ORIGEM_DIVIDA = "divida"
+ORIGEM_AJUSTE = "ajuste"
+ORIGEM_SYNC = "sync"
+
+
+def quantidade_item(quantidade, peso_kg) -> float:
+    """Quantidade efetiva de um item: peso (kg) para venda por peso, senão unidades."""
+    peso = float(peso_kg or 0)
+    return peso if peso > 0 else float(quantidade or 0)
+
+
+async def _atualizar_estoque(db: AsyncSession, por_produto: dict[uuid.UUID, float]) -> list:
+    """UPDATE único com os deltas já somados por produto; retorna as linhas atualizadas."""
+    # Ordem estável de ids reduz risco de deadlock entre vendas concorrentes
+    dados = sorted((pid, d) for pid, d in por_produto.items() if d != 0)
+    if not dados:
+        return []
+
+    v = values(
+        column("produto_id", UUID(as_uuid=True)),
+        column("delta", Float),
+        name="v",
+    ).data(dados)
+
+    stmt = (
+        update(Produto)
+        .where(Produto.id == v.c.produto_id)
+        .values(estoque=func.coalesce(Produto.estoque, 0) + v.c.delta, updated_at=func.now())
+        .returning(
+            Produto.id,
+            Produto.tenant_id,
+            Produto.estoque,
+            Produto.estoque_minimo,
+            Produto.categoria_id,
+            v.c.delta,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return (await db.execute(stmt)).all()
+
+
+async def aplicar_movimentos(
+    db: AsyncSession,
+    deltas: Iterable[tuple[uuid.UUID, float]],
+    origem: str,
+    referencia_id: Optional[uuid.UUID] = None,
+    usuario_id: Optional[uuid.UUID] = None,
+) -> list:
+    """Aplica deltas de estoque (positivos = entrada) e registra no livro-razão.
+
+    Deltas do mesmo produto são somados antes. Retorna as linhas atualizadas
+    (id, tenant_id, estoque, estoque_minimo, categoria_id, delta); produtos
+    inexistentes são ignorados.
+    """
+    por_produto: dict[uuid.UUID, float] = defaultdict(float)
+    for produto_id, delta in deltas:
+        por_produto[produto_id] += float(delta or 0)
+    rows = await _atualizar_estoque(db, por_produto)
+    if not rows:
+        return []
+
+    await db.execute(
+        insert(MovimentoEstoque),
+        [
+            {
+                "tenant_id": r.tenant_id,
+                "produto_id": r.id,
+                "quantidade": float(r.delta),
+                "origem": origem,
+                "referencia_id": referencia_id,
+                "usuario_id": usuario_id,
+            }
+            for r in rows
+        ],
+    )
+    return rows
+
+
+async def registrar_saidas_em_lote(
+    db: AsyncSession,
+    saidas: Iterable[tuple[uuid.UUID, Optional[uuid.UUID], Iterable[tuple[uuid.UUID, float]]]],
+    origem: str,
+) -> list:
+    """Baixa de estoque de várias referências (ex.: dívidas de um sync) num único UPDATE.
+
+    `saidas` são tuplas (referencia_id, usuario_id, itens). O estoque recebe a
+    soma por produto; o livro-razão mantém uma linha por referência e produto.
+    Retorna as linhas atualizadas (delta = soma do lote), como aplicar_movimentos.
+    """
+    por_referencia: list[tuple[uuid.UUID, Optional[uuid.UUID], dict[uuid.UUID, float]]] = []
+    por_produto: dict[uuid.UUID, float] = defaultdict(float)
+    for referencia_id, usuario_id, itens in saidas:
+        deltas: dict[uuid.UUID, float] = defaultdict(float)
+        for produto_id, quantidade in itens:
+            deltas[produto_id] -= float(quantidade or 0)
+        por_referencia.append((referencia_id, usuario_id, deltas))
+        for produto_id, delta in deltas.items():
+            por_produto[produto_id] += delta
+
+    rows = await _atualizar_estoque(db, por_produto)
+    if not rows:
+        return []
+
+    tenant_por_produto = {r.id: r.tenant_id for r in rows}
+    movimentos = [
+        {
+            "tenant_id": tenant_por_produto[produto_id],
+            "produto_id": produto_id,
+            "quantidade": delta,
+            "origem": origem,
+            "referencia_id": referencia_id,
+            "usuario_id": usuario_id,
+        }
+        for referencia_id, usuario_id, deltas in por_referencia
+        for produto_id, delta in deltas.items()
+        if delta != 0 and produto_id in tenant_por_produto
+    ]
+    if movimentos:
+        await db.execute(insert(MovimentoEstoque), movimentos)
+    return rows
+
+
+async def registrar_saida(
+    db: AsyncSession,
+    itens: Iterable[tuple[uuid.UUID, float]],
+    origem: str,
+    referencia_id: Optional[uuid.UUID] = None,
+    usuario_id: Optional[uuid.UUID] = None,
+) -> list:
+    """Baixa de estoque para os itens (produto_id, quantidade) de uma venda/dívida."""
+    return await aplicar_movimentos(
+        db,
+        ((pid, -float(q or 0)) for pid, q in itens),
+        origem,
+        referencia_id=referencia_id,
+        usuario_id=usuario_id,
+    )
+
+
+async def estornar(
+    db: AsyncSession,
+    referencia_id: uuid.UUID,
+    origem: str = ORIGEM_VENDA_ESTORNO,
+    usuario_id: Optional[uuid.UUID] = None,
+) -> list:
+    """Reverte o saldo líquido de todos os movimentos de uma referência.
+
+    Como usa o saldo líquido (saídas + estornos anteriores), chamar duas vezes
+    não devolve o estoque em dobro.
+    """
+    result = await db.execute(
+        select(MovimentoEstoque.produto_id, func.sum(MovimentoEstoque.quantidade))
+        .where(MovimentoEstoque.referencia_id == referencia_id)
+        .group_by(MovimentoEstoque.produto_id)
+    )
+    deltas = [(pid, -float(total or 0)) for pid, total in result.all()]
+    return await aplicar_movimentos(db, deltas, origem, referencia_id=referencia_id, usuario_id=usuario_id)
+
+
+async def registrar_ajuste(
+    db: AsyncSession,
+    produto_id: uuid.UUID,
+    estoque_novo: float,
+    origem: str = ORIGEM_AJUSTE,
+    usuario_id: Optional[uuid.UUID] = None,
+) -> list:
+    """Define o estoque absoluto de um produto gravando o delta como ajuste."""
+    atual = await db.scalar(
+        select(Produto.estoque).where(Produto.id == produto_id).with_for_update()
+    )
+    if atual is None:
+        return []
+    return await aplicar_movimentos(
+        db, [(produto_id, float(estoque_novo or 0) - float(atual or 0))], origem, usuario_id=usuario_id
+    )
+
+
+async def garantir_abertura(db: AsyncSession) -> None:
+    """Cria o movimento de abertura para produtos ainda sem livro-razão.
+
+    Necessário para que o recálculo a partir do livro-razão preserve o estoque
+    que já existia antes da introdução dos movimentos. Idempotente.
+    """
+    await db.execute(
+        text(
+            """
+            INSERT INTO pdv.movimentos_estoque (id, tenant_id, produto_id, quantidade, origem)
+            SELECT gen_random_uuid(), p.tenant_id, p.id, COALESCE(p.estoque, 0), :origem
+            FROM pdv.produtos p
+            WHERE NOT EXISTS (
+                SELECT 1 FROM pdv.movimentos_estoque m WHERE m.produto_id = p.id
+            )
+            """
+        ),
+        {"origem": ORIGEM_ABERTURA},
+    )
+
+
+async def recalcular_estoque(db: AsyncSession, tenant_id: Optional[uuid.UUID] = None) -> int:
+    """Recalcula `Produto.estoque` como a soma do livro-razão. Retorna nº de produtos corrigidos."""
+    filtro_tenant = "AND p.tenant_id = :tenant_id" if tenant_id else ""
+    result = await db.execute(
+        text(
+            f"""
+            UPDATE pdv.produtos p
+            SET estoque = s.saldo, updated_at = now()
+            FROM (
+                SELECT produto_id, SUM(quantidade) AS saldo
+                FROM pdv.movimentos_estoque
+                GROUP BY produto_id
+            ) s
+            WHERE p.id = s.produto_id
+              AND p.estoque IS DISTINCT FROM s.saldo
+              {filtro_tenant}
+            """
+        ),
+        {"tenant_id": tenant_id} if tenant_id else {},
+    )
+    return result.rowcount or 0
+
+
+class LimitesEstoque(NamedTuple):
+    """Regras de estoque baixo de um tenant (ver EmpresaConfig)."""
+    padrao: float = 5.0
+    categorias_excluidas: tuple[int, ...] = (15,)
+
+
+LIMITES_PADRAO = LimitesEstoque()
+
+
+async def obter_limites(db: AsyncSession, tenant_id: Optional[uuid.UUID]) -> LimitesEstoque:
+    """Limites do tenant a partir do perfil da empresa em cache (sem consulta após a primeira)."""
+    perfil = await obter_perfil(db, tenant_id)
+    if perfil.id is None:
+        return LIMITES_PADRAO
+    return LimitesEstoque(
+        padrao=float(perfil.estoque_baixo_padrao if perfil.estoque_baixo_padrao is not None else LIMITES_PADRAO.padrao),
+        categorias_excluidas=perfil.categorias_sem_estoque if perfil.categorias_sem_estoque is not None else LIMITES_PADRAO.categorias_excluidas,
+    )
+
+
+def filtro_baixo_estoque(limites: LimitesEstoque):
+    """Condição SQL de estoque baixo.
+
+    - produto com estoque_minimo > 0: estoque <= estoque_minimo
+    - sem mínimo próprio: estoque <= limite padrão do tenant
+    - categorias sem controle de estoque nunca entram.
+    Escrita para casar com os índices parciais ix_produtos_baixo_estoque_*.
+    """
+    cond = and_(
+        Produto.ativo == True,
+        or_(
+            and_(Produto.estoque_minimo > 0, Produto.estoque - Produto.estoque_minimo <= 0),
+            and_(
+                or_(Produto.estoque_minimo == None, Produto.estoque_minimo <= 0),
+                Produto.estoque <= limites.padrao,
+            ),
+        ),
+    )
+    if limites.categorias_excluidas:
+        cond = and_(
+            cond,
+            or_(Produto.categoria_id == None, Produto.categoria_id.not_in(limites.categorias_excluidas)),
+        )
+    return cond
+
+
+def is_baixo(estoque, estoque_minimo, categoria_id, limites: LimitesEstoque) -> bool:
+    """Mesma regra de filtro_baixo_estoque, em Python (para um único produto)."""
+    if categoria_id is not None and categoria_id in limites.categorias_excluidas:
+        return False
+    estoque = float(estoque or 0)
+    minimo = float(estoque_minimo or 0)
+    if minimo > 0:
+        return estoque <= minimo
+    return estoque <= limites.padrao
+
+
+async def notificar_baixo_estoque(db: AsyncSession, rows: list) -> None:
+    """Emite `produto.low_stock` para produtos que acabaram de cruzar o limite.
+
+    `rows` são as linhas retornadas por aplicar_movimentos (estoque já com o
+    delta aplicado). Chamar depois do commit.
+    """
+    if not rows:
+        return
+    limites_por_tenant: dict = {}
+    for r in rows:
+        # Sem tenant não há a quem avisar (o evento só vai às conexões do tenant)
+        if r.tenant_id is None:
+            continue
+        if r.tenant_id not in limites_por_tenant:
+            limites_por_tenant[r.tenant_id] = await obter_limites(db, r.tenant_id)
+        limites = limites_por_tenant[r.tenant_id]
+        estoque_novo = float(r.estoque or 0)
+        estoque_anterior = estoque_novo - float(r.delta or 0)
+        if not is_baixo(estoque_novo, r.estoque_minimo, r.categoria_id, limites):
+            continue
+        if is_baixo(estoque_anterior, r.estoque_minimo, r.categoria_id, limites):
+            continue
+        try:
+            await realtime_manager.broadcast("produto.low_stock", {
+                "ts": datetime.utcnow().isoformat(),
+                "data": {
+                    "id": str(r.id),
+                    "tenant_id": str(r.tenant_id),
+                    "estoque": estoque_novo,
+                    "estoque_minimo": float(r.estoque_minimo or 0),
+                    "limite": float(r.estoque_minimo) if (r.estoque_minimo or 0) > 0 else limites.padrao,
+                },
+            }, tenant_id=str(r.tenant_id))
+        except Exception:
+            pass
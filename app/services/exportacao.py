@@ -0,0 +1,230 @@
+"""Exportação CSV em streaming (vendas, itens, dívidas, clientes).
+
+As linhas vêm de um cursor do servidor (`session.stream` + `yield_per`) e são
+escritas em lotes num buffer pequeno que é esvaziado a cada lote, então a memória
+usada não depende do tamanho da exportação.
+
+A sessão é aberta dentro do gerador: a sessão da dependência `get_db_session` já
+foi fechada quando o StreamingResponse começa a enviar o corpo.
+"""
+from datetime import datetime
+from io import StringIO
+from typing import AsyncIterator, Callable, Optional
+import csv
+import uuid
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select, select
+from sqlalchemy.sql.elements import ColumnElement
+
+from app.db.models import Cliente, Divida, ItemVenda, Produto, User, Venda
+from app.db.session import async_session
+
+
+ENTIDADES = ("vendas", "itens", "dividas", "clientes")
+
+# Linhas buscadas por ida ao banco e escritas por chunk da resposta
+LINHAS_POR_LOTE = 1000
+
+
+def _texto(v) -> str:
+    return str(v).replace("\n", " ").replace("\r", " ") if v is not None else ""
+
+
+def _texto_ou_traco(v) -> str:
+    """Texto; ausente/vazio vira "-" (formato histórico de faturas-mensal)."""
+    return _texto(v) or "-"
+
+
+def _moeda(v) -> str:
+    return f"{float(v or 0):.2f}"
+
+
+def _numero(v) -> str:
+    return f"{float(v or 0):g}"
+
+
+def _data_hora(v) -> str:
+    return v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else ""
+
+
+def _bool(v) -> str:
+    return "1" if v else "0"
+
+
+# (cabeçalho, expressão SQL, formatação)
+Coluna = tuple[str, ColumnElement, Callable[[object], str]]
+
+
+class Consulta:
+    """Colunas + SELECT de uma exportação; a formatação é aplicada por posição."""
+
+    def __init__(self, colunas: list[Coluna], stmt: Select) -> None:
+        self.cabecalho = [nome for nome, _, _ in colunas]
+        self.formatos = [fmt for _, _, fmt in colunas]
+        self.stmt = stmt
+
+
+def _select(colunas: list[Coluna]) -> Select:
+    return select(*[expr.label(nome) for nome, expr, _ in colunas])
+
+
+def _periodo(stmt: Select, coluna, d1: Optional[datetime], d2_exclusive: Optional[datetime]) -> Select:
+    if d1 is not None:
+        stmt = stmt.where(coluna >= d1)
+    if d2_exclusive is not None:
+        stmt = stmt.where(coluna < d2_exclusive)
+    return stmt
+
+
+def _consulta_vendas(tenant_id, d1, d2_exclusive, incluir_canceladas: bool = False) -> Consulta:
+    colunas: list[Coluna] = [
+        ("data_hora", Venda.created_at, _data_hora),
+        ("id_venda", Venda.id, _texto),
+        ("vendedor", User.nome, _texto_ou_traco),
+        ("cliente_nome", Cliente.nome, _texto_ou_traco),
+        ("cliente_documento", Cliente.documento, _texto),
+        ("forma_pagamento", Venda.forma_pagamento, _texto_ou_traco),
+        ("total", Venda.total, _moeda),
+        ("desconto", Venda.desconto, _moeda),
+        ("observacoes", Venda.observacoes, _texto),
+    ]
+    if incluir_canceladas:
+        colunas.append(("cancelada", Venda.cancelada, _bool))
+    stmt = (
+        _select(colunas)
+        .select_from(Venda)
+        .outerjoin(User, Venda.usuario_id == User.id)
+        .outerjoin(Cliente, Venda.cliente_id == Cliente.id)
+        .where(Venda.tenant_id == tenant_id)
+    )
+    if not incluir_canceladas:
+        stmt = stmt.where(Venda.cancelada == False)
+    stmt = _periodo(stmt, Venda.created_at, d1, d2_exclusive)
+    return Consulta(colunas, stmt.order_by(Venda.created_at, Venda.id))
+
+
+def _consulta_itens(tenant_id, d1, d2_exclusive, incluir_canceladas: bool = False) -> Consulta:
+    colunas: list[Coluna] = [
+        ("data_hora", Venda.created_at, _data_hora),
+        ("id_venda", ItemVenda.venda_id, _texto),
+        ("produto_codigo", Produto.codigo, _texto),
+        ("produto_nome", Produto.nome, _texto),
+        ("quantidade", ItemVenda.quantidade, _numero),
+        ("peso_kg", ItemVenda.peso_kg, _numero),
+        ("preco_unitario", ItemVenda.preco_unitario, _moeda),
+        ("subtotal", ItemVenda.subtotal, _moeda),
+        ("taxa_iva", ItemVenda.taxa_iva, _numero),
+        ("base_iva", ItemVenda.base_iva, _moeda),
+        ("valor_iva", ItemVenda.valor_iva, _moeda),
+        ("codigo_imposto", ItemVenda.codigo_imposto, _texto),
+    ]
+    stmt = (
+        _select(colunas)
+        .select_from(ItemVenda)
+        .join(Venda, ItemVenda.venda_id == Venda.id)
+        .outerjoin(Produto, ItemVenda.produto_id == Produto.id)
+        .where(Venda.tenant_id == tenant_id)
+    )
+    if not incluir_canceladas:
+        stmt = stmt.where(Venda.cancelada == False)
+    stmt = _periodo(stmt, Venda.created_at, d1, d2_exclusive)
+    return Consulta(colunas, stmt.order_by(Venda.created_at, ItemVenda.venda_id, ItemVenda.id))
+
+
+def _consulta_dividas(tenant_id, d1, d2_exclusive, incluir_canceladas: bool = False) -> Consulta:
+    colunas: list[Coluna] = [
+        ("data_divida", Divida.data_divida, _data_hora),
+        ("id_divida", Divida.id, _texto),
+        ("id_local", Divida.id_local, _texto),
+        ("cliente_nome", Cliente.nome, _texto),
+        ("cliente_documento", Cliente.documento, _texto),
+        ("vendedor", User.nome, _texto),
+        ("valor_original", Divida.valor_original, _moeda),
+        ("desconto_aplicado", Divida.desconto_aplicado, _moeda),
+        ("valor_total", Divida.valor_total, _moeda),
+        ("valor_pago", Divida.valor_pago, _moeda),
+        ("saldo", Divida.valor_total - Divida.valor_pago, _moeda),
+        ("status", Divida.status, _texto),
+        ("observacao", Divida.observacao, _texto),
+    ]
+    stmt = (
+        _select(colunas)
+        .select_from(Divida)
+        .outerjoin(Cliente, Divida.cliente_id == Cliente.id)
+        .outerjoin(User, Divida.usuario_id == User.id)
+        .where(Divida.tenant_id == tenant_id)
+    )
+    stmt = _periodo(stmt, Divida.data_divida, d1, d2_exclusive)
+    return Consulta(colunas, stmt.order_by(Divida.data_divida, Divida.id))
+
+
+def _consulta_clientes(tenant_id, d1, d2_exclusive, incluir_canceladas: bool = False) -> Consulta:
+    colunas: list[Coluna] = [
+        ("id_cliente", Cliente.id, _texto),
+        ("nome", Cliente.nome, _texto),
+        ("documento", Cliente.documento, _texto),
+        ("telefone", Cliente.telefone, _texto),
+        ("endereco", Cliente.endereco, _texto),
+        ("ativo", Cliente.ativo, _bool),
+        ("criado_em", Cliente.created_at, _data_hora),
+    ]
+    stmt = _select(colunas).where(Cliente.tenant_id == tenant_id)
+    stmt = _periodo(stmt, Cliente.created_at, d1, d2_exclusive)
+    return Consulta(colunas, stmt.order_by(Cliente.nome, Cliente.id))
+
+
+_CONSULTAS = {
+    "vendas": _consulta_vendas,
+    "itens": _consulta_itens,
+    "dividas": _consulta_dividas,
+    "clientes": _consulta_clientes,
+}
+
+
+def consulta(
+    entidade: str,
+    tenant_id: uuid.UUID,
+    d1: Optional[datetime] = None,
+    d2_exclusive: Optional[datetime] = None,
+    incluir_canceladas: bool = False,
+) -> Consulta:
+    """Monta a consulta de exportação de uma entidade. ValueError se desconhecida."""
+    try:
+        montar = _CONSULTAS[entidade]
+    except KeyError:
+        raise ValueError(f"Entidade inválida: {entidade} (use {', '.join(ENTIDADES)})")
+    return montar(tenant_id, d1, d2_exclusive, incluir_canceladas)
+
+
+def esvaziar_buffer(buffer: StringIO) -> bytes:
+    dados = buffer.getvalue().encode("utf-8")
+    buffer.seek(0)
+    buffer.truncate(0)
+    return dados
+
+
+async def gerar_csv(c: Consulta, linhas_por_lote: int = LINHAS_POR_LOTE) -> AsyncIterator[bytes]:
+    """Gera o CSV (';' como separador) em chunks de bytes, um por lote de linhas."""
+    buffer = StringIO()
+    writer = csv.writer(buffer, delimiter=";", lineterminator="\n")
+    writer.writerow(c.cabecalho)
+    yield esvaziar_buffer(buffer)
+
+    formatos = c.formatos
+    async with async_session() as session:
+        result = await session.stream(c.stmt.execution_options(yield_per=linhas_por_lote))
+        async for lote in result.partitions():
+            writer.writerows([fmt(v) for fmt, v in zip(formatos, row)] for row in lote)
+            yield esvaziar_buffer(buffer)
+
+
+def resposta_csv(c: Consulta, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        gerar_csv(c),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-cache",
+        },
+    )
@@ -0,0 +1,165 @@
+"""Resumo de IVA calculado no banco e rollup diário incremental (pdv.iva_diario).
+
+O rollup é atualizado na mesma transação da venda:
+- venda criada / reativada  -> acumular_venda(sinal=+1)
+- venda cancelada           -> acumular_venda(sinal=-1)
+cada chamada é um único INSERT ... SELECT ... GROUP BY ... ON CONFLICT DO UPDATE
+somando à linha existente, seguro sob concorrência.
+"""
+from datetime import date
+from typing import Optional
+import uuid
+
+from sqlalchemy import func, literal_column, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ItemVenda, IvaDiario, Produto, Venda
+
+
+AGRUPAMENTOS = ("taxa", "mes", "codigo_imposto")
+
+_UPSERT_DE_ITENS = """
+    INSERT INTO pdv.iva_diario (id, tenant_id, dia, taxa_iva, codigo_imposto, base_total, iva_total, qtd_itens)
+    SELECT gen_random_uuid(), v.tenant_id, date(v.created_at), COALESCE(i.taxa_iva, 0),
+           COALESCE(i.codigo_imposto, p.codigo_imposto, ''),
+           :sinal * SUM(COALESCE(i.base_iva, 0)), :sinal * SUM(COALESCE(i.valor_iva, 0)),
+           :sinal * COUNT(*)
+    FROM pdv.itens_venda i
+    JOIN pdv.vendas v ON v.id = i.venda_id
+    LEFT JOIN pdv.produtos p ON p.id = i.produto_id
+    WHERE {filtro}
+      AND v.tenant_id IS NOT NULL
+    GROUP BY v.tenant_id, date(v.created_at), COALESCE(i.taxa_iva, 0), COALESCE(i.codigo_imposto, p.codigo_imposto, '')
+    ON CONFLICT (tenant_id, dia, taxa_iva, codigo_imposto) DO UPDATE SET
+        base_total = pdv.iva_diario.base_total + EXCLUDED.base_total,
+        iva_total = pdv.iva_diario.iva_total + EXCLUDED.iva_total,
+        qtd_itens = pdv.iva_diario.qtd_itens + EXCLUDED.qtd_itens,
+        updated_at = now()
+"""
+
+
+async def acumular_venda(db: AsyncSession, venda_id: uuid.UUID, sinal: int = 1) -> None:
+    """Soma (sinal=+1) ou subtrai (sinal=-1) os itens de uma venda no rollup diário."""
+    await db.execute(
+        text(_UPSERT_DE_ITENS.format(filtro="i.venda_id = :venda_id")),
+        {"venda_id": venda_id, "sinal": sinal},
+    )
+
+
+async def reconstruir_rollup(db: AsyncSession, tenant_id: Optional[uuid.UUID] = None) -> None:
+    """Recria o rollup a partir dos itens (backfill inicial ou correção)."""
+    params: dict = {"sinal": 1}
+    filtro = "v.cancelada = false"
+    if tenant_id is not None:
+        await db.execute(text("DELETE FROM pdv.iva_diario WHERE tenant_id = :tenant_id"), {"tenant_id": tenant_id})
+        filtro += " AND v.tenant_id = :tenant_id"
+        params["tenant_id"] = tenant_id
+    else:
+        await db.execute(text("DELETE FROM pdv.iva_diario"))
+    await db.execute(text(_UPSERT_DE_ITENS.format(filtro=filtro)), params)
+
+
+async def garantir_rollup(db: AsyncSession) -> None:
+    """Backfill na primeira execução: rollup vazio com vendas existentes.
+
+    Itens vendidos antes da coluna codigo_imposto recebem o código do produto;
+    se algum foi preenchido, o rollup é refeito com o código correto.
+    """
+    preenchidos = await db.execute(text(
+        "UPDATE pdv.itens_venda i SET codigo_imposto = p.codigo_imposto "
+        "FROM pdv.produtos p WHERE p.id = i.produto_id "
+        "AND i.codigo_imposto IS NULL AND p.codigo_imposto IS NOT NULL"
+    ))
+    vazio = await db.scalar(text("SELECT NOT EXISTS (SELECT 1 FROM pdv.iva_diario)"))
+    if vazio or preenchidos.rowcount:
+        await reconstruir_rollup(db)
+
+
+def _agrupamentos(agrupar: Optional[str]) -> list[str]:
+    grupos = [g.strip() for g in (agrupar or "taxa").split(",") if g.strip()]
+    invalidos = [g for g in grupos if g not in AGRUPAMENTOS]
+    if invalidos:
+        raise ValueError(f"Agrupamento inválido: {', '.join(invalidos)} (use {', '.join(AGRUPAMENTOS)})")
+    if "taxa" not in grupos:
+        grupos.append("taxa")
+    return grupos
+
+
+async def resumo_iva(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    d1: date,
+    d2_exclusive: date,
+    agrupar: Optional[str] = None,
+    fonte: str = "rollup",
+) -> list[dict]:
+    """Resumo de IVA agrupado por taxa (e opcionalmente mês e código de imposto).
+
+    fonte="rollup" lê pdv.iva_diario (linhas por dia); fonte="itens" agrega os
+    itens de venda diretamente com GROUP BY (útil para conferência).
+    """
+    grupos = _agrupamentos(agrupar)
+
+    if fonte == "itens":
+        taxa = func.coalesce(ItemVenda.taxa_iva, 0.0)
+        codigo = func.coalesce(ItemVenda.codigo_imposto, Produto.codigo_imposto, "")
+        mes = func.date_trunc("month", Venda.created_at)
+        base = func.sum(func.coalesce(ItemVenda.base_iva, 0.0))
+        iva = func.sum(func.coalesce(ItemVenda.valor_iva, 0.0))
+        stmt = (
+            select()
+            .select_from(ItemVenda)
+            .join(Venda, ItemVenda.venda_id == Venda.id)
+            .outerjoin(Produto, ItemVenda.produto_id == Produto.id)
+            .where(
+                Venda.tenant_id == tenant_id,
+                Venda.created_at >= d1,
+                Venda.created_at < d2_exclusive,
+                Venda.cancelada == False,
+            )
+        )
+    else:
+        taxa = IvaDiario.taxa_iva
+        codigo = IvaDiario.codigo_imposto
+        mes = func.date_trunc("month", IvaDiario.dia)
+        base = func.sum(IvaDiario.base_total)
+        iva = func.sum(IvaDiario.iva_total)
+        stmt = select().select_from(IvaDiario).where(
+            IvaDiario.tenant_id == tenant_id,
+            IvaDiario.dia >= d1,
+            IvaDiario.dia < d2_exclusive,
+        )
+
+    colunas = []
+    if "mes" in grupos:
+        colunas.append(mes.label("mes"))
+    if "codigo_imposto" in grupos:
+        colunas.append(codigo.label("codigo_imposto"))
+    colunas.append(taxa.label("taxa_iva"))
+
+    # GROUP BY posicional: expressões com parâmetros (date_trunc, coalesce)
+    # não precisam ser repetidas idênticas no GROUP BY
+    posicoes = [literal_column(str(i + 1)) for i in range(len(colunas))]
+    stmt = (
+        stmt.add_columns(*colunas, base.label("base_total"), iva.label("iva_total"))
+        .group_by(*posicoes)
+        .order_by(*posicoes)
+    )
+    rows = (await db.execute(stmt)).mappings().all()
+
+    resultado = []
+    for r in rows:
+        base_total = float(r["base_total"] or 0)
+        iva_total = float(r["iva_total"] or 0)
+        item = {
+            "taxa_iva": float(r["taxa_iva"] or 0),
+            "base_total": base_total,
+            "iva_total": iva_total,
+            "faturamento_total": base_total + iva_total,
+        }
+        if "mes" in grupos:
+            item["mes"] = r["mes"].strftime("%Y-%m") if r["mes"] is not None else None
+        if "codigo_imposto" in grupos:
+            item["codigo_imposto"] = r["codigo_imposto"] or None
+        resultado.append(item)
+    return resultado
@@ -0,0 +1,269 @@
+"""Agregação de vendas no banco (buckets de tempo x dimensões) para o dashboard.
+
+Em vez de baixar /api/vendas/periodo inteiro e somar no tablet, o dashboard pede
+somas e contagens já agrupadas. A leitura é feita sobre o rollup horário
+pdv.vendas_hora, mantido na mesma transação da venda:
+- venda criada / reativada  -> acumular_venda(sinal=+1)
+- venda cancelada           -> acumular_venda(sinal=-1)
+
+Os resultados ficam em cache por tenant. Períodos só com dias fechados (antes
+de hoje) quase não mudam: ficam em cache por mais tempo e só são descartados
+quando uma venda é cancelada/reativada (`invalidar`). Períodos que incluem hoje
+usam um TTL curto.
+"""
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import Optional
+import time
+import uuid
+
+from sqlalchemy import func, literal_column, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import Produto, User, VendaHora, PRODUTO_NULO, USUARIO_NULO
+
+
+BUCKETS = ("hour", "day", "week", "month")
+DIMENSOES = ("usuario", "produto", "forma_pagamento", "categoria")
+# Dimensões em que as métricas de nível de venda (vendas, total, desconto) não se aplicam
+DIMENSOES_DE_ITEM = ("produto", "categoria")
+
+TTL_ABERTO = 15
+TTL_FECHADO = 3600
+MAX_ENTRADAS_POR_TENANT = 64
+
+# Uma linha de nível de venda por venda (produto PRODUTO_NULO, vendas sem itens
+# incluídas) mais uma linha por item, só com as métricas de item.
+_UPSERT_DE_VENDAS = """
+    INSERT INTO pdv.vendas_hora (id, tenant_id, hora, usuario_id, forma_pagamento, produto_id,
+                                 qtd_vendas, total, desconto, qtd_itens, quantidade, receita)
+    SELECT gen_random_uuid(), tenant_id, date_trunc('hour', created_at),
+           COALESCE(usuario_id, :usuario_nulo), COALESCE(forma_pagamento, ''), produto_id,
+           :sinal * SUM(vendas), :sinal * SUM(total), :sinal * SUM(desconto),
+           :sinal * SUM(itens), :sinal * SUM(quantidade), :sinal * SUM(subtotal)
+    FROM (
+        SELECT v.tenant_id, v.created_at, v.usuario_id, v.forma_pagamento,
+               CAST(:produto_nulo AS uuid) AS produto_id,
+               1 AS vendas, COALESCE(v.total, 0) AS total, COALESCE(v.desconto, 0) AS desconto,
+               0 AS itens, 0 AS quantidade, 0 AS subtotal
+        FROM pdv.vendas v
+        WHERE {filtro} AND v.tenant_id IS NOT NULL
+        UNION ALL
+        SELECT v.tenant_id, v.created_at, v.usuario_id, v.forma_pagamento,
+               i.produto_id,
+               0, 0, 0,
+               1,
+               CASE WHEN COALESCE(i.peso_kg, 0) > 0 THEN i.peso_kg ELSE COALESCE(i.quantidade, 0) END,
+               COALESCE(i.subtotal, 0)
+        FROM pdv.itens_venda i
+        JOIN pdv.vendas v ON v.id = i.venda_id
+        WHERE {filtro} AND v.tenant_id IS NOT NULL
+    ) s
+    GROUP BY 2, 3, 4, 5, 6
+    ON CONFLICT (tenant_id, hora, usuario_id, forma_pagamento, produto_id) DO UPDATE SET
+        qtd_vendas = pdv.vendas_hora.qtd_vendas + EXCLUDED.qtd_vendas,
+        total = pdv.vendas_hora.total + EXCLUDED.total,
+        desconto = pdv.vendas_hora.desconto + EXCLUDED.desconto,
+        qtd_itens = pdv.vendas_hora.qtd_itens + EXCLUDED.qtd_itens,
+        quantidade = pdv.vendas_hora.quantidade + EXCLUDED.quantidade,
+        receita = pdv.vendas_hora.receita + EXCLUDED.receita,
+        updated_at = now()
+"""
+
+
+def _params(**extra) -> dict:
+    return {"usuario_nulo": USUARIO_NULO, "produto_nulo": PRODUTO_NULO, **extra}
+
+
+async def acumular_venda(db: AsyncSession, venda_id: uuid.UUID, sinal: int = 1) -> None:
+    """Soma (sinal=+1) ou subtrai (sinal=-1) uma venda e seus itens no rollup horário."""
+    await db.execute(
+        text(_UPSERT_DE_VENDAS.format(filtro="v.id = :venda_id")),
+        _params(venda_id=venda_id, sinal=sinal),
+    )
+
+
+async def reconstruir_rollup(db: AsyncSession, tenant_id: Optional[uuid.UUID] = None) -> None:
+    """Recria o rollup a partir das vendas e itens (backfill inicial ou correção)."""
+    params = _params(sinal=1)
+    filtro = "v.cancelada = false"
+    if tenant_id is not None:
+        await db.execute(text("DELETE FROM pdv.vendas_hora WHERE tenant_id = :tenant_id"), {"tenant_id": tenant_id})
+        filtro += " AND v.tenant_id = :tenant_id"
+        params["tenant_id"] = tenant_id
+    else:
+        await db.execute(text("DELETE FROM pdv.vendas_hora"))
+    await db.execute(text(_UPSERT_DE_VENDAS.format(filtro=filtro)), params)
+    invalidar(tenant_id)
+
+
+async def garantir_rollup(db: AsyncSession) -> None:
+    """Backfill na primeira execução: rollup sem linhas de venda, com vendas existentes.
+
+    Também refaz o rollup do formato anterior (métricas de venda no primeiro
+    item, vendas sem itens de fora), que não tem linhas PRODUTO_NULO.
+    """
+    pendente = await db.scalar(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pdv.vendas WHERE cancelada = false AND tenant_id IS NOT NULL) "
+            "AND NOT EXISTS (SELECT 1 FROM pdv.vendas_hora WHERE produto_id = :produto_nulo)"
+        ),
+        {"produto_nulo": PRODUTO_NULO},
+    )
+    if pendente:
+        await reconstruir_rollup(db)
+
+
+# tenant -> chave -> (instante, ttl, resultado)
+_cache: dict[uuid.UUID, dict[tuple, tuple[float, int, dict]]] = {}
+
+
+def invalidar(tenant_id: Optional[uuid.UUID] = None) -> None:
+    """Descarta as agregações em cache de um tenant (ou de todos)."""
+    if tenant_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(tenant_id, None)
+
+
+def _dimensoes(dimensoes: Optional[str]) -> list[str]:
+    grupos = []
+    for d in (dimensoes or "").split(","):
+        d = d.strip()
+        if d and d not in grupos:
+            grupos.append(d)
+    invalidas = [d for d in grupos if d not in DIMENSOES]
+    if invalidas:
+        raise ValueError(f"Dimensão inválida: {', '.join(invalidas)} (use {', '.join(DIMENSOES)})")
+    return grupos
+
+
+def _utc(d: date) -> datetime:
+    return datetime.combine(d, dt_time.min, tzinfo=timezone.utc)
+
+
+async def agregar_vendas(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    d1: date,
+    d2_exclusive: date,
+    bucket: str = "day",
+    dimensoes: Optional[str] = None,
+) -> dict:
+    """Somas e contagens de vendas por bucket de tempo (date_trunc) e dimensões.
+
+    Lança ValueError para bucket/dimensão inválidos.
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f"Bucket inválido: {bucket} (use {', '.join(BUCKETS)})")
+    grupos = _dimensoes(dimensoes)
+
+    chave = (d1, d2_exclusive, bucket, tuple(grupos))
+    agora = time.monotonic()
+    entradas = _cache.get(tenant_id)
+    if entradas is not None:
+        item = entradas.get(chave)
+        if item is not None and agora - item[0] < item[1]:
+            return item[2]
+
+    resultado = await _consultar(db, tenant_id, d1, d2_exclusive, bucket, grupos)
+
+    fechado = d2_exclusive <= datetime.now(timezone.utc).date()
+    entradas = _cache.setdefault(tenant_id, {})
+    if len(entradas) >= MAX_ENTRADAS_POR_TENANT:
+        entradas.pop(next(iter(entradas)))
+    entradas[chave] = (agora, TTL_FECHADO if fechado else TTL_ABERTO, resultado)
+    return resultado
+
+
+async def _consultar(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    d1: date,
+    d2_exclusive: date,
+    bucket: str,
+    grupos: list[str],
+) -> dict:
+    por_venda = not any(g in DIMENSOES_DE_ITEM for g in grupos)
+
+    stmt = select().select_from(VendaHora).where(
+        VendaHora.tenant_id == tenant_id,
+        VendaHora.hora >= _utc(d1),
+        VendaHora.hora < _utc(d2_exclusive),
+    )
+    colunas = [func.date_trunc(bucket, VendaHora.hora).label("bucket")]
+    nomes = []
+    if "usuario" in grupos:
+        stmt = stmt.outerjoin(User, VendaHora.usuario_id == User.id)
+        colunas += [VendaHora.usuario_id.label("usuario_id"), User.nome.label("usuario_nome")]
+        nomes += ["usuario_id", "usuario_nome"]
+    if not por_venda:
+        # Linhas de nível de venda não têm produto
+        stmt = stmt.where(VendaHora.produto_id != PRODUTO_NULO)
+    if "produto" in grupos or "categoria" in grupos:
+        stmt = stmt.outerjoin(Produto, VendaHora.produto_id == Produto.id)
+    if "produto" in grupos:
+        colunas += [VendaHora.produto_id.label("produto_id"), Produto.nome.label("produto_nome")]
+        nomes += ["produto_id", "produto_nome"]
+    if "categoria" in grupos:
+        colunas.append(Produto.categoria_id.label("categoria_id"))
+        nomes.append("categoria_id")
+    if "forma_pagamento" in grupos:
+        colunas.append(VendaHora.forma_pagamento.label("forma_pagamento"))
+        nomes.append("forma_pagamento")
+
+    metricas = [
+        func.sum(VendaHora.qtd_itens).label("itens"),
+        func.sum(VendaHora.quantidade).label("quantidade"),
+        func.sum(VendaHora.receita).label("receita"),
+    ]
+    # Linhas zeradas por cancelamento não aparecem
+    presentes = func.sum(VendaHora.qtd_itens) != 0
+    if por_venda:
+        presentes = or_(presentes, func.sum(VendaHora.qtd_vendas) != 0)
+        metricas += [
+            func.sum(VendaHora.qtd_vendas).label("vendas"),
+            func.sum(VendaHora.total).label("total"),
+            func.sum(VendaHora.desconto).label("desconto"),
+        ]
+
+    # GROUP BY posicional (date_trunc com parâmetro não precisa ser repetido)
+    posicoes = [literal_column(str(i + 1)) for i in range(len(colunas))]
+    stmt = (
+        stmt.add_columns(*colunas, *metricas)
+        .group_by(*posicoes)
+        .having(presentes)
+        .order_by(*posicoes)
+    )
+    rows = (await db.execute(stmt)).mappings().all()
+
+    linhas = []
+    for r in rows:
+        linha = {"bucket": r["bucket"].isoformat() if r["bucket"] is not None else None}
+        for nome in nomes:
+            valor = r[nome]
+            if nome == "usuario_id":
+                valor = None if valor == USUARIO_NULO else str(valor)
+            elif nome == "produto_id":
+                valor = str(valor)
+            elif nome == "forma_pagamento":
+                valor = valor or None
+            linha[nome] = valor
+        linha["itens"] = int(r["itens"] or 0)
+        linha["quantidade"] = float(r["quantidade"] or 0)
+        linha["receita"] = float(r["receita"] or 0)
+        if por_venda:
+            vendas = int(r["vendas"] or 0)
+            total = float(r["total"] or 0)
+            linha["vendas"] = vendas
+            linha["total"] = total
+            linha["desconto"] = float(r["desconto"] or 0)
+            linha["ticket_medio"] = total / vendas if vendas else 0.0
+        linhas.append(linha)
+
+    return {
+        "data_inicio": d1.isoformat(),
+        "data_fim": (d2_exclusive - timedelta(days=1)).isoformat(),
+        "bucket": bucket,
+        "dimensoes": grupos,
+        "linhas": linhas,
+    }
@@ -0,0 +1,205 @@
+"""Ranking de produtos (top-N por receita, quantidade ou margem) e curva ABC.
+
+Mesmas contas do relatório financeiro (itens JOIN vendas LEFT JOIN produtos,
+quantidade efetiva = peso_kg quando > 0), agrupadas por produto no banco.
+
+Cache por tenant: o agregado por produto da parte fechada do período (dias
+anteriores a hoje) é guardado e reaproveitado; a cada pedido só o dia atual é
+agregado de novo e somado por cima. Quando o dia vira, o período fechado com o
+mesmo início é estendido agregando só os dias novos. Cancelamentos e vendas
+sincronizadas com data passada descartam o cache do tenant (`invalidar`).
+"""
+from datetime import date, datetime, time as dt_time, timedelta, timezone
+from typing import NamedTuple, Optional
+import time
+import uuid
+
+from sqlalchemy import case, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.models import ItemVenda, Produto, Venda
+
+
+CRITERIOS = ("receita", "quantidade", "margem")
+# Limites da curva ABC (participação acumulada antes do produto)
+LIMITE_A = 0.80
+LIMITE_B = 0.95
+
+TTL_FECHADO = 3600
+MAX_ENTRADAS_POR_TENANT = 32
+
+
+class AgregadoProduto(NamedTuple):
+    codigo: Optional[str]
+    nome: Optional[str]
+    quantidade: float
+    receita: float
+    custo: float
+
+
+# tenant -> (d1, fim_fechado) -> (instante, {produto_id: AgregadoProduto})
+_cache: dict[uuid.UUID, dict[tuple[date, date], tuple[float, dict]]] = {}
+
+
+def invalidar(tenant_id: Optional[uuid.UUID] = None) -> None:
+    """Descarta os agregados em cache de um tenant (ou de todos)."""
+    if tenant_id is None:
+        _cache.clear()
+    else:
+        _cache.pop(tenant_id, None)
+
+
+def _inicio(d: date) -> datetime:
+    return datetime.combine(d, dt_time.min, tzinfo=timezone.utc)
+
+
+async def _agregar(db: AsyncSession, tenant_id: uuid.UUID, d1: date, d2_exclusive: date) -> dict:
+    qtd = case((ItemVenda.peso_kg > 0, ItemVenda.peso_kg), else_=ItemVenda.quantidade)
+    stmt = (
+        select(
+            ItemVenda.produto_id,
+            Produto.codigo,
+            Produto.nome,
+            func.coalesce(func.sum(qtd), 0.0).label("quantidade"),
+            func.coalesce(func.sum(ItemVenda.preco_unitario * qtd), 0.0).label("receita"),
+            func.coalesce(func.sum(func.coalesce(Produto.preco_custo, 0.0) * qtd), 0.0).label("custo"),
+        )
+        .select_from(ItemVenda)
+        .join(Venda, ItemVenda.venda_id == Venda.id)
+        .outerjoin(Produto, ItemVenda.produto_id == Produto.id)
+        .where(
+            Venda.tenant_id == tenant_id,
+            Venda.created_at >= _inicio(d1),
+            Venda.created_at < _inicio(d2_exclusive),
+            Venda.cancelada == False,
+        )
+        .group_by(ItemVenda.produto_id, Produto.codigo, Produto.nome)
+    )
+    rows = (await db.execute(stmt)).all()
+    return {
+        r.produto_id: AgregadoProduto(r.codigo, r.nome, float(r.quantidade), float(r.receita), float(r.custo))
+        for r in rows
+    }
+
+
+def _somar(base: dict, novo: dict) -> dict:
+    """Soma dois agregados por produto sem alterar os originais (o de base pode estar em cache)."""
+    if not novo:
+        return base
+    soma = dict(base)
+    for produto_id, a in novo.items():
+        b = soma.get(produto_id)
+        soma[produto_id] = a if b is None else AgregadoProduto(
+            a.codigo, a.nome, a.quantidade + b.quantidade, a.receita + b.receita, a.custo + b.custo,
+        )
+    return soma
+
+
+async def _agregado_fechado(db: AsyncSession, tenant_id: uuid.UUID, d1: date, fim: date) -> dict:
+    chave = (d1, fim)
+    agora = time.monotonic()
+    entradas = _cache.get(tenant_id)
+    if entradas is not None:
+        item = entradas.get(chave)
+        if item is not None and agora - item[0] < TTL_FECHADO:
+            return item[1]
+
+    # Mesmo início já agregado até um dia anterior: agregar só os dias que faltam
+    base = None
+    for (c_d1, c_fim), (ts, valor) in (entradas or {}).items():
+        if c_d1 == d1 and c_fim < fim and agora - ts < TTL_FECHADO and (base is None or c_fim > base[0]):
+            base = (c_fim, valor)
+    if base is not None:
+        agregado = _somar(base[1], await _agregar(db, tenant_id, base[0], fim))
+    else:
+        agregado = await _agregar(db, tenant_id, d1, fim)
+    entradas = _cache.setdefault(tenant_id, {})
+    if len(entradas) >= MAX_ENTRADAS_POR_TENANT:
+        entradas.pop(next(iter(entradas)))
+    entradas[chave] = (agora, agregado)
+    return agregado
+
+
+async def agregado_por_produto(db: AsyncSession, tenant_id: uuid.UUID, d1: date, d2_exclusive: date) -> dict:
+    """Quantidade, receita e custo por produto no período [d1, d2_exclusive)."""
+    # Dia em UTC, como created_at e a invalidação das vendas sincronizadas
+    hoje = datetime.now(timezone.utc).date()
+    fim_fechado = min(d2_exclusive, hoje)
+    agregado: dict = {}
+    if d1 < fim_fechado:
+        agregado = await _agregado_fechado(db, tenant_id, d1, fim_fechado)
+    if d2_exclusive > hoje:
+        agregado = _somar(agregado, await _agregar(db, tenant_id, max(d1, hoje), d2_exclusive))
+    return agregado
+
+
+def _valor(a: AgregadoProduto, criterio: str) -> float:
+    if criterio == "quantidade":
+        return a.quantidade
+    if criterio == "margem":
+        return a.receita - a.custo
+    return a.receita
+
+
+async def ranking_produtos(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    d1: date,
+    d2_exclusive: date,
+    criterio: str = "receita",
+    limite: int = 20,
+) -> dict:
+    """Top-N produtos pelo critério, com classe ABC calculada sobre todos os produtos.
+
+    Produtos com valor <= 0 (ex.: margem negativa) ficam sempre na classe C.
+    Lança ValueError para critério inválido.
+    """
+    if criterio not in CRITERIOS:
+        raise ValueError(f"Critério inválido: {criterio} (use {', '.join(CRITERIOS)})")
+
+    agregado = await agregado_por_produto(db, tenant_id, d1, d2_exclusive)
+    ordenados = sorted(agregado.items(), key=lambda kv: _valor(kv[1], criterio), reverse=True)
+    total = sum(v for v in (_valor(a, criterio) for _, a in ordenados) if v > 0)
+
+    classes = {c: {"produtos": 0, "valor": 0.0} for c in "ABC"}
+    produtos = []
+    acumulado = 0.0
+    for posicao, (produto_id, a) in enumerate(ordenados, start=1):
+        valor = _valor(a, criterio)
+        participacao = valor / total if total > 0 and valor > 0 else 0.0
+        if participacao <= 0:
+            classe = "C"
+        elif acumulado < LIMITE_A:
+            classe = "A"
+        elif acumulado < LIMITE_B:
+            classe = "B"
+        else:
+            classe = "C"
+        acumulado += participacao
+        classes[classe]["produtos"] += 1
+        classes[classe]["valor"] += valor
+
+        if posicao <= limite:
+            produtos.append({
+                "posicao": posicao,
+                "produto_id": str(produto_id),
+                "codigo": a.codigo,
+                "nome": a.nome,
+                "quantidade": a.quantidade,
+                "receita": a.receita,
+                "custo": a.custo,
+                "margem": a.receita - a.custo,
+                "participacao": participacao,
+                "participacao_acumulada": acumulado,
+                "classe": classe,
+            })
+
+    return {
+        "data_inicio": d1.isoformat(),
+        "data_fim": (d2_exclusive - timedelta(days=1)).isoformat(),
+        "criterio": criterio,
+        "total": total,
+        "total_produtos": len(ordenados),
+        "classes": classes,
+        "produtos": produtos,
+    }
@@ -0,0 +1,310 @@
+"""Fila de relatórios em background (pool limitado de workers + cache em disco).
+
+Fluxo: o cliente submete (tipo, parâmetros) -> recebe o id do job -> consulta o
+status (ou recebe `relatorio.pronto` pelo /ws, só nas conexões do mesmo tenant:
+/ws?tenant_id=...) -> baixa o arquivo.
+
+- Os tipos de relatório são registrados com `registrar` pelos routers que os
+  implementam (ver app/routers/relatorios.py), sem import circular.
+- O arquivo gerado fica em disco com chave = hash(tenant, tipo, parâmetros,
+  versão dos dados). A versão dos dados é `count(*)` + `max(updated_at)` das
+  tabelas de que o relatório depende; enquanto nada mudar, o mesmo pedido é
+  servido do cache sem gerar de novo.
+- Os jobs vivem em memória no processo (status é efêmero, o arquivo não).
+"""
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Union
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import settings
+from app.core.realtime import manager as realtime_manager
+from app.core.tenant import vincular
+from app.db.session import async_session
+
+logger = logging.getLogger(__name__)
+
+STATUS_PENDENTE = "pendente"
+STATUS_EXECUTANDO = "executando"
+STATUS_CONCLUIDO = "concluido"
+STATUS_ERRO = "erro"
+
+# Jobs finalizados ficam consultáveis por este tempo; arquivos em cache, pelo
+# dobro (um pedido repetido dentro desse prazo não gera de novo)
+JOB_TTL = timedelta(hours=1)
+
+Resultado = Union[bytes, AsyncIterator[bytes]]
+Gerador = Callable[[AsyncSession, uuid.UUID, dict], Awaitable[Resultado]]
+
+
+class TipoRelatorio:
+    def __init__(
+        self,
+        nome: str,
+        gerador: Gerador,
+        extensao: str,
+        media_type: str,
+        tabelas: tuple[str, ...],
+        parametros: tuple[str, ...],
+        obrigatorios: tuple[str, ...],
+    ) -> None:
+        self.nome = nome
+        self.gerador = gerador
+        self.extensao = extensao
+        self.media_type = media_type
+        self.tabelas = tabelas
+        self.parametros = parametros
+        self.obrigatorios = obrigatorios
+
+
+class JobRelatorio:
+    def __init__(self, tenant_id: uuid.UUID, tipo: TipoRelatorio, params: dict, chave: str) -> None:
+        self.id = uuid.uuid4()
+        self.tenant_id = tenant_id
+        self.tipo = tipo
+        self.params = params
+        self.chave = chave
+        self.status = STATUS_PENDENTE
+        self.erro: Optional[str] = None
+        self.cache = False
+        self.criado_em = datetime.utcnow()
+        self.concluido_em: Optional[datetime] = None
+
+    @property
+    def arquivo(self) -> str:
+        return caminho_artefato(self.tenant_id, self.chave, self.tipo.extensao)
+
+    @property
+    def filename(self) -> str:
+        sufixo = "_".join(str(v) for v in self.params.values() if v not in (None, ""))
+        return f"{self.tipo.nome}{'_' + sufixo if sufixo else ''}{self.tipo.extensao}"
+
+    def to_dict(self) -> dict:
+        return {
+            "id": str(self.id),
+            "tipo": self.tipo.nome,
+            "params": self.params,
+            "status": self.status,
+            "erro": self.erro,
+            "cache": self.cache,
+            "criado_em": self.criado_em.isoformat(),
+            "concluido_em": self.concluido_em.isoformat() if self.concluido_em else None,
+            "download_url": f"/api/relatorios/jobs/{self.id}/download" if self.status == STATUS_CONCLUIDO else None,
+        }
+
+
+TIPOS: dict[str, TipoRelatorio] = {}
+_jobs: dict[uuid.UUID, JobRelatorio] = {}
+_fila: Optional[asyncio.Queue] = None
+_workers: list[asyncio.Task] = []
+_ultima_limpeza: Optional[datetime] = None
+
+
+class FilaCheia(Exception):
+    pass
+
+
+def registrar(
+    nome: str,
+    extensao: str,
+    media_type: str,
+    tabelas: tuple[str, ...],
+    parametros: tuple[str, ...] = (),
+    obrigatorios: tuple[str, ...] = (),
+):
+    """Decorator que registra um gerador de relatório para a fila."""
+    def decorator(gerador: Gerador) -> Gerador:
+        TIPOS[nome] = TipoRelatorio(nome, gerador, extensao, media_type, tabelas, parametros, obrigatorios)
+        return gerador
+    return decorator
+
+
+def caminho_artefato(tenant_id: uuid.UUID, chave: str, extensao: str) -> str:
+    return os.path.join(settings.REPORTS_DIR, str(tenant_id), f"{chave}{extensao}")
+
+
+def normalizar_params(tipo: TipoRelatorio, params: Optional[dict]) -> dict:
+    """Mantém só parâmetros conhecidos, em ordem estável (parte da chave do cache)."""
+    params = params or {}
+    desconhecidos = sorted(set(params) - set(tipo.parametros))
+    if desconhecidos:
+        raise ValueError(f"Parâmetros inválidos para {tipo.nome}: {', '.join(desconhecidos)}")
+    normalizados = {k: params[k] for k in tipo.parametros if params.get(k) not in (None, "")}
+    faltando = [k for k in tipo.obrigatorios if k not in normalizados]
+    if faltando:
+        raise ValueError(f"Parâmetros obrigatórios para {tipo.nome}: {', '.join(faltando)}")
+    return normalizados
+
+
+async def versao_dados(db: AsyncSession, tenant_id: uuid.UUID, tabelas: tuple[str, ...]) -> str:
+    """Versão dos dados de um tenant: contagem e última alteração de cada tabela."""
+    if not tabelas:
+        return ""
+    partes = [
+        f"SELECT '{t}', count(*), max(updated_at) FROM pdv.{t} WHERE tenant_id = :tenant_id"
+        for t in tabelas
+    ]
+    rows = (await db.execute(text(" UNION ALL ".join(partes)), {"tenant_id": tenant_id})).all()
+    return ";".join(f"{t}:{n}:{ts.isoformat() if ts else ''}" for t, n, ts in rows)
+
+
+def _chave(tenant_id: uuid.UUID, tipo: TipoRelatorio, params: dict, versao: str) -> str:
+    bruto = json.dumps([str(tenant_id), tipo.nome, params, versao], sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode("utf-8")).hexdigest()[:32]
+
+
+async def submeter(db: AsyncSession, tenant_id: uuid.UUID, nome_tipo: str, params: Optional[dict]) -> JobRelatorio:
+    """Cria o job; se o artefato já existe para a versão atual dos dados, conclui na hora.
+
+    Lança ValueError (tipo/parâmetros inválidos) ou FilaCheia.
+    """
+    tipo = TIPOS.get(nome_tipo)
+    if tipo is None:
+        raise ValueError(f"Tipo de relatório inválido: {nome_tipo} (use {', '.join(sorted(TIPOS))})")
+    params = normalizar_params(tipo, params)
+    versao = await versao_dados(db, tenant_id, tipo.tabelas)
+    job = JobRelatorio(tenant_id, tipo, params, _chave(tenant_id, tipo, params, versao))
+
+    await _limpar_expirados()
+    # Mesmo pedido já na fila ou em execução: acompanhar o job existente
+    for existente in _jobs.values():
+        if existente.chave == job.chave and existente.status in (STATUS_PENDENTE, STATUS_EXECUTANDO):
+            return existente
+    if os.path.exists(job.arquivo):
+        job.status = STATUS_CONCLUIDO
+        job.cache = True
+        job.concluido_em = datetime.utcnow()
+        _jobs[job.id] = job
+        return job
+
+    if _fila is None:
+        raise FilaCheia("Fila de relatórios não iniciada")
+    try:
+        _fila.put_nowait(job)
+    except asyncio.QueueFull:
+        raise FilaCheia("Fila de relatórios cheia, tente novamente em instantes")
+    _jobs[job.id] = job
+    return job
+
+
+def obter(job_id: uuid.UUID, tenant_id: uuid.UUID) -> Optional[JobRelatorio]:
+    job = _jobs.get(job_id)
+    if job is None or job.tenant_id != tenant_id:
+        return None
+    return job
+
+
+async def _gravar(resultado: Resultado, destino: str) -> None:
+    """Grava bytes ou chunks num arquivo temporário e move para o destino no fim."""
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    tmp = f"{destino}.{uuid.uuid4().hex}.part"
+    out = await run_in_threadpool(open, tmp, "wb")
+    try:
+        if isinstance(resultado, (bytes, bytearray)):
+            await run_in_threadpool(out.write, resultado)
+        else:
+            async for chunk in resultado:
+                await run_in_threadpool(out.write, chunk)
+        await run_in_threadpool(out.close)
+        await run_in_threadpool(os.replace, tmp, destino)
+    except BaseException:
+        await run_in_threadpool(out.close)
+        try:
+            await run_in_threadpool(os.remove, tmp)
+        except OSError:
+            pass
+        raise
+
+
+async def _executar(job: JobRelatorio) -> None:
+    job.status = STATUS_EXECUTANDO
+    try:
+        async with async_session() as session:
+            vincular(session, job.tenant_id)
+            resultado = await job.tipo.gerador(session, job.tenant_id, dict(job.params))
+            await _gravar(resultado, job.arquivo)
+        job.status = STATUS_CONCLUIDO
+    except Exception as e:
+        logger.exception("Falha ao gerar relatório %s (%s)", job.tipo.nome, job.id)
+        job.status = STATUS_ERRO
+        job.erro = getattr(e, "detail", None) or str(e) or e.__class__.__name__
+    job.concluido_em = datetime.utcnow()
+
+    try:
+        await realtime_manager.broadcast("relatorio.pronto", {
+            "ts": job.concluido_em.isoformat(),
+            "data": {"tenant_id": str(job.tenant_id), **job.to_dict()},
+        }, tenant_id=str(job.tenant_id))
+    except Exception:
+        pass
+
+
+async def _worker() -> None:
+    while True:
+        job = await _fila.get()
+        try:
+            await _executar(job)
+        finally:
+            _fila.task_done()
+
+
+async def _limpar_expirados() -> None:
+    """Descarta jobs antigos; arquivos do cache são varridos no máximo uma vez por JOB_TTL."""
+    global _ultima_limpeza
+    agora = datetime.utcnow()
+    limite = agora - JOB_TTL
+    for job_id in [j.id for j in _jobs.values() if j.concluido_em and j.concluido_em < limite]:
+        _jobs.pop(job_id, None)
+    if _ultima_limpeza is None or _ultima_limpeza < limite:
+        _ultima_limpeza = agora
+        await run_in_threadpool(_limpar_artefatos_antigos)
+
+
+def _limpar_artefatos_antigos() -> None:
+    limite = (datetime.utcnow() - 2 * JOB_TTL).timestamp()
+    if not os.path.isdir(settings.REPORTS_DIR):
+        return
+    for raiz, _, arquivos in os.walk(settings.REPORTS_DIR):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    os.remove(caminho)
+            except OSError:
+                pass
+
+
+async def iniciar(workers: Optional[int] = None, tamanho_fila: Optional[int] = None) -> None:
+    """Cria a fila e os workers (chamado no startup da aplicação)."""
+    global _fila
+    if _fila is not None:
+        return
+    _fila = asyncio.Queue(maxsize=tamanho_fila or settings.REPORT_QUEUE_MAX)
+    for _ in range(workers or settings.REPORT_WORKERS):
+        _workers.append(asyncio.create_task(_worker()))
+
+
+async def parar() -> None:
+    global _fila
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _fila = None
+
+
+def status_fila() -> dict[str, Any]:
+    return {
+        "workers": len(_workers),
+        "na_fila": _fila.qsize() if _fila is not None else 0,
+        "capacidade": _fila.maxsize if _fila is not None else 0,
+        "jobs": len(_jobs),
+    }
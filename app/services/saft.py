@@ -0,0 +1,343 @@
+"""Exportação fiscal em XML no formato do SAF-T (Header, MasterFiles, SalesInvoices).
+
+O XML é escrito incrementalmente com `XMLGenerator` num buffer pequeno, esvaziado
+a cada lote de linhas lidas de um cursor do servidor; nenhum DOM é montado em
+memória, então um ano inteiro do maior tenant sai com memória constante.
+
+Aproximação do SAF-T: as vendas não têm numeração sequencial nem hash de
+certificação, então InvoiceNo usa o id da venda e Hash fica "0".
+"""
+from datetime import date, datetime
+from io import StringIO
+from typing import AsyncIterator, Optional
+from xml.sax.saxutils import XMLGenerator
+import uuid
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import distinct, func, select
+
+from app.db.models import Cliente, ItemVenda, Produto, Venda
+from app.db.session import async_session
+from app.services.empresa import PerfilEmpresa, obter_perfil
+from app.services.estoque import quantidade_item
+from app.services.exportacao import LINHAS_POR_LOTE, esvaziar_buffer
+
+
+SAFT_NAMESPACE = "urn:OECD:StandardAuditFile-Tax:PT_1.04_01"
+AUDIT_FILE_VERSION = "1.04_01"
+MOEDA = "MZN"
+PAIS = "MZ"
+CONSUMIDOR_FINAL_ID = "CF"
+CONSUMIDOR_FINAL_NIF = "999999999"
+MOTIVO_ISENCAO = "Isento nos termos do Código do IVA"
+
+# Base tributável de uma linha: base_iva gravado na venda ou, para vendas antigas
+# sem os campos de IVA, subtotal menos o imposto
+_BASE_LINHA = func.coalesce(
+    func.nullif(ItemVenda.base_iva, 0.0),
+    ItemVenda.subtotal - func.coalesce(ItemVenda.valor_iva, 0.0),
+)
+
+
+def _valor(v, casas: int = 2) -> str:
+    return f"{float(v or 0):.{casas}f}"
+
+
+def _codigo_taxa(taxa, codigo_imposto) -> str:
+    if codigo_imposto:
+        return codigo_imposto
+    return "ISE" if float(taxa or 0) == 0 else "NOR"
+
+
+def _base_linha(base_iva, subtotal, valor_iva) -> float:
+    base = float(base_iva or 0)
+    return base if base else float(subtotal or 0) - float(valor_iva or 0)
+
+
+class _Escritor:
+    """Atalhos sobre XMLGenerator para elementos simples e blocos aninhados."""
+
+    def __init__(self, buffer: StringIO) -> None:
+        self.xml = XMLGenerator(buffer, encoding="utf-8", short_empty_elements=True)
+
+    def abrir(self, nome: str, atributos: Optional[dict] = None) -> None:
+        self.xml.startElement(nome, atributos or {})
+
+    def fechar(self, nome: str) -> None:
+        self.xml.endElement(nome)
+
+    def campo(self, nome: str, valor) -> None:
+        self.xml.startElement(nome, {})
+        if valor is not None:
+            self.xml.characters(str(valor))
+        self.xml.endElement(nome)
+
+
+def _filtro_vendas(tenant_id: uuid.UUID, d1: datetime, d2_exclusive: datetime) -> list:
+    return [
+        Venda.tenant_id == tenant_id,
+        Venda.created_at >= d1,
+        Venda.created_at < d2_exclusive,
+        Venda.cancelada == False,
+    ]
+
+
+def _escrever_header(w: _Escritor, empresa: Optional[PerfilEmpresa], d1: datetime, d2_exclusive: datetime) -> None:
+    fim = date.fromordinal(d2_exclusive.date().toordinal() - 1)
+    nuit = (empresa.nuit if empresa else None) or CONSUMIDOR_FINAL_NIF
+    w.abrir("Header")
+    w.campo("AuditFileVersion", AUDIT_FILE_VERSION)
+    w.campo("CompanyID", nuit)
+    w.campo("TaxRegistrationNumber", nuit)
+    w.campo("TaxAccountingBasis", "F")
+    w.campo("CompanyName", (empresa.nome if empresa else None) or "Desconhecido")
+    w.abrir("CompanyAddress")
+    w.campo("AddressDetail", (empresa.endereco if empresa else None) or "Desconhecido")
+    w.campo("City", "Desconhecido")
+    w.campo("Country", PAIS)
+    w.fechar("CompanyAddress")
+    w.campo("FiscalYear", d1.year)
+    w.campo("StartDate", d1.date().isoformat())
+    w.campo("EndDate", fim.isoformat())
+    w.campo("CurrencyCode", MOEDA)
+    w.campo("DateCreated", date.today().isoformat())
+    w.campo("TaxEntity", "Global")
+    w.campo("ProductCompanyTaxID", nuit)
+    w.campo("SoftwareCertificateNumber", "0")
+    w.campo("ProductID", "PDV3/Backend")
+    w.campo("ProductVersion", "1.0")
+    if empresa and empresa.telefone:
+        w.campo("Telephone", empresa.telefone)
+    if empresa and empresa.email:
+        w.campo("Email", empresa.email)
+    w.fechar("Header")
+
+
+def _escrever_cliente(w: _Escritor, cliente_id: str, nif: str, nome: str, endereco: Optional[str], telefone: Optional[str]) -> None:
+    w.abrir("Customer")
+    w.campo("CustomerID", cliente_id)
+    w.campo("AccountID", "Desconhecido")
+    w.campo("CustomerTaxID", nif)
+    w.campo("CompanyName", nome)
+    w.abrir("BillingAddress")
+    w.campo("AddressDetail", endereco or "Desconhecido")
+    w.campo("City", "Desconhecido")
+    w.campo("Country", PAIS)
+    w.fechar("BillingAddress")
+    if telefone:
+        w.campo("Telephone", telefone)
+    w.campo("SelfBillingIndicator", "0")
+    w.fechar("Customer")
+
+
+def _escrever_totais_documento(w: _Escritor, liquido: float, imposto: float, desconto: float) -> None:
+    w.abrir("DocumentTotals")
+    w.campo("TaxPayable", _valor(imposto))
+    w.campo("NetTotal", _valor(liquido))
+    w.campo("GrossTotal", _valor(liquido + imposto))
+    if desconto > 0:
+        w.abrir("Settlement")
+        w.campo("SettlementAmount", _valor(desconto))
+        w.fechar("Settlement")
+    w.fechar("DocumentTotals")
+
+
+async def gerar_saft(
+    tenant_id: uuid.UUID,
+    d1: datetime,
+    d2_exclusive: datetime,
+    linhas_por_lote: int = LINHAS_POR_LOTE,
+) -> AsyncIterator[bytes]:
+    """Gera o XML em chunks de bytes (um por seção/lote de linhas)."""
+    buffer = StringIO()
+    w = _Escritor(buffer)
+    filtro = _filtro_vendas(tenant_id, d1, d2_exclusive)
+    lote = {"yield_per": linhas_por_lote}
+
+    async with async_session() as session:
+        empresa = await obter_perfil(session, tenant_id)
+        n_docs, total_liquido = (
+            await session.execute(
+                select(func.count(distinct(Venda.id)), func.coalesce(func.sum(_BASE_LINHA), 0.0))
+                .select_from(ItemVenda)
+                .join(Venda, ItemVenda.venda_id == Venda.id)
+                .where(*filtro)
+            )
+        ).one()
+
+        w.xml.startDocument()
+        w.abrir("AuditFile", {"xmlns": SAFT_NAMESPACE})
+        _escrever_header(w, empresa, d1, d2_exclusive)
+        w.abrir("MasterFiles")
+        _escrever_cliente(w, CONSUMIDOR_FINAL_ID, CONSUMIDOR_FINAL_NIF, "Consumidor final", None, None)
+        yield esvaziar_buffer(buffer)
+
+        # Clientes com venda no período
+        clientes = await session.stream(
+            select(Cliente.id, Cliente.documento, Cliente.nome, Cliente.endereco, Cliente.telefone)
+            .where(Cliente.id.in_(select(Venda.cliente_id).where(*filtro, Venda.cliente_id != None)))
+            .order_by(Cliente.id)
+            .execution_options(**lote)
+        )
+        async for linhas in clientes.partitions():
+            for c in linhas:
+                _escrever_cliente(w, str(c.id), c.documento or CONSUMIDOR_FINAL_NIF, c.nome, c.endereco, c.telefone)
+            yield esvaziar_buffer(buffer)
+
+        # Produtos vendidos no período
+        produtos = await session.stream(
+            select(Produto.id, Produto.codigo, Produto.nome, Produto.categoria_id)
+            .where(
+                Produto.id.in_(
+                    select(ItemVenda.produto_id).join(Venda, ItemVenda.venda_id == Venda.id).where(*filtro)
+                )
+            )
+            .order_by(Produto.codigo)
+            .execution_options(**lote)
+        )
+        async for linhas in produtos.partitions():
+            for p in linhas:
+                w.abrir("Product")
+                w.campo("ProductType", "P")
+                w.campo("ProductCode", p.codigo)
+                if p.categoria_id is not None:
+                    w.campo("ProductGroup", p.categoria_id)
+                w.campo("ProductDescription", p.nome)
+                w.campo("ProductNumberCode", p.codigo)
+                w.fechar("Product")
+            yield esvaziar_buffer(buffer)
+
+        # Tabela de impostos: taxas distintas efetivamente usadas
+        taxas = (
+            await session.execute(
+                select(
+                    func.coalesce(ItemVenda.taxa_iva, 0.0).label("taxa"),
+                    func.coalesce(ItemVenda.codigo_imposto, "").label("codigo"),
+                )
+                .join(Venda, ItemVenda.venda_id == Venda.id)
+                .where(*filtro)
+                .distinct()
+                .order_by("taxa", "codigo")
+            )
+        ).all()
+        w.abrir("TaxTable")
+        for t in taxas:
+            w.abrir("TaxTableEntry")
+            w.campo("TaxType", "IVA")
+            w.campo("TaxCountryRegion", PAIS)
+            w.campo("TaxCode", _codigo_taxa(t.taxa, t.codigo))
+            w.campo("Description", f"IVA {float(t.taxa):g}%")
+            w.campo("TaxPercentage", _valor(t.taxa))
+            w.fechar("TaxTableEntry")
+        w.fechar("TaxTable")
+        w.fechar("MasterFiles")
+
+        w.abrir("SourceDocuments")
+        w.abrir("SalesInvoices")
+        w.campo("NumberOfEntries", n_docs)
+        w.campo("TotalDebit", _valor(0))
+        w.campo("TotalCredit", _valor(total_liquido))
+        yield esvaziar_buffer(buffer)
+
+        # Faturas: uma linha por item, ordenadas por venda; o documento fecha
+        # quando o venda_id muda
+        itens = await session.stream(
+            select(
+                Venda.id.label("venda_id"),
+                Venda.created_at,
+                Venda.cliente_id,
+                Venda.desconto,
+                Produto.codigo.label("produto_codigo"),
+                Produto.nome.label("produto_nome"),
+                Produto.unidade_medida,
+                ItemVenda.produto_id,
+                ItemVenda.quantidade,
+                ItemVenda.peso_kg,
+                ItemVenda.preco_unitario,
+                ItemVenda.subtotal,
+                ItemVenda.taxa_iva,
+                ItemVenda.base_iva,
+                ItemVenda.valor_iva,
+                ItemVenda.codigo_imposto,
+            )
+            .select_from(ItemVenda)
+            .join(Venda, ItemVenda.venda_id == Venda.id)
+            .outerjoin(Produto, ItemVenda.produto_id == Produto.id)
+            .where(*filtro)
+            .order_by(Venda.created_at, Venda.id, ItemVenda.id)
+            .execution_options(**lote)
+        )
+        atual = None
+        n_linha = 0
+        liquido = imposto = desconto = 0.0
+        async for linhas in itens.partitions():
+            for r in linhas:
+                if r.venda_id != atual:
+                    if atual is not None:
+                        _escrever_totais_documento(w, liquido, imposto, desconto)
+                        w.fechar("Invoice")
+                    atual = r.venda_id
+                    n_linha = 0
+                    liquido = imposto = 0.0
+                    desconto = float(r.desconto or 0)
+                    w.abrir("Invoice")
+                    w.campo("InvoiceNo", f"FT {r.venda_id}")
+                    w.abrir("DocumentStatus")
+                    w.campo("InvoiceStatus", "N")
+                    w.campo("InvoiceStatusDate", r.created_at.strftime("%Y-%m-%dT%H:%M:%S"))
+                    w.campo("SourceBilling", "P")
+                    w.fechar("DocumentStatus")
+                    w.campo("Hash", "0")
+                    w.campo("InvoiceDate", r.created_at.date().isoformat())
+                    w.campo("InvoiceType", "FT")
+                    w.campo("SystemEntryDate", r.created_at.strftime("%Y-%m-%dT%H:%M:%S"))
+                    w.campo("CustomerID", str(r.cliente_id) if r.cliente_id else CONSUMIDOR_FINAL_ID)
+
+                n_linha += 1
+                quantidade = quantidade_item(r.quantidade, r.peso_kg)
+                base = _base_linha(r.base_iva, r.subtotal, r.valor_iva)
+                valor_iva = float(r.valor_iva or 0)
+                liquido += base
+                imposto += valor_iva
+                taxa = float(r.taxa_iva or 0)
+
+                w.abrir("Line")
+                w.campo("LineNumber", n_linha)
+                w.campo("ProductCode", r.produto_codigo or str(r.produto_id))
+                w.campo("ProductDescription", r.produto_nome or str(r.produto_id))
+                w.campo("Quantity", _valor(quantidade, 3))
+                w.campo("UnitOfMeasure", r.unidade_medida or "un")
+                w.campo("UnitPrice", _valor(base / quantidade if quantidade else base, 4))
+                w.campo("TaxPointDate", r.created_at.date().isoformat())
+                w.campo("Description", r.produto_nome or str(r.produto_id))
+                w.campo("CreditAmount", _valor(base))
+                w.abrir("Tax")
+                w.campo("TaxType", "IVA")
+                w.campo("TaxCountryRegion", PAIS)
+                w.campo("TaxCode", _codigo_taxa(taxa, r.codigo_imposto))
+                w.campo("TaxPercentage", _valor(taxa))
+                w.fechar("Tax")
+                if taxa == 0:
+                    w.campo("TaxExemptionReason", MOTIVO_ISENCAO)
+                w.fechar("Line")
+            yield esvaziar_buffer(buffer)
+
+        if atual is not None:
+            _escrever_totais_documento(w, liquido, imposto, desconto)
+            w.fechar("Invoice")
+        w.fechar("SalesInvoices")
+        w.fechar("SourceDocuments")
+        w.fechar("AuditFile")
+        w.xml.endDocument()
+        yield esvaziar_buffer(buffer)
+
+
+def resposta_saft(tenant_id: uuid.UUID, d1: datetime, d2_exclusive: datetime, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        gerar_saft(tenant_id, d1, d2_exclusive),
+        media_type="application/xml",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}",
+            "Cache-Control": "no-cache",
+        },
+    )
@@ -0,0 +1,201 @@
+"""Saldo de dívidas por cliente (pdv.saldos_cliente) e aging das dívidas em aberto.
+
+O saldo é recalculado a partir das dívidas do cliente na mesma transação que
+as altera (criação, sync, pagamento):
+    atualizar_saldos(db, tenant_id, [cliente_id, ...])
+Cada chamada é um INSERT ... SELECT ... GROUP BY ... ON CONFLICT DO UPDATE.
+Antes dele um advisory lock por cliente (até o fim da transação) garante que
+duas transações no mesmo cliente não gravem saldos calculados sobre fotos
+diferentes das dívidas: a segunda só agrega depois do commit da primeira.
+"""
+from datetime import date
+from typing import Iterable, Optional
+import uuid
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+# Faixas do aging em dias desde data_divida: (rótulo, mínimo, máximo)
+FAIXAS_AGING = (
+    ("0_30", 0, 30),
+    ("31_60", 31, 60),
+    ("61_90", 61, 90),
+    ("90_mais", 91, None),
+)
+
+_UPSERT_SALDOS = """
+    INSERT INTO pdv.saldos_cliente (id, tenant_id, cliente_id, total_divida, total_pago, saldo, qtd_abertas, aberta_desde)
+    SELECT gen_random_uuid(), d.tenant_id, d.cliente_id,
+           SUM(COALESCE(d.valor_total, 0)),
+           SUM(COALESCE(d.valor_pago, 0)),
+           COALESCE(SUM(GREATEST(COALESCE(d.valor_total, 0) - COALESCE(d.valor_pago, 0), 0)) FILTER (WHERE d.status <> 'Quitado'), 0),
+           COUNT(*) FILTER (WHERE d.status <> 'Quitado'),
+           MIN(d.data_divida) FILTER (WHERE d.status <> 'Quitado')
+    FROM pdv.dividas d
+    WHERE d.cliente_id IS NOT NULL
+      AND d.tenant_id IS NOT NULL
+      {filtro}
+    GROUP BY d.tenant_id, d.cliente_id
+    ON CONFLICT (tenant_id, cliente_id) DO UPDATE SET
+        total_divida = EXCLUDED.total_divida,
+        total_pago = EXCLUDED.total_pago,
+        saldo = EXCLUDED.saldo,
+        qtd_abertas = EXCLUDED.qtd_abertas,
+        aberta_desde = EXCLUDED.aberta_desde,
+        updated_at = now()
+"""
+
+
+async def atualizar_saldos(db: AsyncSession, tenant_id: uuid.UUID, cliente_ids: Iterable[Optional[uuid.UUID]]) -> None:
+    """Recalcula o saldo dos clientes informados (ignora None). Não faz commit."""
+    clientes = sorted({c for c in cliente_ids if c is not None})
+    if not clientes:
+        return
+    # Locks sempre na mesma ordem (ids ordenados) para não haver deadlock entre lotes
+    await db.execute(
+        text("SELECT pg_advisory_xact_lock(hashtext('saldo_cliente:' || c::text)) FROM unnest(CAST(:clientes AS uuid[])) AS c ORDER BY c"),
+        {"clientes": clientes},
+    )
+    await db.execute(
+        text(_UPSERT_SALDOS.format(filtro="AND d.tenant_id = :tenant_id AND d.cliente_id = ANY(CAST(:clientes AS uuid[]))")),
+        {"tenant_id": tenant_id, "clientes": clientes},
+    )
+
+
+async def reconstruir_saldos(db: AsyncSession, tenant_id: Optional[uuid.UUID] = None) -> None:
+    """Recria os saldos a partir das dívidas (backfill inicial ou correção)."""
+    params: dict = {}
+    filtro = ""
+    if tenant_id is not None:
+        await db.execute(text("DELETE FROM pdv.saldos_cliente WHERE tenant_id = :tenant_id"), {"tenant_id": tenant_id})
+        filtro = "AND d.tenant_id = :tenant_id"
+        params["tenant_id"] = tenant_id
+    else:
+        await db.execute(text("DELETE FROM pdv.saldos_cliente"))
+    await db.execute(text(_UPSERT_SALDOS.format(filtro=filtro)), params)
+
+
+async def garantir_saldos(db: AsyncSession) -> None:
+    """Backfill na primeira execução: tabela vazia com dívidas de clientes existentes."""
+    vazio = await db.scalar(text(
+        "SELECT NOT EXISTS (SELECT 1 FROM pdv.saldos_cliente) "
+        "AND EXISTS (SELECT 1 FROM pdv.dividas WHERE cliente_id IS NOT NULL)"
+    ))
+    if vazio:
+        await reconstruir_saldos(db)
+
+
+async def listar_saldos(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    apenas_em_aberto: bool = True,
+    limite: int = 100,
+    offset: int = 0,
+) -> list[dict]:
+    """Saldos por cliente (maior saldo primeiro), com o nome do cliente."""
+    filtro = "AND s.saldo > 0" if apenas_em_aberto else ""
+    rows = (await db.execute(
+        text(f"""
+            SELECT s.cliente_id, c.nome AS cliente_nome, c.telefone, s.total_divida, s.total_pago,
+                   s.saldo, s.qtd_abertas, s.aberta_desde
+            FROM pdv.saldos_cliente s
+            LEFT JOIN pdv.clientes c ON c.id = s.cliente_id
+            WHERE s.tenant_id = :tenant_id {filtro}
+            ORDER BY s.saldo DESC, s.cliente_id
+            LIMIT :limite OFFSET :offset
+        """),
+        {"tenant_id": tenant_id, "limite": limite, "offset": offset},
+    )).mappings().all()
+    return [
+        {
+            "cliente_id": str(r["cliente_id"]),
+            "cliente_nome": r["cliente_nome"],
+            "telefone": r["telefone"],
+            "total_divida": float(r["total_divida"] or 0),
+            "total_pago": float(r["total_pago"] or 0),
+            "saldo": float(r["saldo"] or 0),
+            "qtd_abertas": int(r["qtd_abertas"] or 0),
+            "aberta_desde": r["aberta_desde"].isoformat() if r["aberta_desde"] else None,
+        }
+        for r in rows
+    ]
+
+
+def _colunas_faixas() -> str:
+    colunas = []
+    for rotulo, minimo, maximo in FAIXAS_AGING:
+        cond = f"idade >= {minimo}" + (f" AND idade <= {maximo}" if maximo is not None else "")
+        colunas.append(f"COALESCE(SUM(aberto) FILTER (WHERE {cond}), 0) AS faixa_{rotulo}")
+    return ",\n                   ".join(colunas)
+
+
+async def aging(
+    db: AsyncSession,
+    tenant_id: uuid.UUID,
+    data_referencia: Optional[date] = None,
+    limite: int = 100,
+) -> dict:
+    """Valores em aberto por faixa de atraso (0–30, 31–60, 61–90, 90+ dias).
+
+    Uma consulta: agrega as dívidas em aberto por cliente e faixa; os totais
+    gerais vêm da mesma consulta (janela sobre os clientes, antes do LIMIT).
+    """
+    referencia = data_referencia or date.today()
+    faixas = _colunas_faixas()
+    totais = ",\n                   ".join(
+        f"SUM(faixa_{rotulo}) OVER () AS total_{rotulo}" for rotulo, _, _ in FAIXAS_AGING
+    )
+    rows = (await db.execute(
+        text(f"""
+            WITH abertas AS (
+                SELECT d.cliente_id,
+                       GREATEST(COALESCE(d.valor_total, 0) - COALESCE(d.valor_pago, 0), 0) AS aberto,
+                       CAST(:referencia AS date) - CAST(d.data_divida AS date) AS idade
+                FROM pdv.dividas d
+                WHERE d.tenant_id = :tenant_id
+                  AND d.status <> 'Quitado'
+                  AND CAST(d.data_divida AS date) <= CAST(:referencia AS date)
+            ), por_cliente AS (
+                SELECT cliente_id,
+                       SUM(aberto) AS saldo,
+                       COUNT(*) AS qtd_abertas,
+                       {faixas}
+                FROM abertas
+                GROUP BY cliente_id
+            )
+            SELECT p.*, c.nome AS cliente_nome,
+                   COUNT(*) OVER () AS total_clientes,
+                   SUM(p.saldo) OVER () AS total_saldo,
+                   {totais}
+            FROM por_cliente p
+            LEFT JOIN pdv.clientes c ON c.id = p.cliente_id
+            ORDER BY p.saldo DESC, p.cliente_id
+            LIMIT :limite
+        """),
+        {"tenant_id": tenant_id, "referencia": referencia, "limite": limite},
+    )).mappings().all()
+
+    resumo = {rotulo: 0.0 for rotulo, _, _ in FAIXAS_AGING}
+    total_saldo = 0.0
+    total_clientes = 0
+    clientes = []
+    for r in rows:
+        if not clientes:
+            resumo = {rotulo: float(r[f"total_{rotulo}"] or 0) for rotulo, _, _ in FAIXAS_AGING}
+            total_saldo = float(r["total_saldo"] or 0)
+            total_clientes = int(r["total_clientes"] or 0)
+        clientes.append({
+            "cliente_id": str(r["cliente_id"]) if r["cliente_id"] else None,
+            "cliente_nome": r["cliente_nome"],
+            "saldo": float(r["saldo"] or 0),
+            "qtd_abertas": int(r["qtd_abertas"] or 0),
+            "faixas": {rotulo: float(r[f"faixa_{rotulo}"] or 0) for rotulo, _, _ in FAIXAS_AGING},
+        })
+    return {
+        "data_referencia": referencia.isoformat(),
+        "total": total_saldo,
+        "total_clientes": total_clientes,
+        "faixas": resumo,
+        "clientes": clientes,
+    }
@@ -0,0 +1,165 @@
+"""Sync incremental (delta) das entidades: pull por cursor e push em lote.
+
+Pull: lê o change-log (pdv.alteracoes, ver app/services/alteracoes.py) depois
+do cursor (transacao, versao), só de transações já encerradas, e devolve o
+estado atual dos registros alterados. Excluídos e desativados (ativo = false)
+saem como removidos.
+
+Push: INSERT ... ON CONFLICT (id) DO UPDATE em lotes, com last-write-wins: o
+registro do servidor só é sobrescrito se não mudou depois da edição feita no
+dispositivo (updated_at enviado). O updated_at gravado é sempre o do servidor.
+"""
+from datetime import datetime, timezone
+from typing import Optional
+import uuid
+
+from sqlalchemy import func, literal_column, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.paginacao import codificar_cursor, decodificar_cursor
+from app.db.models import Alteracao
+
+
+# Linhas por INSERT do push (limite de parâmetros do Postgres)
+LINHAS_POR_INSERT = 1000
+
+
+def parse_instante(valor) -> Optional[datetime]:
+    """updated_at enviado pelo dispositivo (ISO 8601); None se ausente ou inválido."""
+    if not valor:
+        return None
+    try:
+        instante = datetime.fromisoformat(str(valor).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return instante if instante.tzinfo else instante.replace(tzinfo=timezone.utc)
+
+
+async def pull(
+    db: AsyncSession,
+    modelo,
+    entidade: str,
+    tenant_id: uuid.UUID,
+    cursor: Optional[str],
+    limite: int,
+) -> dict:
+    """Próxima página de alterações: {"registros", "removidos", "next_cursor", "has_more"}.
+
+    Lança ValueError para cursor inválido.
+    """
+    stmt = select(Alteracao.registro_id, Alteracao.operacao, Alteracao.transacao, Alteracao.versao).where(
+        Alteracao.tenant_id == tenant_id,
+        Alteracao.entidade == entidade,
+        # Só transações encerradas: nada novo pode aparecer abaixo do xmin do snapshot
+        Alteracao.transacao < func.txid_snapshot_xmin(func.txid_current_snapshot()),
+    )
+    if cursor:
+        try:
+            transacao, versao = (int(v) for v in decodificar_cursor(cursor, 2))
+        except (ValueError, TypeError):
+            raise ValueError("Cursor inválido")
+        stmt = stmt.where(tuple_(Alteracao.transacao, Alteracao.versao) > tuple_(transacao, versao))
+    # Uma linha a mais indica se há próxima página
+    linhas = (await db.execute(
+        stmt.order_by(Alteracao.transacao, Alteracao.versao).limit(limite + 1)
+    )).all()
+    has_more = len(linhas) > limite
+    linhas = linhas[:limite]
+
+    # Vale a última alteração de cada registro na página
+    ultima_op = {}
+    for l in linhas:
+        ultima_op.pop(l.registro_id, None)
+        ultima_op[l.registro_id] = l.operacao
+    ids = [i for i, op in ultima_op.items() if op != "delete"]
+    por_id = {}
+    if ids:
+        por_id = {r.id: r for r in (await db.execute(
+            select(modelo).where(modelo.id.in_(ids), modelo.tenant_id == tenant_id)
+        )).scalars()}
+
+    registros, removidos = [], []
+    for registro_id in ultima_op:
+        registro = por_id.get(registro_id)
+        if registro is None or not getattr(registro, "ativo", True):
+            removidos.append(str(registro_id))
+        else:
+            registros.append(registro)
+
+    ultimo = linhas[-1] if linhas else None
+    return {
+        "registros": registros,
+        "removidos": removidos,
+        "next_cursor": codificar_cursor(ultimo.transacao, ultimo.versao) if ultimo else cursor,
+        "has_more": has_more,
+    }
+
+
+async def _upsert(db: AsyncSession, modelo, linhas: list[dict], campos: list[str]) -> list:
+    """Um INSERT ... ON CONFLICT com last-write-wins; devolve (id, inserido) das linhas gravadas."""
+    stmt = pg_insert(modelo).values(linhas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[modelo.id],
+        set_={**{c: stmt.excluded[c] for c in campos}, "updated_at": func.now()},
+        where=(modelo.tenant_id == stmt.excluded.tenant_id) & (modelo.updated_at <= stmt.excluded.updated_at),
+    ).returning(modelo.id, literal_column("(xmax = 0)").label("inserido"))
+    return (await db.execute(stmt)).all()
+
+
+async def upsert_lww(
+    db: AsyncSession,
+    modelo,
+    tenant_id: uuid.UUID,
+    registros: list[dict],
+    campos: list[str],
+) -> dict:
+    """Aplica o push em lotes. Não faz commit.
+
+    Cada registro traz "id", os `campos` e "updated_at" (do dispositivo; None =
+    agora). Se um lote falhar (ex.: unicidade), o lote é refeito registro a
+    registro em savepoints e só os que falharem vão para "erros".
+    Devolve {"aplicados": [...], "ignorados": [...], "erros": [...]}; ignorados
+    são os registros mais antigos que a versão do servidor ou de outro tenant.
+    """
+    # O mesmo id duas vezes no lote faria o ON CONFLICT falhar: vale o último
+    registros = list({r["id"]: r for r in registros}.values())
+    agora = datetime.now(timezone.utc)
+    aplicados, inseridos, erros = [], [], []
+    for i in range(0, len(registros), LINHAS_POR_INSERT):
+        lote = [
+            {
+                "id": r["id"],
+                "tenant_id": tenant_id,
+                **{c: r.get(c) for c in campos},
+                "updated_at": r.get("updated_at") or agora,
+            }
+            for r in registros[i:i + LINHAS_POR_INSERT]
+        ]
+        try:
+            async with db.begin_nested():
+                gravados = await _upsert(db, modelo, lote, campos)
+        except Exception:
+            gravados = []
+            for linha in lote:
+                try:
+                    async with db.begin_nested():
+                        gravados += await _upsert(db, modelo, [linha], campos)
+                except Exception as e:
+                    erros.append({"id": str(linha["id"]), "error": str(getattr(e, "orig", e))})
+        aplicados += [g.id for g in gravados]
+        inseridos += [g.id for g in gravados if g.inserido]
+
+    # Inseridos ficaram com o updated_at do dispositivo: o cursor do pull usa o do servidor
+    for i in range(0, len(inseridos), LINHAS_POR_INSERT):
+        await db.execute(
+            update(modelo).where(modelo.id.in_(inseridos[i:i + LINHAS_POR_INSERT])).values(updated_at=func.now())
+        )
+
+    com_erro = {e["id"] for e in erros}
+    gravados_ids = set(aplicados)
+    return {
+        "aplicados": [str(a) for a in aplicados],
+        "ignorados": [str(r["id"]) for r in registros if r["id"] not in gravados_ids and str(r["id"]) not in com_erro],
+        "erros": erros,
+    }
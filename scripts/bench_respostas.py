@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Benchmark da camada de resposta (serialização JSON + compressão).
+
+Duas partes:
+  1) Offline: gera N vendas/produtos sintéticos no formato de VendaResponse /
+     ProdutoResponse e compara json.dumps vs orjson, e o tamanho bruto vs
+     gzip vs brotli. Não precisa de servidor nem banco.
+  2) HTTP (opcional, se BACKEND_URL estiver definido): mede latência e bytes
+     transferidos em /api/vendas/ e /api/produtos/ com Accept-Encoding
+     identity, gzip e br.
+
+Uso:
+  python scripts/bench_respostas.py [--n 5000] [--repeticoes 5]
+"""
+import argparse
+import gzip
+import json
+import os
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def gerar_vendas(n: int) -> list[dict]:
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    produtos = [str(uuid.uuid4()) for _ in range(200)]
+    vendas = []
+    for i in range(n):
+        dt = base + timedelta(minutes=7 * i)
+        itens = []
+        for j in range(1 + i % 4):
+            preco = 25.0 + (i + j) % 50
+            itens.append({
+                "produto_id": produtos[(i * 7 + j) % len(produtos)],
+                "quantidade": 1 + j,
+                "peso_kg": 0.0,
+                "preco_unitario": preco,
+                "subtotal": preco * (1 + j),
+                "id": uuid.uuid4(),
+                "venda_id": None,
+                "created_at": dt,
+                "updated_at": dt,
+            })
+        venda_id = uuid.uuid4()
+        for it in itens:
+            it["venda_id"] = venda_id
+        vendas.append({
+            "usuario_id": uuid.UUID(int=i % 5),
+            "cliente_id": None,
+            "total": sum(it["subtotal"] for it in itens),
+            "desconto": 0.0,
+            "forma_pagamento": "Dinheiro" if i % 3 else "M-Pesa",
+            "observacoes": None,
+            "id": venda_id,
+            "usuario_nome": f"Vendedor {i % 5}",
+            "cancelada": False,
+            "created_at": dt,
+            "updated_at": dt,
+            "itens": itens,
+        })
+    return vendas
+
+
+def gerar_produtos(n: int) -> list[dict]:
+    agora = datetime(2025, 1, 1, 8, 0, 0)
+    return [
+        {
+            "id": uuid.uuid4(),
+            "codigo": f"P{i:06d}",
+            "nome": f"Produto de teste {i}",
+            "descricao": "",
+            "preco_custo": 10.0 + i % 30,
+            "preco_venda": 15.0 + i % 30,
+            "estoque": float(i % 120),
+            "estoque_minimo": 5.0,
+            "categoria_id": 1 + i % 11,
+            "venda_por_peso": False,
+            "unidade_medida": "un",
+            "taxa_iva": 16.0,
+            "ativo": True,
+            "imagem_path": None,
+            "created_at": agora,
+            "updated_at": agora,
+        }
+        for i in range(n)
+    ]
+
+
+def _json_padrao(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+
+
+def _orjson(payload) -> bytes:
+    return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+
+
+def medir(fn, payload, repeticoes: int) -> tuple[float, bytes]:
+    tempos = []
+    out = b""
+    for _ in range(repeticoes):
+        t0 = time.perf_counter()
+        out = fn(payload)
+        tempos.append(time.perf_counter() - t0)
+    return statistics.median(tempos) * 1000, out
+
+
+def bench_offline(nome: str, payload, repeticoes: int) -> None:
+    print(f"\n== {nome} ({len(payload)} registros) ==")
+    ms_json, corpo = medir(_json_padrao, payload, repeticoes)
+    print(f"json.dumps   : {ms_json:8.1f} ms  {len(corpo):>10} bytes")
+    if orjson is not None:
+        ms_or, corpo = medir(_orjson, payload, repeticoes)
+        print(f"orjson.dumps : {ms_or:8.1f} ms  {len(corpo):>10} bytes  ({ms_json / ms_or:.1f}x)")
+    else:
+        print("orjson não instalado")
+
+    t0 = time.perf_counter()
+    gz = gzip.compress(corpo, compresslevel=6)
+    print(f"gzip (6)     : {(time.perf_counter() - t0) * 1000:8.1f} ms  {len(gz):>10} bytes  ({len(corpo) / len(gz):.1f}x menor)")
+    if brotli is not None:
+        t0 = time.perf_counter()
+        br = brotli.compress(corpo, quality=4)
+        print(f"brotli (q4)  : {(time.perf_counter() - t0) * 1000:8.1f} ms  {len(br):>10} bytes  ({len(corpo) / len(br):.1f}x menor)")
+    else:
+        print("brotli não instalado")
+
+
+def bench_http(base: str, repeticoes: int) -> None:
+    import httpx
+
+    base = base.rstrip("/")
+    for rota in ("/api/vendas/", "/api/produtos/"):
+        print(f"\n== HTTP {rota} ==")
+        for enc in ("identity", "gzip", "br"):
+            tempos = []
+            tamanho = 0
+            with httpx.Client(timeout=60.0) as client:
+                for _ in range(repeticoes):
+                    t0 = time.perf_counter()
+                    with client.stream("GET", base + rota, headers={"Accept-Encoding": enc}) as r:
+                        tamanho = sum(len(c) for c in r.iter_raw())
+                        recebido = r.headers.get("content-encoding", "identity")
+                    tempos.append(time.perf_counter() - t0)
+            print(f"{enc:<9}: {statistics.median(tempos) * 1000:8.1f} ms  {tamanho:>10} bytes (content-encoding={recebido})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=5000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    args = parser.parse_args()
+
+    bench_offline("vendas", gerar_vendas(args.n), args.repeticoes)
+    bench_offline("produtos", gerar_produtos(args.n), args.repeticoes)
+
+    url = os.getenv("BACKEND_URL")
+    if url:
+        bench_http(url, args.repeticoes)
+    else:
+        print("\nBACKEND_URL não definido: parte HTTP ignorada.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Teste de concorrência dos pagamentos de dívida (POST /api/dividas/{id}/pagamentos).
+
+- Cria uma dívida de teste (1 item do primeiro produto ativo) com valor N * V
+- Dispara N pagamentos de valor V em paralelo
+- Envia o mesmo lote de pagamentos de novo por /api/dividas/pagamentos/lote
+  (mesmos ids: não pode somar outra vez)
+- Verifica:
+  * valor_pago final == N * V e status "Quitado";
+  * os valor_pago devolvidos são exatamente V, 2V, ..., NV (cada pagamento viu
+    o anterior; com leitura+escrita em Python apareceriam repetidos).
+
+Uso:
+  python scripts/concorrencia_pagamentos.py [--n 300] [--valor 10] [--concorrencia 100]
+
+Pré-requisitos:
+  - backend rodando; BACKEND_URL (ex.: http://localhost:8000) e, se houver
+    mais de um tenant, TENANT_ID no ambiente.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+import httpx
+
+
+def api_base() -> str:
+    base = (os.getenv("BACKEND_URL") or "http://localhost:8000").rstrip("/")
+    if base.endswith("/api"):
+        base = base[:-4]
+    return base + "/api"
+
+
+async def primeiro_produto(client: httpx.AsyncClient) -> dict:
+    r = await client.get("/produtos/")
+    r.raise_for_status()
+    produtos = [p for p in r.json() if p.get("ativo", True)]
+    if not produtos:
+        sys.exit("Nenhum produto ativo no servidor para montar a dívida de teste.")
+    return produtos[0]
+
+
+async def criar_divida(client: httpx.AsyncClient, produto: dict, valor_total: float) -> str:
+    r = await client.post("/dividas/", json={
+        "observacao": "teste de concorrência de pagamentos",
+        "itens": [{
+            "produto_id": produto["id"],
+            "quantidade": 1,
+            "preco_unitario": valor_total,
+            "subtotal": valor_total,
+        }],
+    })
+    r.raise_for_status()
+    return r.json()["id"]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=300)
+    parser.add_argument("--valor", type=float, default=10.0)
+    parser.add_argument("--concorrencia", type=int, default=100)
+    args = parser.parse_args()
+
+    headers = {}
+    if os.getenv("TENANT_ID"):
+        headers["X-Tenant-Id"] = os.environ["TENANT_ID"]
+    limites = httpx.Limits(max_connections=args.concorrencia, max_keepalive_connections=args.concorrencia)
+
+    async with httpx.AsyncClient(base_url=api_base(), headers=headers, limits=limites, timeout=60) as client:
+        produto = await primeiro_produto(client)
+        esperado = round(args.n * args.valor, 2)
+        divida_id = await criar_divida(client, produto, esperado)
+        print(f"Dívida {divida_id} de {esperado:.2f}; {args.n} pagamentos de {args.valor:.2f} em paralelo")
+
+        pagamentos = [
+            {"id": str(uuid.uuid4()), "valor": args.valor, "forma_pagamento": "Dinheiro"}
+            for _ in range(args.n)
+        ]
+        sem = asyncio.Semaphore(args.concorrencia)
+
+        async def pagar(p: dict) -> dict:
+            async with sem:
+                r = await client.post(f"/dividas/{divida_id}/pagamentos", json=p)
+                r.raise_for_status()
+                return r.json()
+
+        t0 = time.perf_counter()
+        respostas = await asyncio.gather(*(pagar(p) for p in pagamentos))
+        dt = time.perf_counter() - t0
+        print(f"{args.n} pagamentos em {dt:.2f}s ({args.n / dt:.0f}/s)")
+
+        vistos = sorted(round(r["valor_pago"], 2) for r in respostas)
+        esperados = [round(args.valor * (i + 1), 2) for i in range(args.n)]
+        final = max(respostas, key=lambda r: r["valor_pago"])
+
+        # Reenvio do mesmo lote (replay offline): nada deve mudar
+        r = await client.post("/dividas/pagamentos/lote", json={
+            "data": [{**p, "divida_id": divida_id} for p in pagamentos],
+        })
+        r.raise_for_status()
+        replay = r.json()
+        apos_replay = max((d["valor_pago"] for d in replay["dividas"]), default=None)
+
+    ok = True
+    if vistos != esperados:
+        repetidos = len(vistos) - len(set(vistos))
+        print(f"FALHA: valores intermediários inconsistentes ({repetidos} repetidos)")
+        ok = False
+    if round(final["valor_pago"], 2) != esperado or final["status"] != "Quitado":
+        print(f"FALHA: valor_pago final {final['valor_pago']:.2f} ({final['status']}), esperado {esperado:.2f} (Quitado)")
+        ok = False
+    if replay["errors"] or apos_replay is None or round(apos_replay, 2) != esperado:
+        print(f"FALHA: replay do lote alterou a dívida ou falhou: {apos_replay} / {replay['errors'][:3]}")
+        ok = False
+    if ok:
+        print(f"OK: valor_pago {esperado:.2f}, status Quitado, replay idempotente")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+"""Lista vendas possivelmente duplicadas (mesma assinatura de conteúdo), em lotes.
+
+Substitui o antigo cleanup_duplicate_vendas.py, que carregava todas as vendas e
+itens em memória e apagava as cópias sem estornar estoque nem rollups. Aqui o
+trabalho é feito no banco (app/services/duplicidade_vendas.py), lote a lote, e
+nada é alterado: vendas iguais com uuids diferentes podem ser vendas repetidas
+de verdade. As que forem cópias são canceladas pelo fluxo normal de cancelamento.
+
+Uso:
+    python scripts/dedupe_vendas.py                # lista as duplicadas
+    python scripts/dedupe_vendas.py --cursor XYZ   # continua de uma execução anterior
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+# Garantir que o pacote `app` seja importável ao executar via `python scripts/...`
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _ROOT not in sys.path:
+    sys.path.insert(0, _ROOT)
+
+from app.db.session import AsyncSessionLocal
+from app.services.duplicidade_vendas import LOTE_DEDUPLICACAO, deduplicar
+
+
+async def executar(cursor: str | None, lote: int) -> None:
+    async with AsyncSessionLocal() as session:
+        resultado = await deduplicar(session, cursor=cursor, lote=lote)
+
+    for venda_id, original in resultado["duplicadas"]:
+        print(f"Duplicada: {venda_id} (original {original})")
+    print(f"Vendas verificadas: {resultado['verificadas']}")
+    print(f"Duplicadas encontradas: {len(resultado['duplicadas'])}")
+    if resultado["cursor"]:
+        print(f"Próxima execução: --cursor {resultado['cursor']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Lista vendas possivelmente duplicadas em lotes")
+    parser.add_argument("--cursor", default=None, help="Continua depois do cursor de uma execução anterior.")
+    parser.add_argument("--lote", type=int, default=LOTE_DEDUPLICACAO, help="Vendas por lote.")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(executar(args.cursor, args.lote))
+    except ValueError as e:
+        print(f"Erro: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())